@@ -0,0 +1,2 @@
+from .cohorts import *
+from .stand_in import *
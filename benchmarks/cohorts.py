@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+
+# Extent (xmin, ymin, xmax, ymax) in the British National Grid of the synthetic postcodes and pollution grids
+EXTENT = (300000, 200000, 500000, 500000)
+
+
+def synthetic_postcode(i):
+    """
+    Unique postcode-like string for a number (outward code 'Z' + letter + number, inward code digit + 2 letters).
+    :param i: number (< 17 million).
+    :return: postcode (str).
+    """
+    outward, inward = divmod(int(i), 6760)
+    digit, letters = divmod(inward, 676)
+    return (f"Z{chr(65 + outward % 26)}{outward // 26 + 1} "
+            f"{digit}{chr(65 + letters // 26)}{chr(65 + letters % 26)}")
+
+
+def synthetic_postcodes(n, extent=EXTENT, seed=0):
+    """
+    Table of synthetic postcodes with random co-ordinates (whole metres) within an extent.
+    :param n: number of postcodes.
+    :param extent: (xmin, ymin, xmax, ymax).
+    :param seed: random seed.
+    :return: DataFrame with postcode, eastings, northings and country columns.
+    """
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'postcode': [synthetic_postcode(i) for i in range(n)],
+        'eastings': rng.integers(extent[0], extent[2], n),
+        'northings': rng.integers(extent[1], extent[3], n),
+        'country': 'England'
+    })
+
+
+def synthetic_cohort(postcodes, n, years=(2008, 2012), invalid_rate=0.01, seed=0):
+    """
+    Input of preprocess_postcode_data.py for a synthetic cohort: participants sampled with replacement from a
+    postcode table (participants share postcodes as in real cohorts), a column of postcodes per year and a
+    fraction of invalid postcodes.
+    :param postcodes: DataFrame from synthetic_postcodes.
+    :param n: number of participants.
+    :param years: years of the postcode columns.
+    :param invalid_rate: fraction of invalid postcodes.
+    :param seed: random seed.
+    :return: DataFrame with ID and Postcodes<year> columns.
+    """
+    rng = np.random.default_rng(seed)
+    data = {'ID': np.arange(n)}
+    for year in years:
+        column = postcodes['postcode'].to_numpy()[rng.integers(0, len(postcodes), n)].astype(object)
+        column[rng.random(n) < invalid_rate] = 'XX1 1XX'
+        data[f'Postcodes{year}'] = column
+    return pd.DataFrame(data)
+
+
+def geocoded_cohort(postcodes, n, years=(2008, 2012), seed=0):
+    """
+    Geocoded data (output of preprocess_postcode_data.py) for a synthetic cohort.
+    :param postcodes: DataFrame from synthetic_postcodes.
+    :param n: number of participants per year.
+    :param years: years of data collection.
+    :param seed: random seed.
+    :return: DataFrame with ID, year, postcode, eastings, northings and country columns.
+    """
+    rng = np.random.default_rng(seed)
+    dfs = []
+    for year in years:
+        df = postcodes.iloc[rng.integers(0, len(postcodes), n)].reset_index(drop=True)
+        df.insert(0, 'year', year)
+        df.insert(0, 'ID', np.arange(n))
+        dfs.append(df)
+    return pd.concat(dfs, ignore_index=True)
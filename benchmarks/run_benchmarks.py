@@ -0,0 +1,181 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+import pandas as pd
+import requests
+import rasterio
+from rasterio.transform import from_origin
+from shapely.geometry import box
+import geopandas
+from tabulate import tabulate
+import geoutils
+import scrapedefra
+from benchmarks.cohorts import EXTENT, synthetic_postcodes, geocoded_cohort
+from benchmarks.stand_in import StandInServer
+
+BENCHMARKS = ['geocode_batch', 'geocode_async', 'grid_codes', 'linking_func', 'spatial_join', 'nearest_roads',
+              'raster_sample']
+
+
+def main():
+    # Initiate parser and add arguments
+    parser = argparse.ArgumentParser(
+        description="Offline benchmarks of geocoding, grid code lookup, pollution linking, spatial joins and "
+                    "raster sampling for synthetic cohorts. postcodes.io and uk-air.defra.gov.uk are replaced by a "
+                    "local stand-in server with configurable latency and error rate."
+    )
+    parser.add_argument("--sizes", "-n", help="Cohort sizes (postcodes) separated by comma.",
+                        default="1000,10000,100000")
+    parser.add_argument("--benchmarks", "-b", help="Benchmarks separated by comma: " + ", ".join(BENCHMARKS) + ".",
+                        default=",".join(BENCHMARKS))
+    parser.add_argument("--latency", help="Delay of each stand-in server response in seconds.", default=0.005)
+    parser.add_argument("--error-rate", help="Fraction of stand-in server responses failing with 503.", default=0)
+    parser.add_argument("--postcodes", help="Number of distinct synthetic postcodes.", default=50000)
+    parser.add_argument("--seed", help="Random seed.", default=0)
+    parser.add_argument("--output", "-o", help="JSON file for the results.")
+
+    # Read arguments from command line
+    args = parser.parse_args()
+
+    benchmarks = args.benchmarks.split(',')
+    for name in benchmarks:
+        if name not in BENCHMARKS:
+            sys.exit(f"Error: {name} is not a valid benchmark.\nValid benchmarks: {', '.join(BENCHMARKS)}.")
+
+    results = run_benchmarks([int(n) for n in args.sizes.split(',')], benchmarks, latency=float(args.latency),
+                             error_rate=float(args.error_rate), n_postcodes=int(args.postcodes),
+                             seed=int(args.seed))
+    print(tabulate(pd.DataFrame(results), headers='keys', tablefmt='orgtbl', showindex="never", floatfmt='.3f'))
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'latency': float(args.latency), 'error_rate': float(args.error_rate),
+                       'max_rss_mb': geoutils.peak_rss_mb(), 'results': results}, f, indent=2)
+        print(f"Results written to {args.output}.")
+
+
+def measure(name, size, func):
+    """
+    Time a benchmark and measure its peak memory allocated by Python and numpy (tracemalloc).
+    :param name: name of the benchmark.
+    :param size: number of rows processed.
+    :param func: function running the benchmark.
+    :return: dict with benchmark, size, seconds, rows_per_second and peak_mb.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    func()
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'benchmark': name, 'size': size, 'seconds': seconds, 'rows_per_second': size / seconds,
+            'peak_mb': peak / 2 ** 20}
+
+
+def run_benchmarks(sizes, benchmarks=BENCHMARKS, latency=0.005, error_rate=0.0, n_postcodes=50000, seed=0):
+    """
+    Run benchmarks for cohorts of several sizes against a local stand-in server.
+    :param sizes: list of cohort sizes (number of geocoded postcodes).
+    :param benchmarks: list of benchmark names (see BENCHMARKS).
+    :param latency: delay of each stand-in server response in seconds.
+    :param error_rate: fraction of stand-in server responses failing with 503.
+    :param n_postcodes: number of distinct synthetic postcodes.
+    :param seed: random seed.
+    :return: list of dicts (see measure).
+    """
+    postcodes = synthetic_postcodes(n_postcodes, seed=seed)
+    results = []
+    with StandInServer(postcodes, years=[2008, 2012], latency=latency, error_rate=error_rate, seed=seed) as server, \
+            tempfile.TemporaryDirectory() as tmpdir:
+        fixtures = Fixtures(server, postcodes, tmpdir, seed)
+        for size in sizes:
+            data = geocoded_cohort(postcodes, size // 2, years=(2008, 2012), seed=seed)
+            for name in benchmarks:
+                print(f"Running {name} ({len(data)} rows)...")
+                results.append(measure(name, len(data), getattr(fixtures, name)(data)))
+    return results
+
+
+class Fixtures:
+    """
+    Set up of each benchmark (outside of the measured time): fixtures.<benchmark>(data) returns the function that
+    is measured.
+    """
+
+    def __init__(self, server, postcodes, tmpdir, seed=0):
+        self.server = server
+        self.postcodes = postcodes
+        self.tmpdir = tmpdir
+        self.rng = np.random.default_rng(seed)
+        self._sc = None
+
+    @property
+    def sc(self):
+        if self._sc is None:
+            self._sc = scrapedefra.ScrapeDefraPollution([2008, 2012], ['PM10', 'NO2'], base_url=self.server.url)
+        return self._sc
+
+    def geocode_batch(self, data):
+        url = self.server.url + '/postcodes'
+
+        def run():
+            with requests.Session() as session:
+                geoutils.geocode_uk_batch(data['postcode'].tolist(), session=session, url=url)
+        return run
+
+    def geocode_async(self, data):
+        geocoder = geoutils.AsyncGeocoder(rate=1000, max_in_flight=20, backoff=0.01,
+                                          url=self.server.url + '/postcodes')
+        return lambda: asyncio.run(geocoder.geocode_async(data['postcode'].tolist()))
+
+    def grid_codes(self, data):
+        index = self.sc.grid_index
+        return lambda: index.nearest_codes(data['eastings'], data['northings'])
+
+    def linking_func(self, data):
+        sc = self.sc
+        return lambda: sc.linking_func(data.copy(), 'ID', workers=4)
+
+    def spatial_join(self, data):
+        # 2km squares over the extent (about the density of output areas in towns)
+        xs, ys = np.meshgrid(np.arange(EXTENT[0], EXTENT[2], 2000), np.arange(EXTENT[1], EXTENT[3], 2000))
+        areas = geopandas.GeoDataFrame(
+            {'code': np.arange(xs.size).astype(str)},
+            geometry=[box(x, y, x + 2000, y + 2000) for x, y in zip(xs.ravel(), ys.ravel())], crs=geoutils.BNG
+        )
+        index = geoutils.AreaIndex(areas)
+        return lambda: index.link(data)
+
+    def nearest_roads(self, data):
+        roads = self.rng.uniform(EXTENT[:2], EXTENT[2:], (20000, 2))
+        index = geoutils.PointIndex(roads[:, 0], roads[:, 1])
+
+        def run():
+            index.query(data['eastings'].to_numpy(float), data['northings'].to_numpy(float), k=3)
+            index.within(data['eastings'].to_numpy(float), data['northings'].to_numpy(float), 1000)
+        return run
+
+    def raster_sample(self, data):
+        paths = [os.path.join(self.tmpdir, f'class_{i}.tif') for i in range(10)]
+        width, height = (EXTENT[2] - EXTENT[0]) // 1000, (EXTENT[3] - EXTENT[1]) // 1000
+        for path in paths:
+            if not os.path.exists(path):
+                with rasterio.open(path, 'w', driver='GTiff', width=width, height=height, count=1,
+                                   dtype='float32', crs=geoutils.BNG, nodata=-1,
+                                   transform=from_origin(EXTENT[0], EXTENT[3], 1000, 1000)) as dst:
+                    dst.write(self.rng.uniform(0, 100, (1, height, width)).astype('float32'))
+
+        def run():
+            with geoutils.RasterStack(paths) as stack:
+                stack.sample(data['eastings'], data['northings'])
+        return run
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+import io
+import re
+import json
+import time
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from geoutils import clean_postcode
+from .cohorts import EXTENT
+
+# Tables of the pcm-data page served by the stand-in: (pollutant, metric, label prefix)
+PCM_TABLES = [('PM10', 'Annual mean', 'pm10'), ('PM2.5', 'Annual mean', 'pm25'), ('NO2', 'Annual mean', 'no2'),
+              ('NOX', 'Annual mean', 'nox'), ('SO2', 'Annual mean', 'so2'), ('OZONE', 'DGT120', 'dgt12'),
+              ('BENZENE', 'Annual mean', 'bz')]
+
+
+class StandInServer:
+    """
+    Local stand-in for https://postcodes.io/ and https://uk-air.defra.gov.uk run in a background thread:
+    - GET /postcodes/<postcode> and POST /postcodes (bulk lookup) answer from a table of postcodes (or recorded
+      postcodes.io results),
+    - GET /data/pcm-data serves a pcm-data page with a table per pollutant linking to /datastore/pcm/*.csv,
+    - GET /datastore/pcm/map<label><year>.csv serves a synthetic 1km pollution grid over extent in the PCM csv
+      format (5 lines before the header).
+    Every response is delayed by latency seconds and a fraction error_rate of responses are '503 Service
+    unavailable'.
+    """
+
+    def __init__(self, postcodes=None, recorded=None, years=range(2001, 2019), extent=EXTENT, latency=0.0,
+                 error_rate=0.0, seed=0):
+        """
+        :param postcodes: DataFrame with postcode, eastings, northings and country columns (see
+        cohorts.synthetic_postcodes).
+        :param recorded: dict of cleaned upper case postcode to recorded postcodes.io result (used with postcodes).
+        :param years: years of the pollution tables.
+        :param extent: (xmin, ymin, xmax, ymax) of the pollution grids.
+        :param latency: delay of each response in seconds.
+        :param error_rate: fraction of responses failing with 503.
+        :param seed: random seed of the errors.
+        """
+        self.results = dict(recorded or {})
+        if postcodes is not None:
+            for row in postcodes[['postcode', 'eastings', 'northings', 'country']].itertuples(index=False):
+                self.results[clean_postcode(row.postcode).upper()] = {
+                    'postcode': row.postcode, 'eastings': int(row.eastings), 'northings': int(row.northings),
+                    'country': row.country
+                }
+        self.years = list(years)
+        self.extent = extent
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.csv_files = {}
+        self.requests = 0
+        self.httpd = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.httpd.server_port}'
+
+    def start(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                server.respond(self, 'GET')
+
+            def do_POST(self):
+                server.respond(self, 'POST')
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def respond(self, handler, method):
+        body = handler.rfile.read(int(handler.headers.get('Content-Length') or 0)) if method == 'POST' else b''
+        with self.lock:
+            self.requests += 1
+            failed = self.random.random() < self.error_rate
+        if self.latency:
+            time.sleep(self.latency)
+        path = handler.path.split('?')[0]
+        if failed:
+            status, content, kind = 503, json.dumps({'status': 503, 'error': 'Service unavailable'}).encode(), 'json'
+        elif path == '/postcodes' and method == 'POST':
+            status, content, kind = 200, self.bulk(json.loads(body)['postcodes']), 'json'
+        elif path.startswith('/postcodes/'):
+            status, content, kind = self.single(path[len('/postcodes/'):])
+        elif path == '/data/pcm-data':
+            status, content, kind = 200, self.pcm_page(), 'html'
+        elif re.match(r'^/datastore/pcm/map[a-z0-9]+\.csv$', path):
+            status, content, kind = 200, self.pcm_csv(path.rsplit('/', 1)[1]), 'csv'
+        else:
+            status, content, kind = 404, b'Not Found', 'html'
+        handler.send_response(status)
+        handler.send_header('Content-Type', {'json': 'application/json', 'html': 'text/html',
+                                             'csv': 'text/csv'}[kind])
+        handler.send_header('Content-Length', str(len(content)))
+        handler.end_headers()
+        handler.wfile.write(content)
+
+    def bulk(self, queries):
+        result = [{'query': q, 'result': self.results.get(clean_postcode(q).upper())} for q in queries]
+        return json.dumps({'status': 200, 'result': result}).encode()
+
+    def single(self, postcode):
+        result = self.results.get(clean_postcode(postcode).upper())
+        if result is not None:
+            return 200, json.dumps({'status': 200, 'result': result}).encode(), 'json'
+        if re.match(r'^[A-Z]{1,2}[0-9][A-Z0-9]?[0-9][A-Z]{2}$', clean_postcode(postcode).upper()):
+            return 404, json.dumps({'status': 404, 'error': 'Postcode not found'}).encode(), 'json'
+        return 404, json.dumps({'status': 404, 'error': 'Invalid postcode'}).encode(), 'json'
+
+    def pcm_page(self):
+        html = ['<html><body>']
+        for pollutant, metric, label in PCM_TABLES:
+            html.append('<table class="data"><tr><th>Pollutant</th><th>Year</th><th>Metric</th>'
+                        '<th>Header label</th><th>Comments</th><th>Download</th></tr>')
+            for year in self.years:
+                name = f'map{label}{year}{"g" if pollutant == "PM10" and year > 2001 else ""}'
+                html.append(f'<tr><td>{pollutant}</td><td>{year}</td><td>{metric}</td><td>{name[3:]}</td>'
+                            f'<td> </td><td><a href="../datastore/pcm/{name}.csv">CSV</a></td></tr>')
+            html.append('</table>')
+        html.append('</body></html>')
+        return '\n'.join(html).encode()
+
+    def pcm_csv(self, filename):
+        with self.lock:
+            if filename not in self.csv_files:
+                self.csv_files[filename] = pcm_csv(filename[3:-4], self.extent, seed=len(self.csv_files))
+            return self.csv_files[filename]
+
+
+def pcm_csv(label, extent=EXTENT, seed=0):
+    """
+    Synthetic pollution grid in the PCM csv format: 5 lines of notes, a header ukgridcode,x,y,<label> and a row per
+    1km square (centroids) of extent, with 1% of values 'MISSING'.
+    :param label: header label (e.g. 'pm102008g').
+    :param extent: (xmin, ymin, xmax, ymax).
+    :param seed: random seed.
+    :return: bytes.
+    """
+    xs = np.arange(extent[0], extent[2], 1000) + 500
+    ys = np.arange(extent[1], extent[3], 1000) + 500
+    x, y = [a.ravel() for a in np.meshgrid(xs, ys)]
+    codes = (y // 1000) * 1000 + x // 1000
+    values = np.round(np.random.default_rng(seed).gamma(4, 4, len(x)), 3).astype(str).astype(object)
+    values[np.random.default_rng(seed + 1).random(len(x)) < 0.01] = 'MISSING'
+    out = io.StringIO()
+    out.write(''.join(f'Stand-in pollution data, line {i}\n' for i in range(1, 6)))
+    out.write(f'ukgridcode,x,y,{label}\n')
+    np.savetxt(out, np.c_[codes, x, y, values], fmt='%s', delimiter=',')
+    return out.getvalue().encode()
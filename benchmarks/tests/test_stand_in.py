@@ -0,0 +1,51 @@
+import requests
+import scrapedefra
+import geoutils
+from benchmarks import StandInServer, synthetic_postcodes, synthetic_cohort, geocoded_cohort
+from benchmarks.run_benchmarks import run_benchmarks
+
+EXTENT = (400000, 300000, 420000, 310000)
+
+
+class TestStandInServer:
+
+    def test_geocode(self):
+        postcodes = synthetic_postcodes(300)
+        with StandInServer(postcodes) as server:
+            actual = geoutils.geocode_uk_batch(postcodes['postcode'].tolist()[:150] + ['XX', 'AB1 1AB'],
+                                               url=server.url + '/postcodes')
+        assert actual[0] == postcodes.iloc[0].tolist()
+        assert actual[149] == postcodes.iloc[149].tolist()
+        assert actual[-2:] == [['Invalid postcode'] * 4, ['Postcode not found'] * 4]
+
+    def test_errors(self):
+        with StandInServer(synthetic_postcodes(10), error_rate=1) as server:
+            response = requests.get(server.url + '/postcodes/ZA10AA')
+        assert response.status_code == 503
+
+    def test_scrape_and_link(self):
+        data = geocoded_cohort(synthetic_postcodes(100, extent=EXTENT), 50)
+        with StandInServer(years=[2007, 2008], extent=EXTENT) as server:
+            sc = scrapedefra.ScrapeDefraPollution([2008, 2012], ['PM10', 'NO2'], base_url=server.url)
+            linked = sc.linking_func(data, 'ID', workers=2)
+        assert sc.pollution_data['year_pollution_data_collected'].tolist() == ['2008', '2008', '2008', '2008']
+        assert linked.columns.tolist()[-2:] == ['PM10', 'NO2']
+        assert len(linked) == 100 and linked['PM10'].notna().mean() > 0.9
+
+
+class TestCohorts:
+
+    def test_synthetic_cohort(self):
+        postcodes = synthetic_postcodes(7000)
+        assert postcodes['postcode'].nunique() == 7000
+        cohort = synthetic_cohort(postcodes, 20, years=(2008, 2012))
+        assert cohort.columns.tolist() == ['ID', 'Postcodes2008', 'Postcodes2012']
+
+
+class TestRunBenchmarks:
+
+    def test_run_benchmarks(self):
+        results = run_benchmarks([100], ['geocode_batch', 'spatial_join', 'nearest_roads'], latency=0,
+                                 n_postcodes=200)
+        assert [r['benchmark'] for r in results] == ['geocode_batch', 'spatial_join', 'nearest_roads']
+        assert all(r['size'] == 100 and r['seconds'] > 0 and r['peak_mb'] > 0 for r in results)
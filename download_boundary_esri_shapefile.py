@@ -1,26 +1,39 @@
-import geopandas
 import os
+import argparse
+import geoutils
 from tabulate import tabulate
 
 # See TermsAndConditions_ukdataservice_boundary.html for terms and conditions/lisencing for using these datasets
 
-# 2011 output area
-
-shp_eng_2011 = geopandas.read_file(
-        'https://borders.ukdataservice.ac.uk/ukborders/easy_download/prebuilt/shape/England_oa_2011.zip'
-)
-shp_wales_2011 = geopandas.read_file(
-        'https://borders.ukdataservice.ac.uk/ukborders/easy_download/prebuilt/shape/Wales_oa_2011.zip'
+# Initiate parser and add arguments
+parser = argparse.ArgumentParser(
+    description="Download the 2011 output area boundaries of England and Wales into the boundary store "
+                "(boundary_data)."
 )
+parser.add_argument("--shp", help="Also write the boundaries to "
+                                  "boundary_data/output_area/EW_output_area_2011.shp (slow, only needed by "
+                                  "programmes reading a shapefile).", action="store_true")
+args = parser.parse_args()
+
+# Boundary store (archives are downloaded once and converted to a parquet file that can be read by bounding box)
+store = geoutils.BoundaryStore("boundary_data")
+
+# 2011 output area (England and Wales appended)
+
+store.add("EW_output_area_2011", [
+    'https://borders.ukdataservice.ac.uk/ukborders/easy_download/prebuilt/shape/England_oa_2011.zip',
+    'https://borders.ukdataservice.ac.uk/ukborders/easy_download/prebuilt/shape/Wales_oa_2011.zip'
+])
+shp_2011 = store.read("EW_output_area_2011")
 
-# Append England and Wales shapefiles
-shp_2011 = shp_eng_2011.append(shp_wales_2011, ignore_index=True)
+if args.shp:
+    os.makedirs(os.path.join("boundary_data", "output_area"), exist_ok=True)
+    shp_2011.to_file(os.path.join("boundary_data", "output_area", "EW_output_area_2011.shp"))
 
 # Print head
 print("\n\nOA 2011 data:\n")
-shp_2011.to_file(os.path.join("boundary_data", "output_area", "EW_output_area_2011.shp"))
 shp_2011.drop('geometry', axis=1, inplace=True)
 cols = shp_2011.columns.values.tolist()
 print(tabulate(shp_2011.head(),
                headers=cols,
-               tablefmt='orgtbl', showindex="never"))
\ No newline at end of file
+               tablefmt='orgtbl', showindex="never"))
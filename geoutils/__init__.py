@@ -1 +1,16 @@
-from .geo_utils import *
\ No newline at end of file
+from .metrics import *
+from .geo_utils import *
+from .postcode_index import *
+from .geocode_cache import *
+from .async_geocode import *
+from .download_cache import *
+from .spatial_index import *
+from .raster_stack import *
+from .area_index import *
+from .area_grid import *
+from .zonal import *
+from .boundary_store import *
+from .checkpoint import *
+from .geocoded import *
+from .incremental import *
+from .sharding import *
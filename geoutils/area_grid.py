@@ -0,0 +1,123 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+import shapely
+from rasterio import features
+from rasterio.transform import from_origin
+from .area_index import join_areas
+
+# Labels of grid cells not assigned to a single area
+OUTSIDE = -1
+BOUNDARY = -2
+
+
+class AreaGrid:
+    """
+    Boundary polygons (of an AreaIndex) rasterised into a memory-mapped grid of area labels (positions in
+    AreaIndex.areas) over the extent of the polygons. Cells crossed by a boundary are labelled BOUNDARY and
+    only co-ordinates in those cells (or exactly on the edge of a cell) are assigned with an exact polygon test;
+    all other co-ordinates are labelled by array indexing.
+    """
+
+    def __init__(self, path, index):
+        """
+        :param path: label grid (.npy) built with AreaGrid.build, metadata in path + '.json'.
+        :param index: AreaIndex the grid was built from.
+        """
+        self.path = path
+        self.index = index
+        with open(path + '.json') as f:
+            self.meta = json.load(f)
+        self.x0, self.y0 = self.meta['x0'], self.meta['y0']
+        self.resolution = self.meta['resolution']
+        self.labels = np.load(path, mmap_mode='r')
+
+    @classmethod
+    def build(cls, index, path, resolution=100, strip_rows=1000):
+        """
+        Rasterise the polygons of an AreaIndex, strip by strip.
+        :param index: AreaIndex.
+        :param path: filename of the label grid (.npy), the metadata is written to path + '.json'.
+        :param resolution: size of the grid cells in metres.
+        :param strip_rows: number of rows rasterised at a time.
+        :return: AreaGrid.
+        """
+        xmin, ymin, xmax, ymax = shapely.total_bounds(index.geometries)
+        x0 = np.floor(xmin / resolution) * resolution
+        y0 = np.ceil(ymax / resolution) * resolution
+        shape = (int(np.ceil((y0 - ymin) / resolution)), int(np.ceil((xmax - x0) / resolution)))
+
+        labels = np.lib.format.open_memmap(path + '.tmp', mode='w+', dtype=np.int32, shape=shape)
+        boundaries = shapely.boundary(index.geometries)
+        for row in range(0, shape[0], strip_rows):
+            nrows = min(strip_rows, shape[0] - row)
+            top = y0 - row * resolution
+            transform = from_origin(x0, top, resolution, resolution)
+            strip = shapely.box(x0, top - nrows * resolution, x0 + shape[1] * resolution, top)
+            hits = index.tree.query(strip)
+            if len(hits) == 0:
+                labels[row:row + nrows] = OUTSIDE
+                continue
+            out = features.rasterize(zip(index.geometries[hits], hits), out_shape=(nrows, shape[1]),
+                                     transform=transform, fill=OUTSIDE, dtype='int32')
+            crossed = features.rasterize(zip(boundaries[hits], np.ones(len(hits))), out_shape=(nrows, shape[1]),
+                                         transform=transform, fill=0, all_touched=True, dtype='uint8')
+            out[crossed == 1] = BOUNDARY
+            labels[row:row + nrows] = out
+        labels.flush()
+        del labels
+
+        # the metadata is moved in last, so an interrupted build is never opened
+        with open(path + '.json.tmp', 'w') as f:
+            json.dump({'x0': float(x0), 'y0': float(y0), 'resolution': resolution, 'shape': shape,
+                       'fingerprint': index.fingerprint()}, f)
+        if os.path.exists(path + '.json'):
+            os.remove(path + '.json')
+        os.replace(path + '.tmp', path)
+        os.replace(path + '.json.tmp', path + '.json')
+        return cls(path, index)
+
+    @classmethod
+    def cached(cls, index, path, resolution=100):
+        """
+        Open the label grid at path, building it first if it does not exist or was built from other polygons
+        (see AreaIndex.fingerprint) or at another resolution.
+        """
+        if os.path.exists(path) and os.path.exists(path + '.json'):
+            with open(path + '.json') as f:
+                meta = json.load(f)
+            if meta.get('fingerprint') == index.fingerprint() and meta['resolution'] == resolution:
+                return cls(path, index)
+        return cls.build(index, path, resolution=resolution)
+
+    def assign(self, eastings, northings, processes=1):
+        """
+        Assign co-ordinates to areas (same result as AreaIndex.assign).
+        :param eastings: array of eastings.
+        :param northings: array of northings.
+        :param processes: number of processes for the exact polygon tests.
+        :return: numpy array of positions in areas (-1 if no polygon contains the co-ordinates or invalid
+        co-ordinates).
+        """
+        eastings = pd.to_numeric(pd.Series(np.asarray(eastings, dtype=object)), errors='coerce').to_numpy(float)
+        northings = pd.to_numeric(pd.Series(np.asarray(northings, dtype=object)), errors='coerce').to_numpy(float)
+        with np.errstate(invalid='ignore'):
+            col = (eastings - self.x0) / self.resolution
+            row = (self.y0 - northings) / self.resolution
+            inside = (col >= 0) & (col < self.labels.shape[1]) & (row >= 0) & (row < self.labels.shape[0])
+        positions = np.full(len(eastings), OUTSIDE, dtype=np.int64)
+        positions[inside] = self.labels[row[inside].astype(np.int64), col[inside].astype(np.int64)]
+
+        # Co-ordinates on the edge of a cell may be on a boundary that runs along the edge
+        edge = inside & ((col == np.floor(col)) | (row == np.floor(row)))
+        exact = (positions == BOUNDARY) | edge
+        positions[exact] = self.index.assign(eastings[exact], northings[exact], processes=processes)
+        return positions
+
+    def link(self, data, eastings='eastings', northings='northings', processes=1):
+        """
+        Inner join of co-ordinate data with the attributes of the areas containing them (see AreaIndex.link).
+        """
+        positions = self.assign(data[eastings], data[northings], processes=processes)
+        return join_areas(data, self.index.areas, positions)
@@ -0,0 +1,198 @@
+import os
+import json
+import hashlib
+import multiprocessing as mp
+import numpy as np
+import pandas as pd
+import geopandas
+import shapely
+from .checkpoint import file_fingerprint
+
+# Brittish national grid (BNG) co-ordinate reference system (CRS)
+BNG = 'epsg:27700'
+
+# AreaIndex used by worker processes of AreaIndex.assign
+_worker_index = None
+
+
+class AreaIndex:
+    """
+    Point-to-area assignment engine: an STRtree over the prepared polygons of a boundary file (e.g. output areas
+    or LSOAs) in the British National Grid. The polygons and their attributes can be saved to a feather file
+    (geometries as WKB), which loads much faster than reading and reprojecting the shapefile; the STRtree is
+    rebuilt on loading. A feather file saved by AreaIndex.cached records the fingerprint of its boundary file
+    (path + '.json') and is only reused for the same boundary file.
+    """
+
+    def __init__(self, areas):
+        """
+        :param areas: GeoDataFrame of polygons in the British National Grid.
+        """
+        self.areas = areas.reset_index(drop=True)
+        self.geometries = np.asarray(self.areas.geometry.array, dtype=object)
+        shapely.prepare(self.geometries)
+        self.tree = shapely.STRtree(self.geometries)
+        self._fingerprint = None
+
+    @classmethod
+    def from_shapefile(cls, shpfilename):
+        """
+        Read a boundary file and reproject it to the British National Grid if necessary.
+        :param shpfilename: URL to or downloaded boundary shapefile for reading.
+        :return: AreaIndex.
+        """
+        shp = geopandas.read_file(shpfilename)
+        if shp.crs is None or not shp.crs.equals(BNG):
+            shp = shp.to_crs(BNG)
+        return cls(shp)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load polygons saved with AreaIndex.save.
+        :param path: feather file.
+        :return: AreaIndex.
+        """
+        df = pd.read_feather(path)
+        geometry = shapely.from_wkb(df.pop('geometry_wkb').to_numpy())
+        return cls(geopandas.GeoDataFrame(df, geometry=geometry, crs=BNG))
+
+    @classmethod
+    def cached(cls, shpfilename, store=None):
+        """
+        Load the polygons from store, reading the boundary file and saving it to store if store does not exist or
+        was saved from another boundary file (or another version of it, see source_fingerprint).
+        :param shpfilename: URL to or downloaded boundary shapefile for reading.
+        :param store: feather file (None to always read the boundary file).
+        :return: AreaIndex.
+        """
+        source = source_fingerprint(shpfilename)
+        if store is not None and os.path.exists(store) and os.path.exists(store + '.json'):
+            with open(store + '.json') as f:
+                if json.load(f).get('source') == source:
+                    return cls.load(store)
+        index = cls.from_shapefile(shpfilename)
+        if store is not None:
+            index.save(store)
+            with open(store + '.json.tmp', 'w') as f:
+                json.dump({'source': source}, f)
+            os.replace(store + '.json.tmp', store + '.json')
+        return index
+
+    def save(self, path):
+        """
+        Save the polygons and their attributes to a feather file (removing the fingerprint of the boundary file
+        of a previous save by AreaIndex.cached).
+        :param path: feather file.
+        """
+        if os.path.exists(path + '.json'):
+            os.remove(path + '.json')
+        df = pd.DataFrame(self.areas.drop(columns=self.areas.geometry.name))
+        df['geometry_wkb'] = shapely.to_wkb(self.geometries)
+        df.to_feather(path + '.tmp')
+        os.replace(path + '.tmp', path)
+
+    def fingerprint(self):
+        """
+        Fingerprint of the polygons and their attributes, e.g. to check that an AreaGrid was built from them.
+        :return: str (sha256).
+        """
+        if self._fingerprint is None:
+            sha = hashlib.sha256()
+            for wkb in shapely.to_wkb(self.geometries):
+                sha.update(wkb)
+            attributes = pd.DataFrame(self.areas.drop(columns=self.areas.geometry.name)).astype(str)
+            sha.update(pd.util.hash_pandas_object(attributes, index=False).to_numpy().tobytes())
+            sha.update(','.join(attributes.columns).encode())
+            self._fingerprint = sha.hexdigest()
+        return self._fingerprint
+
+    def query(self, xs, ys):
+        """
+        Positions of the polygons containing points (first polygon if several contain a point).
+        :param xs: array of eastings.
+        :param ys: array of northings.
+        :return: numpy array of positions in areas (-1 if no polygon contains the point).
+        """
+        points = shapely.points(np.asarray(xs, dtype=float), np.asarray(ys, dtype=float))
+        point_idx, area_idx = self.tree.query(points, predicate='within')
+        positions = np.full(len(points), -1, dtype=np.int64)
+        positions[point_idx[::-1]] = area_idx[::-1]
+        return positions
+
+    def assign(self, eastings, northings, processes=1, chunk_size=50000):
+        """
+        Assign co-ordinates to areas. Each distinct co-ordinate is only queried once (participants often share a
+        postcode centroid) and chunks of co-ordinates are queried in parallel processes.
+        :param eastings: array of eastings.
+        :param northings: array of northings.
+        :param processes: number of processes.
+        :param chunk_size: number of co-ordinates per chunk.
+        :return: numpy array of positions in areas (-1 if no polygon contains the co-ordinates or invalid
+        co-ordinates).
+        """
+        eastings = pd.to_numeric(pd.Series(np.asarray(eastings, dtype=object)), errors='coerce').to_numpy(float)
+        northings = pd.to_numeric(pd.Series(np.asarray(northings, dtype=object)), errors='coerce').to_numpy(float)
+        valid = ~(np.isnan(eastings) | np.isnan(northings))
+        coords, inverse = np.unique(np.c_[eastings[valid], northings[valid]], axis=0, return_inverse=True)
+        chunks = [coords[i:i + chunk_size] for i in range(0, len(coords), chunk_size)]
+
+        if int(processes) > 1 and len(chunks) > 1:
+            with mp.Pool(int(processes), initializer=_init_worker, initargs=(self,)) as pool:
+                found = pool.map(_query_worker, chunks)
+        else:
+            found = [self.query(chunk[:, 0], chunk[:, 1]) for chunk in chunks]
+
+        positions = np.full(len(eastings), -1, dtype=np.int64)
+        if found:
+            positions[valid] = np.concatenate(found)[inverse.ravel()]
+        return positions
+
+    def link(self, data, eastings='eastings', northings='northings', processes=1):
+        """
+        Inner join of co-ordinate data with the attributes of the areas containing them.
+        :param data: DataFrame with eastings and northings columns.
+        :param eastings: column name of the eastings.
+        :param northings: column name of the northings.
+        :param processes: number of processes.
+        :return: DataFrame with the columns of data, index_right (position of the area) and the attributes of
+        the areas.
+        """
+        positions = self.assign(data[eastings], data[northings], processes=processes)
+        return join_areas(data, self.areas, positions)
+
+
+def source_fingerprint(shpfilename):
+    """
+    Fingerprint of a boundary file: its path, size and modification time (see file_fingerprint), or the URL.
+    :param shpfilename: URL to or downloaded boundary shapefile.
+    :return: dict.
+    """
+    path = shpfilename[len('zip://'):] if shpfilename.startswith('zip://') else shpfilename
+    if os.path.exists(path):
+        return file_fingerprint(path)
+    return {'path': shpfilename}
+
+
+def join_areas(data, areas, positions):
+    """
+    Inner join of data with the attributes of areas.
+    :param data: DataFrame.
+    :param areas: GeoDataFrame of areas.
+    :param positions: array of positions in areas for each row of data (-1 for rows to drop).
+    :return: DataFrame with the columns of data, index_right (position of the area) and the attributes of
+    the areas.
+    """
+    found = positions >= 0
+    attributes = pd.DataFrame(areas.drop(columns=areas.geometry.name)).iloc[positions[found]]
+    attributes.insert(0, 'index_right', positions[found])
+    return pd.concat([data[found].reset_index(drop=True), attributes.reset_index(drop=True)], axis=1)
+
+
+def _init_worker(index):
+    global _worker_index
+    _worker_index = index
+
+
+def _query_worker(coords):
+    return _worker_index.query(coords[:, 0], coords[:, 1])
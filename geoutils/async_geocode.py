@@ -0,0 +1,137 @@
+import asyncio
+import random
+import aiohttp
+from .geo_utils import POSTCODES_IO_URL, clean_postcode
+from .metrics import METRICS
+
+# HTTP status codes worth retrying (rate limiting and server errors)
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Token-bucket rate limiter for asyncio: allows bursts of up to capacity requests and on average rate
+    requests per second.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1, rate))
+        self.tokens = self.capacity
+        self.updated = None
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            loop = asyncio.get_running_loop()
+            while True:
+                now = loop.time()
+                if self.updated is not None:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AsyncGeocoder:
+    """
+    Geocode UK postcodes with the bulk lookup endpoint of https://postcodes.io/ from a single process. The
+    number of requests in flight is bounded, requests are rate limited with a token bucket and failed requests
+    (timeouts, connection errors, responses that are not json, 429 and 5xx responses) are retried with
+    exponential backoff.
+    """
+
+    def __init__(self, batch_size=100, max_in_flight=10, rate=10, retries=5, backoff=0.5, timeout=30,
+                 url=POSTCODES_IO_URL):
+        self.batch_size = max(1, min(int(batch_size), 100))
+        self.max_in_flight = int(max_in_flight)
+        self.rate = rate
+        self.retries = int(retries)
+        self.backoff = backoff
+        self.timeout = timeout
+        self.url = url
+        self.retried = 0
+
+    async def request(self, session, method, url, json=None):
+        """
+        Send a request, retrying with exponential backoff.
+        :return: tuple of HTTP status code (None if no response was received) and decoded json (or error message).
+        """
+        for attempt in range(self.retries + 1):
+            delay = self.backoff * 2 ** attempt * (1 + random.random())
+            try:
+                async with self.semaphore:
+                    await self.bucket.acquire()
+                    async with session.request(method, url, json=json) as response:
+                        METRICS.add('http_requests')
+                        METRICS.add('http_bytes', response.content_length or 0)
+                        if response.status not in RETRY_STATUS:
+                            return response.status, await response.json(content_type=None)
+                        status, error = response.status, f"HTTP error {response.status}"
+                        retry_after = response.headers.get('Retry-After', '')
+                        if retry_after.isdigit():
+                            delay = max(delay, float(retry_after))
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                status, error = None, f"Request failed ({type(e).__name__})"
+            except ValueError:
+                # body that is not json (e.g. an error page from a proxy)
+                status, error = None, "Request failed (invalid json response)"
+            if attempt < self.retries:
+                self.retried += 1
+                METRICS.add('http_retries')
+                await asyncio.sleep(delay)
+        return status, {'error': error}
+
+    async def geocode_one(self, session, postcode):
+        status, payload = await self.request(session, 'GET', self.url + '/' + clean_postcode(postcode))
+        if status == 200:
+            info = payload["result"]
+            return [info['postcode'], info['eastings'], info['northings'], info['country']]
+        info = payload["error"]
+        return [info, info, info, info]
+
+    async def geocode_chunk(self, session, chunk):
+        status, payload = await self.request(session, 'POST', self.url,
+                                             json={'postcodes': [clean_postcode(p) for p in chunk]})
+        if status is None or status in RETRY_STATUS:
+            info = payload["error"]
+            return [[info, info, info, info] for postcode in chunk]
+        if status != 200:
+            return await asyncio.gather(*[self.geocode_one(session, postcode) for postcode in chunk])
+        results = []
+        for postcode, item in zip(chunk, payload["result"]):
+            info = item["result"]
+            if info is None:
+                results.append(await self.geocode_one(session, postcode))
+            else:
+                results.append([info['postcode'], info['eastings'], info['northings'], info['country']])
+        self.done += len(chunk)
+        METRICS.progress('AsyncGeocoder', self.done, self.total)
+        return results
+
+    async def geocode_async(self, postcodes):
+        """
+        Coroutine version of AsyncGeocoder.geocode.
+        """
+        postcodes = list(postcodes)
+        self.done, self.total = 0, len(postcodes)
+        self.semaphore = asyncio.Semaphore(self.max_in_flight)
+        self.bucket = TokenBucket(self.rate)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        connector = aiohttp.TCPConnector(limit=self.max_in_flight)
+        async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+            chunks = await asyncio.gather(*[
+                self.geocode_chunk(session, postcodes[i:i + self.batch_size])
+                for i in range(0, len(postcodes), self.batch_size)
+            ])
+        return [row for chunk in chunks for row in chunk]
+
+    def geocode(self, postcodes):
+        """
+        Asyncio equivalent of geoutils.geocode_uk_batch.
+        :param postcodes: list of postcodes.
+        :return: list of [postcode, easting, northing, country] lists in the same order as postcodes.
+        """
+        return asyncio.run(self.geocode_async(postcodes))
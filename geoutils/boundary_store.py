@@ -0,0 +1,129 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+import geopandas
+import requests
+import shapely
+from .geo_utils import USER_AGENT
+from .area_index import BNG
+from .metrics import METRICS
+
+
+class BoundaryStore:
+    """
+    Local store of boundary data (e.g. the England and Wales output area shapefiles from
+    https://borders.ukdataservice.ac.uk). Downloaded archives are kept in store_dir/archives and each dataset is
+    converted once to a parquet file of WKB geometries in the British National Grid, sorted by 10km tile and with
+    the bounding box of each polygon in columns xmin, ymin, xmax and ymax. Reads can then be restricted to the
+    polygons intersecting a bounding box (or a set of tiles), using the parquet row group statistics to skip
+    the rest of the file. The urls and dropped columns of each dataset are kept in store_dir/<name>.json and a
+    dataset is converted again when they change.
+    """
+
+    def __init__(self, store_dir, offline=False, tile_size=10000, row_group_size=5000):
+        self.store_dir = store_dir
+        self.offline = offline
+        self.tile_size = tile_size
+        self.row_group_size = row_group_size
+        os.makedirs(os.path.join(store_dir, 'archives'), exist_ok=True)
+
+    def path(self, name):
+        return os.path.join(self.store_dir, name + '.parquet')
+
+    def download(self, url):
+        """
+        Download an archive unless it is in the store.
+        :param url: url of the archive.
+        :return: path to the local copy of the archive.
+        """
+        path = os.path.join(self.store_dir, 'archives', os.path.basename(url))
+        if os.path.exists(path):
+            return path
+        if self.offline:
+            raise FileNotFoundError(f"{url} not found in the boundary store {self.store_dir} (offline mode).")
+        with requests.get(url, headers=USER_AGENT, stream=True) as response:
+            response.raise_for_status()
+            with open(path + '.tmp', 'wb') as f:
+                for block in response.iter_content(chunk_size=1 << 20):
+                    f.write(block)
+                    METRICS.add('http_bytes', len(block))
+            METRICS.add('http_requests')
+        os.replace(path + '.tmp', path)
+        return path
+
+    def add(self, name, urls, drop=()):
+        """
+        Download boundary archives (or shapefiles) and convert them to a dataset of the store, unless the
+        dataset exists with the same urls and dropped columns.
+        :param name: name of the dataset.
+        :param urls: list of urls to (or local paths of) zipped shapefiles, appended into one dataset.
+        :param drop: columns to drop.
+        :return: path of the dataset.
+        """
+        meta = {'urls': list(urls), 'drop': list(drop)}
+        meta_path = os.path.join(self.store_dir, name + '.json')
+        if os.path.exists(self.path(name)) and os.path.exists(meta_path):
+            with open(meta_path) as f:
+                if json.load(f) == meta:
+                    return self.path(name)
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        frames = []
+        for url in urls:
+            path = self.download(url) if url.startswith('http') else url
+            shp = geopandas.read_file('zip://' + path if path.endswith('.zip') else path)
+            if shp.crs is None or not shp.crs.equals(BNG):
+                shp = shp.to_crs(BNG)
+            frames.append(shp.drop(columns=list(drop)))
+        shp = pd.concat(frames, ignore_index=True)
+
+        geometries = np.asarray(shp.geometry.array, dtype=object)
+        df = pd.DataFrame(shp.drop(columns=shp.geometry.name))
+        df[['xmin', 'ymin', 'xmax', 'ymax']] = shapely.bounds(geometries)
+        df['geometry_wkb'] = shapely.to_wkb(geometries)
+        tile_y = np.floor(df['ymin'] / self.tile_size)
+        tile_x = np.floor(df['xmin'] / self.tile_size)
+        df = df.iloc[np.lexsort((tile_x, tile_y))].reset_index(drop=True)
+        df.to_parquet(self.path(name) + '.tmp', index=False, row_group_size=self.row_group_size)
+        os.replace(self.path(name) + '.tmp', self.path(name))
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(meta_path + '.tmp', meta_path)
+        return self.path(name)
+
+    def read(self, name, bbox=None):
+        """
+        Read the polygons of a dataset intersecting one or several bounding boxes.
+        :param name: name of the dataset.
+        :param bbox: tuple (xmin, ymin, xmax, ymax), list of such tuples (e.g. tiles) or None for all polygons.
+        :return: GeoDataFrame in the British National Grid.
+        """
+        filters = None
+        boxes = None
+        if bbox is not None:
+            boxes = [bbox] if np.isscalar(bbox[0]) else list(bbox)
+            filters = [[('xmax', '>=', b[0]), ('ymax', '>=', b[1]), ('xmin', '<=', b[2]), ('ymin', '<=', b[3])]
+                       for b in boxes]
+        df = pd.read_parquet(self.path(name), filters=filters)
+        geometry = shapely.from_wkb(df.pop('geometry_wkb').to_numpy())
+        if boxes is not None:
+            keep = np.zeros(len(df), dtype=bool)
+            for b in boxes:
+                keep |= shapely.intersects(geometry, shapely.box(*b))
+            df, geometry = df[keep], geometry[keep]
+        df = df.drop(columns=['xmin', 'ymin', 'xmax', 'ymax'])
+        return geopandas.GeoDataFrame(df.reset_index(drop=True), geometry=geometry, crs=BNG)
+
+
+def coordinates_bbox(eastings, northings, buffer=0):
+    """
+    Bounding box of co-ordinates (ignoring co-ordinates that are not numbers).
+    :param eastings: array of eastings.
+    :param northings: array of northings.
+    :param buffer: distance added around the bounding box.
+    :return: tuple (xmin, ymin, xmax, ymax).
+    """
+    eastings = pd.to_numeric(pd.Series(np.asarray(eastings, dtype=object)), errors='coerce')
+    northings = pd.to_numeric(pd.Series(np.asarray(northings, dtype=object)), errors='coerce')
+    return (eastings.min() - buffer, northings.min() - buffer, eastings.max() + buffer, northings.max() + buffer)
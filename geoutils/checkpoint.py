@@ -0,0 +1,74 @@
+import os
+import json
+
+
+class ChunkCheckpoint:
+    """
+    Checkpoint manifest (output + '.manifest.json') of a csv file written chunk by chunk. After each chunk the
+    manifest records the number of completed chunks, the size of the output file and an optional state (e.g.
+    running counts), so that a run restarted after a crash truncates a partly written chunk and resumes from the
+    next chunk. A manifest written with a different fingerprint (e.g. another input file or chunk size) is
+    ignored and the output is started again.
+    """
+
+    def __init__(self, output, fingerprint):
+        """
+        :param output: output csv file.
+        :param fingerprint: JSON serialisable description of the input and settings of the run.
+        """
+        self.output = output
+        self.path = output + '.manifest.json'
+        self.fingerprint = json.loads(json.dumps(fingerprint))
+        self.chunks = 0
+        self.size = 0
+        self.state = None
+        self.complete = False
+        if os.path.exists(self.path) and os.path.exists(output):
+            with open(self.path) as f:
+                manifest = json.load(f)
+            if manifest['fingerprint'] == self.fingerprint and manifest['size'] <= os.path.getsize(output):
+                self.chunks = manifest['chunks']
+                self.size = manifest['size']
+                self.state = manifest['state']
+                self.complete = manifest['complete']
+        with open(output, 'ab') as f:
+            f.truncate(self.size)
+
+    def append(self, data, state=None):
+        """
+        Append a chunk to the output (with a header for the first chunk) and record it in the manifest.
+        :param data: DataFrame.
+        :param state: JSON serialisable state after the chunk.
+        """
+        with open(self.output, 'a', newline='') as f:
+            data.to_csv(f, index=False, header=self.size == 0)
+            f.flush()
+            os.fsync(f.fileno())
+            self.size = f.tell()
+        self.chunks += 1
+        self.state = state
+        self.save()
+
+    def finish(self):
+        """
+        Mark the output as complete (a rerun with the same fingerprint has nothing to do).
+        """
+        self.complete = True
+        self.save()
+
+    def save(self):
+        manifest = {'fingerprint': self.fingerprint, 'chunks': self.chunks, 'size': self.size,
+                    'state': self.state, 'complete': self.complete}
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(manifest, f)
+        os.replace(self.path + '.tmp', self.path)
+
+
+def file_fingerprint(path):
+    """
+    Fingerprint of a file from its path, size and modification time.
+    :param path: filename.
+    :return: dict.
+    """
+    stat = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime': stat.st_mtime_ns}
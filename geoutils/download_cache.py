@@ -0,0 +1,202 @@
+import os
+import json
+import socket
+import hashlib
+import threading
+from contextlib import contextmanager
+import requests
+import pandas as pd
+from .geo_utils import USER_AGENT, read_csv_content
+from .metrics import METRICS
+try:
+    import fcntl
+    msvcrt = None
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+
+class DownloadCache:
+    """
+    On-disk cache of downloads (e.g. DEFRA PCM csv files and the pcm-data catalogue page). Files are stored by
+    the sha256 of their content and an index maps each url to its content hash, encoding, ETag and Last-Modified
+    headers, which are used to revalidate the cached copy with a conditional request. Csv files are stored already
+    parsed in the feather format, so a repeat run needs neither the network nor csv parsing. In offline mode no
+    requests are sent and only cached files are returned. A cache may be shared between threads and between
+    processes (e.g. on several nodes): files are written under names unique to the writer before being moved into
+    place and the index is merged with the entries of other processes under a file lock.
+    """
+
+    def __init__(self, cache_dir, offline=False):
+        self.cache_dir = cache_dir
+        self.offline = offline
+        self.index_file = os.path.join(cache_dir, 'index.json')
+        os.makedirs(os.path.join(cache_dir, 'objects'), exist_ok=True)
+        if os.path.exists(self.index_file):
+            with open(self.index_file) as f:
+                self.index = json.load(f)
+        else:
+            self.index = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    @property
+    def session(self):
+        """
+        requests.Session of the current thread.
+        """
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def object_path(self, sha, header=None):
+        """
+        Path of a cached file, or of the parsed csv file if header is given.
+        """
+        name = sha if header is None else f"{sha}.header{header}.feather"
+        return os.path.join(self.cache_dir, 'objects', name)
+
+    def fetch(self, url, header=None):
+        """
+        Download url unless the cached copy is still valid.
+        :param url: url.
+        :param header: header line for csv files (cached copies are parsed files).
+        :return: tuple of content hash (None if not available) and downloaded bytes (None if the cached copy
+        is to be used).
+        """
+        entry = self.index.get(url)
+        cached = entry is not None and os.path.exists(self.object_path(entry['sha256'], header))
+        if self.offline:
+            if not cached:
+                print(f"Error: {url} not found in the download cache (offline mode).")
+                METRICS.add('download_cache_misses')
+                return None, None
+            METRICS.add('download_cache_hits')
+            return entry['sha256'], None
+
+        headers = dict(USER_AGENT)
+        if cached:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        try:
+            response = self.session.get(url, headers=headers)
+        except requests.RequestException as e:
+            if cached:
+                print(f"Warning: could not revalidate {url} ({type(e).__name__}), using cached copy.")
+                METRICS.add('download_cache_hits')
+                return entry['sha256'], None
+            raise
+        METRICS.add('http_requests')
+        METRICS.add('http_bytes', len(response.content))
+
+        if response.status_code == 304 and cached:
+            METRICS.add('download_cache_hits')
+            return entry['sha256'], None
+        METRICS.add('download_cache_misses')
+        if response.status_code != 200:
+            print("Error: Not Found." if response.status_code == 404 else f"Error: HTTP {response.status_code}.")
+            return None, None
+
+        sha = hashlib.sha256(response.content).hexdigest()
+        with self.lock:
+            self.index[url] = {
+                'sha256': sha,
+                'encoding': response.encoding or response.apparent_encoding,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified')
+            }
+            self.save_index(url)
+        return sha, response.content
+
+    def get_content(self, url):
+        """
+        Cached equivalent of requests.get(url).content.
+        :param url: url.
+        :return: bytes (None if not available).
+        """
+        sha, content = self.fetch(url)
+        if sha is None:
+            return None
+        path = self.object_path(sha)
+        if content is None:
+            with open(path, 'rb') as f:
+                return f.read()
+        if not os.path.exists(path):
+            self.write(path, content)
+        return content
+
+    def get_dataframe(self, link, header):
+        """
+        Cached equivalent of geoutils.request_url_to_dataframe.
+        :param link: url to csv file with pollution data.
+        :param header: Header line in the file.
+        :return: pandas dataframe with pollution data (None if not available).
+        """
+        if 'csv' not in link:
+            print("Error: expected a http connection to a csv file.")
+            return None
+        sha, content = self.fetch(link, header)
+        if sha is None:
+            return None
+        path = self.object_path(sha, header)
+        if content is None or os.path.exists(path):
+            return pd.read_feather(path)
+        df = read_csv_content(content, header, self.index[link].get('encoding') or 'latin-1')
+        tmp = tmp_name(path)
+        df.to_feather(tmp)
+        os.replace(tmp, path)
+        return df
+
+    def write(self, path, content):
+        tmp = tmp_name(path)
+        with open(tmp, 'wb') as f:
+            f.write(content)
+        os.replace(tmp, path)
+
+    @contextmanager
+    def index_lock(self):
+        """
+        Exclusive lock of the index between processes (released by the system if a process crashes).
+        """
+        with open(self.index_file + '.lock', 'a+') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def save_index(self, *urls):
+        """
+        Write the entries of urls to the index, merged with the index on disk (entries written by other
+        processes since it was read are kept and loaded).
+        :param urls: urls whose entries changed.
+        """
+        with self.index_lock():
+            index = {}
+            if os.path.exists(self.index_file):
+                with open(self.index_file) as f:
+                    index = json.load(f)
+            index.update({url: self.index[url] for url in urls})
+            tmp = tmp_name(self.index_file)
+            with open(tmp, 'w') as f:
+                json.dump(index, f, indent=1)
+            os.replace(tmp, self.index_file)
+        self.index = index
+
+
+def tmp_name(path):
+    """
+    Temporary filename next to path, unique to the host, process and thread writing it.
+    """
+    return f'{path}.{socket.gethostname()}.{os.getpid()}.{threading.get_ident()}.tmp'
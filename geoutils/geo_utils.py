@@ -3,18 +3,32 @@ import re
 import pandas as pd
 import numpy as np
 import io
+from .metrics import METRICS
 
-def geocode_uk(postcode):
+POSTCODES_IO_URL = 'http://api.postcodes.io/postcodes'
+
+USER_AGENT = {
+    "User-Agent":
+        'Mozilla/5.0 (Windows NT 6.3; WOW64) '
+        'AppleWebKit/537.36 (KHTML, like Gecko) '
+        'Chrome/59.0.3071.115 Safari/537.36'
+}
+
+
+def geocode_uk(postcode, session=None, url=POSTCODES_IO_URL):
     """
     Convert UK postcode into geographical co-ordinates by querying https://postcodes.io/.
     Co-ordinate reference system (CRS):
     - Brittish National Grid for English, Scottish and Welsh postcodes
     - Irish National Grid for Northern Irish postcodes.
     :param postcode: postcode.
+    :param session: optional requests.Session to reuse connections between calls.
+    :param url: postcodes endpoint of postcodes.io (e.g. a local stand-in server for benchmarks).
     :return: 1 dimensional numpy array of postcode, easting, northing, country.
     """
-    url = 'http://api.postcodes.io/postcodes/' + re.sub(r"\s+|\W+", '', str(postcode))
-    response = requests.get(url)
+    response = (session or requests).get(url + '/' + clean_postcode(postcode))
+    METRICS.add('http_requests')
+    METRICS.add('http_bytes', len(response.content))
 
     if response.status_code == 200:
         info = response.json()["result"]
@@ -25,6 +39,60 @@ def geocode_uk(postcode):
         return [info, info, info, info]
 
 
+def geocode_uk_batch(postcodes, batch_size=100, session=None, url=POSTCODES_IO_URL):
+    """
+    Convert UK postcodes into geographical co-ordinates using the bulk lookup endpoint of https://postcodes.io/.
+    Up to 100 postcodes are sent per request over a single keep-alive session. Postcodes without a bulk result
+    are looked up individually so that the error message matches geocode_uk ('Invalid postcode' or
+    'Postcode not found').
+    :param postcodes: list of postcodes.
+    :param batch_size: number of postcodes per bulk request (max 100).
+    :param session: optional requests.Session, a new session is opened (and closed) if not given.
+    :param url: postcodes endpoint of postcodes.io.
+    :return: list of [postcode, easting, northing, country] lists in the same order as postcodes.
+    """
+    postcodes = list(postcodes)
+    batch_size = max(1, min(int(batch_size), 100))
+    own_session = session is None
+    if own_session:
+        session = requests.Session()
+
+    results = []
+    try:
+        for start in range(0, len(postcodes), batch_size):
+            chunk = postcodes[start:start + batch_size]
+            cleaned = [clean_postcode(postcode) for postcode in chunk]
+            response = session.post(url, json={'postcodes': cleaned})
+            METRICS.add('http_requests')
+            METRICS.add('http_bytes', len(response.content))
+            if response.status_code == 200:
+                lookup = response.json()["result"]
+                for postcode, item in zip(chunk, lookup):
+                    info = item["result"]
+                    if info is None:
+                        results.append(geocode_uk(postcode, session=session, url=url))
+                    else:
+                        results.append([info['postcode'], info['eastings'], info['northings'],
+                                        info['country']])
+            else:
+                results.extend(geocode_uk(postcode, session=session, url=url) for postcode in chunk)
+            if len(postcodes) > batch_size:
+                METRICS.progress('geocode_uk_batch', len(results), len(postcodes))
+    finally:
+        if own_session:
+            session.close()
+    return results
+
+
+def clean_postcode(postcode):
+    """
+    Remove whitespace and non-alphanumeric characters from a postcode.
+    :param postcode: postcode.
+    :return: cleaned postcode (str).
+    """
+    return re.sub(r"\s+|\W+", '', str(postcode))
+
+
 def geocode(postcode):
     """
     Convert worldwide postcode to latitude and longitude by scraping worldpostalcode.com.
@@ -55,7 +123,8 @@ def random_postcode(n):
 
 def find_nearest_idx(array, value):
     """
-    Returns indicies of an column that are closest to a value (includes all occurances).
+    Returns indicies of an column that are closest to a value (includes all occurances). For many values use
+    find_nearest_idxs or NearestValueIndex, which sort the array once.
     :param array: array
     :param value: value
     :return: list of indicies of the array.
@@ -72,31 +141,97 @@ def find_nearest_idx(array, value):
         return np.nan
 
 
-def request_url_to_dataframe(link, header):
+class NearestValueIndex:
+    """
+    Batch equivalent of find_nearest_idx: the values of an array are sorted once and each query is answered with
+    a binary search, returning all indices of the array tied for the nearest value.
+    """
+
+    def __init__(self, array):
+        """
+        :param array: array of numbers (or of strings of numbers, e.g. years). NaN values are never returned. If
+        the array cannot be converted to numbers every query returns NaN, as find_nearest_idx does.
+        """
+        try:
+            array = np.asarray(array).astype(float)
+        except ValueError:
+            array = np.array([])
+        indices = np.flatnonzero(~np.isnan(array))
+        order = np.argsort(array[indices], kind='stable')
+        self.indices = indices[order]
+        self.values = array[self.indices]
+
+    def nearest_idx(self, values):
+        """
+        Indices of the array closest to each value (includes all occurrences).
+        :param values: array of values (strings of numbers are converted, other values give NaN).
+        :return: list with a list of indices of the array (in increasing order) or NaN for each value.
+        """
+        values = pd.to_numeric(pd.Series(np.asarray(values, dtype=object)), errors='coerce').to_numpy(float)
+        n = len(self.values)
+        result = [np.nan] * len(values)
+        if n == 0:
+            return result
+        valid = np.flatnonzero(~np.isnan(values))
+        q = values[valid]
+        pos = np.searchsorted(self.values, q)
+        left = self.values[np.clip(pos - 1, 0, n - 1)]
+        right = self.values[np.clip(pos, 0, n - 1)]
+        dl = np.where(pos > 0, np.abs(left - q), np.inf)
+        dr = np.where(pos < n, np.abs(right - q), np.inf)
+        best = np.minimum(dl, dr)
+
+        # ranges of sorted positions holding the nearest value(s) below and above each query
+        lo = np.where(dl == best, np.searchsorted(self.values, left, side='left'), pos)
+        hi = np.where(dr == best, np.searchsorted(self.values, right, side='right'), pos)
+        for i, start, stop in zip(valid, lo, hi):
+            result[i] = np.sort(self.indices[start:stop]).tolist()
+        return result
+
+
+def find_nearest_idxs(array, values):
+    """
+    Returns indices of an array that are closest to each of many values (see NearestValueIndex).
+    :param array: array
+    :param values: values
+    :return: list of lists of indices of the array (NaN for values that are not numbers).
+    """
+    return NearestValueIndex(array).nearest_idx(values)
+
+
+def request_url_to_dataframe(link, header, cache=None):
     """
     Read in pollution data.
     :param header: Header line in the file.
     :param link: url to csv file with pollution data.
+    :param cache: optional geoutils.DownloadCache used to store and revalidate downloads.
     :return: pandas dataframe with pollutaion data with the following columns: unique code for 1x1km grid
     square (ukgridcode), easting (x), northing (y), and header label referring to the pollutant and
     the year (i.e 'pm102008g' for PM10 pollution data from the year 2008).
     """
-    agent = {
-        "User-Agent":
-            'Mozilla/5.0 (Windows NT 6.3; WOW64) '
-            'AppleWebKit/537.36 (KHTML, like Gecko) '
-            'Chrome/59.0.3071.115 Safari/537.36'
-    }
+    if cache is not None:
+        return cache.get_dataframe(link, header)
     if 'csv' not in link:
         print("Error: expected a http connection to a csv file.")
     else:
-        f = requests.get(link, headers=agent)
+        f = requests.get(link, headers=USER_AGENT)
+        METRICS.add('http_requests')
+        METRICS.add('http_bytes', len(f.content))
         if f.status_code == 200:
-            df = pd.read_csv(io.StringIO(f.text),
-                             low_memory=False, na_values=['NA', 'NaN', 'MISSING'],
-                             header=header)
-            return df
+            # decode as requests does for response.text (charset of the response or guessed)
+            return read_csv_content(f.content, header, f.encoding or f.apparent_encoding)
         elif f.status_code == 404:
             print("Error: Not Found.")
 
 
+def read_csv_content(content, header, encoding='latin-1'):
+    """
+    Parse downloaded pollution data.
+    :param content: bytes of the csv file.
+    :param header: Header line in the file.
+    :param encoding: encoding of the response (requests uses ISO-8859-1 for text/csv responses without a charset).
+    :return: pandas dataframe with pollution data.
+    """
+    return pd.read_csv(io.BytesIO(content), encoding=encoding,
+                       low_memory=False, na_values=['NA', 'NaN', 'MISSING'],
+                       header=header)
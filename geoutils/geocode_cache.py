@@ -0,0 +1,90 @@
+import sqlite3
+import time
+from .geo_utils import clean_postcode
+from .metrics import METRICS
+
+# Error messages from https://postcodes.io/ that are a property of the postcode (safe to cache).
+NEGATIVE_RESULTS = ('Invalid postcode', 'Postcode not found')
+
+
+class GeocodeCache:
+    """
+    Persistent geocode cache stored in a SQLite database and keyed by normalised postcode. Successful lookups
+    are kept indefinitely; negative results ('Invalid postcode', 'Postcode not found') expire after
+    negative_ttl seconds. Any other error (e.g. rate limiting) is never cached.
+    """
+
+    def __init__(self, path, negative_ttl=30 * 24 * 3600):
+        self.path = path
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self.con = sqlite3.connect(path)
+        self.con.execute(
+            "CREATE TABLE IF NOT EXISTS geocodes ("
+            "key TEXT PRIMARY KEY, postcode TEXT, eastings REAL, northings REAL, country TEXT, "
+            "error TEXT, updated REAL)"
+        )
+        self.con.commit()
+
+    def get_many(self, keys):
+        """
+        Look up normalised postcodes in the cache.
+        :param keys: list of normalised postcodes.
+        :return: dict of key to [postcode, easting, northing, country] for keys found in the cache.
+        """
+        keys = list(keys)
+        expired = time.time() - self.negative_ttl
+        found = {}
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            query = ("SELECT key, postcode, eastings, northings, country, error FROM geocodes "
+                     "WHERE key IN (" + ",".join("?" * len(chunk)) + ") AND (error IS NULL OR updated > ?)")
+            for key, postcode, eastings, northings, country, error in self.con.execute(query, chunk + [expired]):
+                found[key] = [error] * 4 if error else [postcode, eastings, northings, country]
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        METRICS.add('geocode_cache_hits', len(found))
+        METRICS.add('geocode_cache_misses', len(keys) - len(found))
+        return found
+
+    def put_many(self, results):
+        """
+        Store geocoded postcodes in the cache.
+        :param results: dict of normalised postcode to [postcode, easting, northing, country].
+        """
+        now = time.time()
+        rows = []
+        for key, row in results.items():
+            if row[0] == row[1]:
+                if row[0] in NEGATIVE_RESULTS:
+                    rows.append((key, None, None, None, None, row[0], now))
+            else:
+                rows.append((key, row[0], row[1], row[2], row[3], None, now))
+        self.con.executemany("INSERT OR REPLACE INTO geocodes VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        self.con.commit()
+
+    def close(self):
+        self.con.close()
+
+
+def geocode_uk_unique(postcodes, geocoder, cache=None):
+    """
+    Geocode each distinct (normalised) postcode once and join the results back to the input order.
+    :param postcodes: list of postcodes.
+    :param geocoder: function taking a list of postcodes and returning a list of
+    [postcode, easting, northing, country] lists (e.g. geoutils.geocode_uk_batch).
+    :param cache: optional GeocodeCache consulted before and updated after geocoding.
+    :return: list of [postcode, easting, northing, country] lists in the same order as postcodes.
+    """
+    keys = [clean_postcode(postcode).upper() for postcode in postcodes]
+    unique = list(dict.fromkeys(keys))
+
+    results = cache.get_many(unique) if cache is not None else {}
+    missing = [key for key in unique if key not in results]
+    if missing:
+        geocoded = dict(zip(missing, geocoder(missing)))
+        if cache is not None:
+            cache.put_many(geocoded)
+        results.update(geocoded)
+    return [list(results[key]) for key in keys]
@@ -0,0 +1,231 @@
+import os
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+from pyproj import CRS, Transformer
+from pyproj.exceptions import CRSError
+from .area_index import BNG
+
+# Geocoding errors written to the eastings/northings/country columns by preprocess_postcode_data.py
+GEOCODE_ERRORS = ('Postcode not found', 'Invalid postcode')
+
+# Values of the status column of typed geocodes (position in the tuple); any other error is 'Error'
+GEOCODE_STATUS = ('OK', 'Invalid postcode', 'Postcode not found', 'Error')
+
+# Columns stored as categoricals in columnar files
+CATEGORICAL_COLUMNS = ('year', 'country', 'pollutant', 'crs')
+
+# Irish Grid (TM75) co-ordinate reference system of Northern Irish postcodes (postcodes.io and the ONSPD)
+IRISH_GRID = 'epsg:29903'
+
+# CRS of the co-ordinates returned by the geocoders by country (BNG for any other country)
+COUNTRY_CRS = {'Northern Ireland': IRISH_GRID}
+
+# Columnar file formats by file extension
+COLUMNAR_FORMATS = {'.parquet': 'parquet', '.feather': 'feather'}
+
+
+def table_format(path):
+    """
+    File format of a table from its extension.
+    :param path: filename.
+    :return: 'parquet', 'feather' or 'csv' (any other extension, including compressed csv files).
+    """
+    return COLUMNAR_FORMATS.get(os.path.splitext(str(path))[1].lower(), 'csv')
+
+
+def read_table(path, **kwargs):
+    """
+    Read a csv, parquet or feather file (see table_format).
+    :param path: filename.
+    :param kwargs: keyword arguments of pd.read_csv. Columnar files only take dtype (a type or dict of column
+    to type, applied after reading), na_values (a list of values replaced with NaN) and keep_default_na (no
+    effect, columnar files are not parsed from text).
+    :return: DataFrame (year, country and pollutant columns of columnar files as categoricals, unless given
+    another dtype).
+    """
+    fmt = table_format(path)
+    if fmt == 'csv':
+        return pd.read_csv(path, **kwargs)
+    unsupported = [key for key in kwargs if key not in ('dtype', 'na_values', 'keep_default_na')]
+    if unsupported:
+        raise TypeError(f"Argument(s) {', '.join(unsupported)} not supported for {fmt} files.")
+    data = pd.read_parquet(path) if fmt == 'parquet' else pd.read_feather(path)
+    # parquet only keeps string categoricals
+    data = data.astype({col: 'category' for col in CATEGORICAL_COLUMNS if col in data.columns})
+    if kwargs.get('na_values') is not None:
+        na_values = list(kwargs['na_values'])
+        for col in data.columns:
+            missing = data[col].isin(na_values)
+            if missing.any():
+                data[col] = data[col].mask(missing)
+    dtype = kwargs.get('dtype')
+    if dtype is not None:
+        dtypes = dtype if isinstance(dtype, dict) else {col: dtype for col in data.columns}
+        for col, col_type in dtypes.items():
+            if col not in data.columns:
+                continue
+            if col_type in (str, 'str'):
+                # as read_csv: values as strings, missing values kept
+                data[col] = data[col].astype(object).map(str, na_action='ignore')
+            else:
+                data[col] = data[col].astype(col_type)
+    return data
+
+
+def write_table(data, path):
+    """
+    Write a DataFrame to a csv (compression inferred from the extension), parquet or feather file (see
+    table_format). In columnar files the year, country and pollutant columns are stored as categoricals.
+    :param data: DataFrame.
+    :param path: filename.
+    """
+    fmt = table_format(path)
+    if fmt == 'csv':
+        data.to_csv(path, index=False)
+        return
+    data = data.reset_index(drop=True).astype({col: 'category' for col in CATEGORICAL_COLUMNS
+                                               if col in data.columns})
+    if fmt == 'parquet':
+        data.to_parquet(path, index=False)
+    else:
+        data.to_feather(path)
+
+
+def typed_geocodes(data):
+    """
+    Convert geocoded data with error messages in the postcode, eastings, northings and country columns (output
+    of geocode_uk) to typed columns: numeric co-ordinates (NaN for errors), a small integer status column
+    (position in GEOCODE_STATUS) and missing postcode and country for errors.
+    :param data: DataFrame with postcode, eastings, northings and country columns.
+    :return: DataFrame with the status column inserted after the country column.
+    """
+    errors = data['eastings'].where(data['eastings'].astype(str) == data['country'].astype(str))
+    status = np.where(errors.isna(), 0, len(GEOCODE_STATUS) - 1)
+    for code, message in enumerate(GEOCODE_STATUS[1:-1], start=1):
+        status[(errors == message).to_numpy()] = code
+    ok = status == 0
+    data = data.assign(
+        postcode=data['postcode'].where(ok),
+        eastings=pd.to_numeric(data['eastings'].where(ok), errors='coerce').astype(float),
+        northings=pd.to_numeric(data['northings'].where(ok), errors='coerce').astype(float),
+        country=data['country'].where(ok)
+    )
+    data.insert(data.columns.get_loc('country') + 1, 'status', status.astype(np.int8))
+    return data
+
+
+@lru_cache(maxsize=None)
+def crs_transformer(source, target):
+    """
+    Transformer between two co-ordinate reference systems, created once per pair and kept for later calls.
+    :param source: source CRS (e.g. 'epsg:29903').
+    :param target: target CRS (e.g. 'epsg:27700').
+    :return: pyproj.Transformer taking and returning (x, y) co-ordinates.
+    """
+    return Transformer.from_crs(source, target, always_xy=True)
+
+
+def check_metre_crs(crs):
+    """
+    Check that a co-ordinate reference system is projected with axes in metres (co-ordinates in other CRSs, e.g.
+    degrees of latitude and longitude, cannot be rounded to whole metres).
+    :param crs: CRS (e.g. 'epsg:27700').
+    :return: crs.
+    """
+    try:
+        projected = CRS(crs)
+    except CRSError as e:
+        raise ValueError(f"Invalid co-ordinate reference system {crs}: {e}")
+    if not projected.is_projected or any(axis.unit_name != 'metre' for axis in projected.axis_info):
+        raise ValueError(f"Co-ordinate reference system {crs} is not projected with axes in metres.")
+    return crs
+
+
+def normalise_crs(data, target=BNG, country_crs=COUNTRY_CRS):
+    """
+    Transform the co-ordinates of geocoded data into one co-ordinate reference system and record it in a crs
+    column. The CRS of each row is read from the crs column if present (so normalising twice is harmless),
+    otherwise from the country (see COUNTRY_CRS). The co-ordinates of each source CRS are transformed in one
+    array call and rounded to whole metres (as returned by the geocoders). Rows without numeric co-ordinates
+    (geocoding errors) are left unchanged with a missing crs.
+    :param data: DataFrame with eastings, northings and country columns.
+    :param target: target CRS, projected with axes in metres (see check_metre_crs).
+    :param country_crs: dict of country to CRS of its co-ordinates (BNG for other countries).
+    :return: DataFrame with the crs column after the country column.
+    """
+    check_metre_crs(target)
+    eastings = pd.to_numeric(data['eastings'], errors='coerce').to_numpy(float)
+    northings = pd.to_numeric(data['northings'], errors='coerce').to_numpy(float)
+    valid = ~np.isnan(eastings) & ~np.isnan(northings)
+    if 'crs' in data.columns:
+        source = data['crs'].astype(object).where(data['crs'].notna(), BNG).to_numpy()
+    else:
+        source = data['country'].astype(object).map(country_crs).fillna(BNG).to_numpy()
+
+    crs = np.where(valid, target, None).astype(object)
+    new_eastings, new_northings = data['eastings'].to_numpy(object).copy(), data['northings'].to_numpy(object).copy()
+    for group in pd.unique(source[valid]):
+        if group == target:
+            continue
+        rows = valid & (source == group)
+        x, y = crs_transformer(group, target).transform(eastings[rows], northings[rows])
+        new_eastings[rows], new_northings[rows] = np.round(x).astype(np.int64), np.round(y).astype(np.int64)
+
+    data = data.assign(eastings=pd.Series(new_eastings, index=data.index).infer_objects(),
+                       northings=pd.Series(new_northings, index=data.index).infer_objects())
+    if 'crs' in data.columns:
+        data['crs'] = crs
+    else:
+        data.insert(data.columns.get_loc('country') + 1, 'crs', crs)
+    return data
+
+
+def read_geocoded(path, idcol):
+    """
+    Read and validate geocoded data (output of preprocess_postcode_data.py, csv or typed columnar file). Rows
+    with a geocoding error or missing co-ordinates are dropped and the co-ordinates are returned as integers.
+    :param path: csv, parquet or feather file with participant IDs, year, postcode, eastings, northings and
+    country columns.
+    :param idcol: column name for participant IDs.
+    :return: DataFrame.
+    """
+    data = read_table(path, dtype={idcol: str}, na_values=list(GEOCODE_ERRORS))
+    missing = [col for col in [idcol, 'year', 'eastings', 'northings'] if col not in data.columns]
+    if missing:
+        raise ValueError(f"Column(s) {', '.join(missing)} not found in {path}.")
+    eastings = pd.to_numeric(data['eastings'], errors='coerce')
+    northings = pd.to_numeric(data['northings'], errors='coerce')
+    valid = eastings.notna() & northings.notna() & data['year'].notna()
+    if 'status' in data.columns:
+        valid &= data['status'] == 0
+    data = data[valid].reset_index(drop=True)
+    return data.assign(eastings=eastings[valid].astype(np.int64).to_numpy(),
+                       northings=northings[valid].astype(np.int64).to_numpy())
+
+
+class CoordinateTable:
+    """
+    Distinct co-ordinates (and years) of geocoded data. Linkers work on the distinct rows, as participants often
+    share a postcode, and their results are broadcast back to the rows of the data.
+    """
+
+    def __init__(self, data, columns=('eastings', 'northings', 'year')):
+        """
+        :param data: DataFrame with the columns.
+        :param columns: columns identifying a distinct row.
+        """
+        codes, uniques = pd.MultiIndex.from_frame(data[list(columns)]).factorize()
+        self.coords = uniques.to_frame(index=False, name=list(columns))
+        self.inverse = codes
+
+    def __len__(self):
+        return len(self.coords)
+
+    def broadcast(self, linked):
+        """
+        Broadcast results for the distinct rows back to the rows of the data.
+        :param linked: DataFrame with a row per distinct row (in the order of coords).
+        :return: DataFrame with a row per row of the data.
+        """
+        return linked.reset_index(drop=True).iloc[self.inverse].reset_index(drop=True)
@@ -0,0 +1,80 @@
+import os
+import numpy as np
+import pandas as pd
+from .geocoded import read_table, write_table, table_format
+from .metrics import METRICS
+
+
+def row_fingerprints(data, columns, version=None):
+    """
+    Fingerprint of each row of the input of a run from the values of some columns (compared as strings, so that
+    e.g. 2008 and '2008' match) and the version of the external datasets used for the row.
+    :param data: DataFrame.
+    :param columns: columns identifying the row and its inputs (e.g. ID, year and postcode).
+    :param version: optional dataset version: a string for all rows or an array of strings (one per row), e.g.
+    the download links of the pollution data of the year of each row.
+    :return: numpy array of uint64.
+    """
+    frame = data[list(columns)].astype(str).reset_index(drop=True)
+    if version is not None:
+        frame['version'] = np.broadcast_to(np.asarray(version, dtype=object), len(frame))
+    return pd.util.hash_pandas_object(frame, index=False).to_numpy(np.uint64)
+
+
+class IncrementalOutput:
+    """
+    Output of a run updated incrementally: the fingerprints of the input rows (see row_fingerprints) of each
+    output row are kept next to the output (output + '.fingerprints.npy'). On a rerun only the rows whose
+    fingerprint is not found in the previous output are computed; previous output rows whose fingerprint is still
+    in the input are kept (in their previous order) and the computed rows are appended. Rows of the previous
+    output no longer in the input are dropped. Csv outputs are read back as text so that kept rows are written
+    unchanged.
+    """
+
+    def __init__(self, path, fingerprints):
+        """
+        :param path: output filename (csv, parquet or feather, see write_table).
+        :param fingerprints: fingerprints of the rows of the input of this run.
+        """
+        self.path = path
+        self.sidecar = path + '.fingerprints.npy'
+        self.fingerprints = np.asarray(fingerprints, dtype=np.uint64)
+        self.previous = None
+        self.previous_fingerprints = np.array([], dtype=np.uint64)
+        if os.path.exists(path) and os.path.exists(self.sidecar):
+            kwargs = {'dtype': str, 'keep_default_na': False} if table_format(path) == 'csv' else {}
+            previous = read_table(path, **kwargs)
+            previous_fingerprints = np.load(self.sidecar)
+            if len(previous) == len(previous_fingerprints):
+                self.previous = previous
+                self.previous_fingerprints = previous_fingerprints
+        self.kept = np.isin(self.previous_fingerprints, self.fingerprints)
+        self.changed = ~np.isin(self.fingerprints, self.previous_fingerprints[self.kept])
+
+    def merge(self, computed, fingerprints):
+        """
+        Merge the rows computed for the changed input rows into the kept rows of the previous output.
+        :param computed: DataFrame of the rows computed in this run.
+        :param fingerprints: fingerprints of the input rows of the computed rows.
+        :return: tuple of the merged DataFrame and its fingerprints.
+        """
+        METRICS.add('incremental_rows_kept', int(self.kept.sum()))
+        METRICS.add('incremental_rows_computed', len(computed))
+        if not self.kept.any():
+            return computed.reset_index(drop=True), np.asarray(fingerprints, dtype=np.uint64)
+        data = pd.concat([self.previous[self.kept], computed], ignore_index=True)
+        return data, np.concatenate([self.previous_fingerprints[self.kept],
+                                     np.asarray(fingerprints, dtype=np.uint64)])
+
+    def write(self, data, fingerprints):
+        """
+        Write the output and its fingerprints. The previous fingerprints are removed first and the new ones
+        written last, so a run following an interrupted write starts again from scratch.
+        :param data: DataFrame (see merge).
+        :param fingerprints: fingerprints of the rows of data.
+        """
+        if os.path.exists(self.sidecar):
+            os.remove(self.sidecar)
+        write_table(data, self.path)
+        np.save(self.sidecar + '.tmp.npy', np.asarray(fingerprints, dtype=np.uint64))
+        os.replace(self.sidecar + '.tmp.npy', self.sidecar)
@@ -0,0 +1,164 @@
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+try:
+    import resource
+except ImportError:
+    # not available on Windows (see peak_rss_mb)
+    resource = None
+
+
+class RunMetrics:
+    """
+    Instrumentation of a run: counters shared by geoutils and scrapedefra (e.g. http_requests, http_bytes,
+    http_retries and <cache>_hits/<cache>_misses), per-stage wall time, counter increments, rows processed per
+    second and peak resident set size, throttled live progress messages and a JSON summary. The module level
+    instance METRICS is used by the library; counters can be incremented from any thread.
+    """
+
+    def __init__(self, progress_interval=10):
+        """
+        :param progress_interval: minimum number of seconds between progress messages of a stage (None for no
+        progress messages, e.g. in worker processes).
+        """
+        self.progress_interval = progress_interval
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Clear counters and stages (e.g. at the start of a run).
+        """
+        with self.lock:
+            self.counters = {}
+            self.stages = []
+            self.started = time.time()
+            self.last_progress = {}
+
+    def snapshot(self):
+        """
+        Copy of the counters, e.g. to compute the increments of a task with increments.
+        :return: dict.
+        """
+        with self.lock:
+            return dict(self.counters)
+
+    def increments(self, before):
+        """
+        Counter increments since a snapshot.
+        :param before: dict returned by snapshot.
+        :return: dict of the counters that changed.
+        """
+        with self.lock:
+            return {key: value - before.get(key, 0) for key, value in self.counters.items()
+                    if value != before.get(key, 0)}
+
+    def add(self, name, n=1):
+        """
+        Increment a counter.
+        :param name: counter name.
+        :param n: increment.
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        """
+        Measure a stage of a run:
+
+            with METRICS.stage('geocode', rows=len(postcodes)) as stage:
+                ...
+                stage['rows'] = n  # if only known at the end
+
+        The counters of a stage are the increments during the stage (including those of stages running
+        concurrently in other threads).
+        :param name: name of the stage.
+        :param rows: number of rows processed by the stage.
+        :return: dict of the stage metrics (filled in on exit).
+        """
+        before = self.snapshot()
+        stage = {'stage': name, 'rows': rows}
+        start = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            seconds = time.perf_counter() - start
+            counters = self.increments(before)
+            with self.lock:
+                self.last_progress.pop(name, None)
+            stage.update(seconds=round(seconds, 3), counters=counters, peak_rss_mb=_round_mb(peak_rss_mb()))
+            if stage['rows'] is not None:
+                stage['rows_per_second'] = round(stage['rows'] / seconds, 1) if seconds > 0 else None
+            with self.lock:
+                self.stages.append(stage)
+
+    def progress(self, name, done, total=None):
+        """
+        Print a progress message for a long stage, at most every progress_interval seconds.
+        :param name: name of the stage.
+        :param done: number of rows (or requests) done.
+        :param total: total number of rows (or requests).
+        """
+        if self.progress_interval is None:
+            return
+        now = time.time()
+        with self.lock:
+            first = self.last_progress.setdefault(name, (now, now))[0]
+            if now - self.last_progress[name][1] < self.progress_interval and done != total:
+                return
+            self.last_progress[name] = (first, now)
+        rate = done / (now - first) if now > first else 0
+        of = f"/{total}" if total is not None else ""
+        print(f"  {name}: {done}{of} ({rate:.0f}/s)", file=sys.stderr, flush=True)
+
+    def summary(self):
+        """
+        Metrics of the run: counters, cache hit ratios, stages, total wall time and peak resident set size.
+        :return: dict.
+        """
+        with self.lock:
+            counters = dict(self.counters)
+            stages = list(self.stages)
+        ratios = {}
+        for key in counters:
+            if key.endswith('_hits'):
+                cache = key[:-len('_hits')]
+                total = counters[key] + counters.get(cache + '_misses', 0)
+                ratios[cache] = round(counters[key] / total, 4) if total else None
+        return {'started': self.started, 'seconds': round(time.time() - self.started, 3), 'counters': counters,
+                'cache_hit_ratios': ratios, 'stages': stages, 'peak_rss_mb': _round_mb(peak_rss_mb())}
+
+    def write(self, path):
+        """
+        Write the summary to a JSON file.
+        :param path: filename.
+        """
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of the process in MB (peak working set with psutil where the resource module is not
+    available, e.g. on Windows).
+    :return: float or None if it cannot be measured.
+    """
+    if resource is not None:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss / 2 ** 20 if sys.platform == 'darwin' else rss / 2 ** 10
+    try:
+        import psutil
+    except ImportError:
+        return None
+    memory = psutil.Process().memory_info()
+    return getattr(memory, 'peak_wset', memory.rss) / 2 ** 20
+
+
+def _round_mb(mb):
+    return None if mb is None else round(mb, 1)
+
+
+METRICS = RunMetrics()
@@ -0,0 +1,171 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+from .checkpoint import file_fingerprint
+
+# ONSPD country codes and the country names returned by https://postcodes.io/
+ONSPD_COUNTRIES = {
+    'E92000001': 'England',
+    'W92000004': 'Wales',
+    'S92000003': 'Scotland',
+    'N92000002': 'Northern Ireland',
+    'L93000001': 'Channel Islands',
+    'M83000003': 'Isle of Man'
+}
+
+# Default arguments of PostcodeIndex.build (recorded with the index)
+BUILD_DEFAULTS = {'pcd_col': 'pcds', 'east_col': 'oseast1m', 'north_col': 'osnrth1m', 'country_col': 'ctry',
+                  'doterm_col': 'doterm', 'include_terminated': False}
+
+# Valid format of a postcode after removing whitespace and non-alphanumeric characters
+POSTCODE_REGEX = r"^(?:[A-Z]{1,2}[0-9][A-Z0-9]?[0-9][A-Z]{2}|GIR0AA)$"
+
+
+class PostcodeIndex:
+    """
+    Offline UK geocoder backed by an index built from the ONS Postcode Directory (ONSPD). The index is a
+    directory of numpy arrays (sorted normalised postcodes with matching eastings, northings and country codes)
+    which are memory-mapped on loading, so several processes can share one copy through the page cache, and
+    source.json with the fingerprint of the csv file and the arguments it was built with.
+    """
+
+    FILES = ('postcodes', 'eastings', 'northings', 'country', 'countries')
+
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        arrays = {name: np.load(os.path.join(index_dir, name + '.npy'), mmap_mode='r') for name in self.FILES}
+        self.postcodes = arrays['postcodes']
+        self.eastings = arrays['eastings']
+        self.northings = arrays['northings']
+        self.country = arrays['country']
+        self.countries = np.asarray(arrays['countries'])
+
+    @classmethod
+    def build(cls, csvfile, index_dir, pcd_col='pcds', east_col='oseast1m', north_col='osnrth1m',
+              country_col='ctry', doterm_col='doterm', include_terminated=False):
+        """
+        Build the on-disk index from an ONSPD-style CSV file.
+        :param csvfile: ONSPD csv file.
+        :param index_dir: directory to write the index to.
+        :param pcd_col: column name of the postcodes.
+        :param east_col: column name of the eastings.
+        :param north_col: column name of the northings.
+        :param country_col: column name of the country codes (ONSPD codes or country names).
+        :param doterm_col: column name of the date of termination (ignored if not in the file).
+        :param include_terminated: keep terminated postcodes (not returned by https://postcodes.io/).
+        :return: PostcodeIndex.
+        """
+        arguments = {'pcd_col': pcd_col, 'east_col': east_col, 'north_col': north_col, 'country_col': country_col,
+                     'doterm_col': doterm_col, 'include_terminated': include_terminated}
+        cols = [pcd_col, east_col, north_col, country_col]
+        header = pd.read_csv(csvfile, nrows=0).columns
+        if doterm_col in header and not include_terminated:
+            cols.append(doterm_col)
+        df = pd.read_csv(csvfile, usecols=cols, dtype={pcd_col: str, country_col: str, doterm_col: str},
+                         low_memory=False)
+        if doterm_col in df.columns:
+            df = df[df[doterm_col].isna()]
+
+        df['key'] = normalise_postcodes(df[pcd_col])
+        df = df[df['key'].str.match(POSTCODE_REGEX)]
+        df = df.drop_duplicates('key').sort_values('key')
+
+        country = df[country_col].fillna('').map(lambda c: ONSPD_COUNTRIES.get(c, c))
+        countries, codes = np.unique(country.to_numpy(dtype=str), return_inverse=True)
+
+        os.makedirs(index_dir, exist_ok=True)
+        if os.path.exists(os.path.join(index_dir, 'source.json')):
+            os.remove(os.path.join(index_dir, 'source.json'))
+        arrays = {
+            'postcodes': df['key'].to_numpy(dtype='S7'),
+            'eastings': pd.to_numeric(df[east_col], errors='coerce').to_numpy(dtype=float),
+            'northings': pd.to_numeric(df[north_col], errors='coerce').to_numpy(dtype=float),
+            'country': codes.astype(np.uint8),
+            'countries': countries
+        }
+        for name, array in arrays.items():
+            # replaced (not overwritten) so processes with the previous index memory-mapped keep reading it
+            with open(os.path.join(index_dir, name + '.npy.tmp'), 'wb') as f:
+                np.save(f, array)
+            os.replace(os.path.join(index_dir, name + '.npy.tmp'), os.path.join(index_dir, name + '.npy'))
+        # written last: an index without source.json is incomplete and built again
+        with open(os.path.join(index_dir, 'source.json.tmp'), 'w') as f:
+            json.dump({'source': file_fingerprint(csvfile), 'arguments': arguments}, f)
+        os.replace(os.path.join(index_dir, 'source.json.tmp'), os.path.join(index_dir, 'source.json'))
+        return cls(index_dir)
+
+    @classmethod
+    def from_onspd(cls, path, index_dir=None, **kwargs):
+        """
+        Load an index, building it first if path is an ONSPD csv file that has not been indexed yet, or was
+        indexed before it changed (size or modification time) or with other arguments.
+        :param path: index directory or ONSPD csv file.
+        :param index_dir: directory of the index (default: csv filename without extension + '_index').
+        :param kwargs: passed on to PostcodeIndex.build.
+        :return: PostcodeIndex.
+        """
+        if os.path.isdir(path):
+            return cls(path)
+        if index_dir is None:
+            index_dir = os.path.splitext(path)[0] + '_index'
+        source = os.path.join(index_dir, 'source.json')
+        if os.path.exists(source):
+            with open(source) as f:
+                built = json.load(f)
+            arguments = dict(BUILD_DEFAULTS, **kwargs)
+            if built['source'] == file_fingerprint(path) and built['arguments'] == arguments:
+                return cls(index_dir)
+        return cls.build(path, index_dir, **kwargs)
+
+    def lookup(self, postcodes):
+        """
+        Vectorised geocoding of a column of postcodes. Unknown postcodes are returned with the error message
+        in all four columns, as in geoutils.geocode_uk.
+        :param postcodes: list-like of postcodes.
+        :return: pandas DataFrame with columns: postcode, eastings, northings, country (same order as input).
+        """
+        keys = normalise_postcodes(pd.Series(np.asarray(postcodes, dtype=object)))
+        valid = keys.str.match(POSTCODE_REGEX).to_numpy(dtype=bool)
+        if len(self.postcodes) == 0:
+            # e.g. an ONSPD file filtered to no postcodes
+            out = pd.DataFrame(index=range(len(keys)), columns=['postcode', 'eastings', 'northings', 'country'],
+                               dtype=object)
+            out.loc[:, :] = 'Postcode not found'
+            out.loc[~valid, :] = 'Invalid postcode'
+            return out
+
+        queries = keys[valid].to_numpy(dtype='S7')
+        pos = np.searchsorted(self.postcodes, queries)
+        pos[pos == len(self.postcodes)] = 0
+        found = np.zeros(len(keys), dtype=bool)
+        found[valid] = self.postcodes[pos] == queries
+        idx = np.zeros(len(keys), dtype=np.int64)
+        idx[valid] = pos
+
+        out = pd.DataFrame({
+            'postcode': keys.str[:-3] + ' ' + keys.str[-3:],
+            'eastings': np.asarray(self.eastings[idx]),
+            'northings': np.asarray(self.northings[idx]),
+            'country': self.countries[np.asarray(self.country[idx])]
+        }).astype(object)
+        out.loc[~found, :] = 'Postcode not found'
+        out.loc[~valid, :] = 'Invalid postcode'
+        return out
+
+    def geocode(self, postcodes):
+        """
+        Offline equivalent of geoutils.geocode_uk_batch.
+        :param postcodes: list of postcodes.
+        :return: list of [postcode, easting, northing, country] lists in the same order as postcodes.
+        """
+        return self.lookup(postcodes).values.tolist()
+
+
+def normalise_postcodes(postcodes):
+    """
+    Vectorised version of geoutils.clean_postcode, also converting postcodes to upper case.
+    :param postcodes: pandas Series of postcodes.
+    :return: pandas Series of normalised postcodes.
+    """
+    return postcodes.astype(str).str.replace(r"\s+|\W+", '', regex=True).str.upper()
@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+import rasterio
+from rasterio.windows import Window
+from .zonal import SummedAreaTable, buffer_columns
+
+
+class RasterStack:
+    """
+    Several single-band rasters on the same grid (e.g. the percentage cover rasters of each land cover class)
+    viewed as one multi-band raster. Pixel indices of all co-ordinates are computed once for the whole stack and
+    each band is read in a single pass: either the window spanning all co-ordinates (when the co-ordinates are
+    spread out) or only the blocks that contain co-ordinates.
+    """
+
+    def __init__(self, paths, names=None, block_size=256):
+        self.paths = list(paths)
+        self.names = list(names) if names is not None else self.paths
+        self.block_size = block_size
+        self.datasets = [rasterio.open(path) for path in self.paths]
+        first = self.datasets[0]
+        for path, ds in zip(self.paths, self.datasets):
+            if ds.transform != first.transform or ds.shape != first.shape or ds.crs != first.crs:
+                self.close()
+                raise ValueError(f"Raster {path} is not on the same grid as {self.paths[0]}.")
+        self.transform = first.transform
+        self.shape = first.shape
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        for ds in self.datasets:
+            ds.close()
+
+    def index(self, xs, ys):
+        """
+        Pixel indices of co-ordinates (in the CRS of the rasters).
+        :return: tuple of arrays: rows, cols and whether the co-ordinates are inside the rasters.
+        """
+        xs = pd.to_numeric(pd.Series(np.asarray(xs, dtype=object)), errors='coerce').to_numpy(float)
+        ys = pd.to_numeric(pd.Series(np.asarray(ys, dtype=object)), errors='coerce').to_numpy(float)
+        cols, rows = ~self.transform * (xs, ys)
+        with np.errstate(invalid='ignore'):
+            rows, cols = np.floor(rows), np.floor(cols)
+            inside = (rows >= 0) & (rows < self.shape[0]) & (cols >= 0) & (cols < self.shape[1])
+        rows = np.where(inside, rows, 0).astype(np.int64)
+        cols = np.where(inside, cols, 0).astype(np.int64)
+        return rows, cols, inside
+
+    def read_plan(self, rows, cols):
+        """
+        Windows to read from each band to cover the pixels: the window spanning all pixels if reading it is
+        not more than reading the blocks containing pixels, otherwise the blocks.
+        :return: list of tuples of window and positions of the pixels in the window.
+        """
+        if len(rows) == 0:
+            return []
+        r0, r1, c0, c1 = rows.min(), rows.max() + 1, cols.min(), cols.max() + 1
+        block = (rows // self.block_size) * (self.shape[1] // self.block_size + 1) + cols // self.block_size
+        blocks, inverse = np.unique(block, return_inverse=True)
+        if len(blocks) * self.block_size ** 2 >= (r1 - r0) * (c1 - c0):
+            return [(Window(c0, r0, c1 - c0, r1 - r0), np.arange(len(rows)))]
+        plan = []
+        order = np.argsort(inverse, kind='stable')
+        for pos in np.split(order, np.cumsum(np.bincount(inverse))[:-1]):
+            br = rows[pos[0]] // self.block_size * self.block_size
+            bc = cols[pos[0]] // self.block_size * self.block_size
+            height = min(self.block_size, self.shape[0] - br)
+            width = min(self.block_size, self.shape[1] - bc)
+            plan.append((Window(bc, br, width, height), pos))
+        return plan
+
+    def sample(self, xs, ys):
+        """
+        Values of each band at co-ordinates.
+        :param xs: array of x co-ordinates (eastings).
+        :param ys: array of y co-ordinates (northings).
+        :return: pandas DataFrame with one column per band (named as in names), with the raw pixel values
+        (nodata pixels keep the nodata value, as with rasterio's sample) and NaN for co-ordinates outside the
+        rasters.
+        """
+        rows, cols, inside = self.index(xs, ys)
+        rows, cols = rows[inside], cols[inside]
+        plan = self.read_plan(rows, cols)
+        out = {}
+        for name, ds in zip(self.names, self.datasets):
+            values = np.full(len(rows), np.nan)
+            for window, pos in plan:
+                arr = ds.read(1, window=window).astype(float)
+                values[pos] = arr[rows[pos] - window.row_off, cols[pos] - window.col_off]
+            column = np.full(len(inside), np.nan)
+            column[inside] = values
+            out[name] = column
+        return pd.DataFrame(out)
+
+    def summed_area_tables(self):
+        """
+        Summed-area tables of each band (each band is read whole once).
+        :return: dict of name to SummedAreaTable.
+        """
+        return {name: SummedAreaTable(ds.read(1), self.transform, ds.nodata)
+                for name, ds in zip(self.names, self.datasets)}
+
+    def buffer_means(self, xs, ys, radii, shape='circle', strips=8):
+        """
+        Mean of each band within buffers of several radii around co-ordinates (e.g. percentage cover of each land
+        cover class within 500m, 1km and 2km), see SummedAreaTable.buffer_mean.
+        :param xs: array of x co-ordinates (eastings).
+        :param ys: array of y co-ordinates (northings).
+        :param radii: radii in metres.
+        :param shape: 'circle' or 'square'.
+        :param strips: maximum number of rectangles per half circle.
+        :return: pandas DataFrame with columns '<name>_<radius>m'.
+        """
+        return buffer_columns(self.summed_area_tables(), xs, ys, radii, shape, strips)
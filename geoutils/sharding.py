@@ -0,0 +1,231 @@
+import os
+import json
+import time
+import socket
+import threading
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+from .geocoded import read_table, write_table
+from .boundary_store import coordinates_bbox
+
+# Square (xmin, ymin, xmax, ymax) covering the British National Grid, divided along the Hilbert curve
+HILBERT_BOUNDS = (0, 0, 1300000, 1300000)
+
+
+def hilbert_keys(eastings, northings, order=16, bounds=HILBERT_BOUNDS):
+    """
+    Position of co-ordinates along a Hilbert curve filling a square: co-ordinates close along the curve are close
+    in space, so contiguous ranges of sorted keys are compact tiles.
+    :param eastings: array of eastings.
+    :param northings: array of northings.
+    :param order: number of bits per axis (the square is divided in 2**order by 2**order cells, about 20m for the
+    default bounds).
+    :param bounds: square (xmin, ymin, xmax, ymax).
+    :return: numpy array of int64 keys (4**order for co-ordinates that are not numbers).
+    """
+    xs = pd.to_numeric(pd.Series(np.asarray(eastings, dtype=object)), errors='coerce').to_numpy(float)
+    ys = pd.to_numeric(pd.Series(np.asarray(northings, dtype=object)), errors='coerce').to_numpy(float)
+    n = 1 << order
+    valid = ~np.isnan(xs) & ~np.isnan(ys)
+    x = np.clip(np.floor((np.where(valid, xs, 0) - bounds[0]) / (bounds[2] - bounds[0]) * n), 0, n - 1)
+    y = np.clip(np.floor((np.where(valid, ys, 0) - bounds[1]) / (bounds[3] - bounds[1]) * n), 0, n - 1)
+    x, y = x.astype(np.int64), y.astype(np.int64)
+    keys = np.zeros(len(x), dtype=np.int64)
+    s = n >> 1
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        keys += s * s * ((3 * rx.astype(np.int64)) ^ ry.astype(np.int64))
+        # rotate the quadrant
+        flip = ~ry & rx
+        x = np.where(flip, n - 1 - x, x)
+        y = np.where(flip, n - 1 - y, y)
+        x, y = np.where(~ry, y, x), np.where(~ry, x, y)
+        s >>= 1
+    keys[~valid] = n * n
+    return keys
+
+
+def spatial_shards(eastings, northings, shards, order=16):
+    """
+    Partition co-ordinates into shards of (nearly) equal numbers of rows that are contiguous along a Hilbert
+    curve (see hilbert_keys), so that each shard covers a compact area. Co-ordinates that are not numbers go to
+    the last shard.
+    :param eastings: array of eastings.
+    :param northings: array of northings.
+    :param shards: number of shards.
+    :param order: number of bits per axis of the Hilbert curve.
+    :return: numpy array of shard numbers.
+    """
+    keys = hilbert_keys(eastings, northings, order)
+    ranks = np.empty(len(keys), dtype=np.int64)
+    ranks[np.argsort(keys, kind='stable')] = np.arange(len(keys))
+    return ranks * int(shards) // max(len(keys), 1)
+
+
+class ShardDirectory:
+    """
+    Shared directory (e.g. on a network file system) coordinating workers on several processes or nodes. The plan
+    step writes the rows of each shard (shard_<n>.parquet) and plan.json with the settings of the run, the
+    bounding box of each shard and a fingerprint of its input. Workers claim shards by creating shard_<n>.claim
+    exclusively, write shard_<n>.result.parquet and move on to the next shard; claims not touched for
+    claim_timeout seconds (crashed workers, see heartbeat) can be taken over. The merge step concatenates the
+    results in the order of the rows of the input, whatever the number of shards and workers.
+    """
+
+    def __init__(self, path, claim_timeout=3600):
+        """
+        :param path: shared directory.
+        :param claim_timeout: number of seconds after which a claim without a result is taken over.
+        """
+        self.path = path
+        self.claim_timeout = claim_timeout
+        os.makedirs(path, exist_ok=True)
+
+    def file(self, shard, suffix):
+        return os.path.join(self.path, f'shard_{shard}{suffix}')
+
+    @property
+    def plan(self):
+        with open(os.path.join(self.path, 'plan.json')) as f:
+            return json.load(f)
+
+    def planned(self):
+        return os.path.exists(os.path.join(self.path, 'plan.json'))
+
+    def matches(self, source):
+        """
+        Whether the directory has a plan created from the same source (see create).
+        :param source: JSON serialisable fingerprint of the input and arguments of the plan.
+        """
+        return self.planned() and self.plan.get('source') == json.loads(json.dumps(source))
+
+    def create(self, data, shards, settings=None, source=None):
+        """
+        Partition data into spatial shards (see spatial_shards) and write the plan. The plan, shards, results and
+        claims of a previous plan in the directory are removed first.
+        :param data: DataFrame with eastings and northings columns.
+        :param shards: number of shards.
+        :param settings: JSON serialisable settings for the workers.
+        :param source: JSON serialisable fingerprint of the input and arguments of the plan (e.g. with
+        geoutils.file_fingerprint), recorded so that a plan of other data can be detected (see matches).
+        """
+        if self.planned():
+            os.remove(os.path.join(self.path, 'plan.json'))
+        for name in os.listdir(self.path):
+            if name.startswith('shard_'):
+                os.remove(os.path.join(self.path, name))
+        numbers = spatial_shards(data['eastings'], data['northings'], shards)
+        data = data.reset_index(drop=True).assign(row=np.arange(len(data)))
+        boxes = []
+        for shard in range(int(shards)):
+            rows = data[numbers == shard]
+            write_table(rows, self.file(shard, '.parquet'))
+            bbox = coordinates_bbox(rows['eastings'], rows['northings']) if len(rows) else None
+            boxes.append(None if bbox is None or np.isnan(bbox).any() else [float(b) for b in bbox])
+        plan = {'shards': int(shards), 'rows': len(data), 'bboxes': boxes, 'settings': settings or {},
+                'source': source}
+        with open(os.path.join(self.path, 'plan.json.tmp'), 'w') as f:
+            json.dump(plan, f, indent=1)
+        os.replace(os.path.join(self.path, 'plan.json.tmp'), os.path.join(self.path, 'plan.json'))
+
+    def done(self, shard):
+        return os.path.exists(self.file(shard, '.result.parquet'))
+
+    def complete(self):
+        return all(self.done(shard) for shard in range(self.plan['shards']))
+
+    def claim(self):
+        """
+        Claim the next shard without a result and not claimed by another worker.
+        :return: shard number or None if there is no shard left.
+        """
+        for shard in range(self.plan['shards']):
+            if self.done(shard):
+                continue
+            path = self.file(shard, '.claim')
+            if os.path.exists(path) and time.time() - os.path.getmtime(path) > self.claim_timeout:
+                # take over the claim of a crashed worker (only one worker succeeds in renaming it)
+                stale = path + f'.stale.{socket.gethostname()}.{os.getpid()}.{time.time_ns()}'
+                try:
+                    os.rename(path, stale)
+                except FileNotFoundError:
+                    continue
+                if time.time() - os.path.getmtime(stale) <= self.claim_timeout:
+                    # another worker took the claim over (or its worker renewed it) after the check: put it back,
+                    # unless yet another worker claimed the shard meanwhile
+                    try:
+                        os.link(stale, path)
+                    except FileExistsError:
+                        pass
+                    os.remove(stale)
+                    continue
+                os.remove(stale)
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                continue
+            with os.fdopen(fd, 'w') as f:
+                f.write(f'{socket.gethostname()} {os.getpid()}\n')
+            if self.done(shard):
+                os.remove(path)
+                continue
+            return shard
+        return None
+
+    @contextmanager
+    def heartbeat(self, shard, interval=None):
+        """
+        Keep the claim of a shard from being taken over while it is linked, however long it takes: the claim is
+        touched from a background thread every interval seconds.
+        :param shard: shard number.
+        :param interval: number of seconds between touches (default: a quarter of claim_timeout).
+        """
+        interval = self.claim_timeout / 4 if interval is None else interval
+        stop = threading.Event()
+
+        def touch():
+            while not stop.wait(interval):
+                try:
+                    os.utime(self.file(shard, '.claim'))
+                except FileNotFoundError:
+                    pass
+
+        thread = threading.Thread(target=touch, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def read(self, shard):
+        """
+        Rows of a shard (with a row column holding their position in the input).
+        """
+        return read_table(self.file(shard, '.parquet'))
+
+    def write(self, shard, result):
+        """
+        Write the result of a shard and release its claim.
+        :param shard: shard number.
+        :param result: DataFrame with the row column of the rows of the shard.
+        """
+        tmp = self.file(shard, f'.result.{socket.gethostname()}.{os.getpid()}.parquet')
+        write_table(result, tmp)
+        os.replace(tmp, self.file(shard, '.result.parquet'))
+        if os.path.exists(self.file(shard, '.claim')):
+            os.remove(self.file(shard, '.claim'))
+
+    def merge(self):
+        """
+        Concatenate the results of all shards in the order of the rows of the input.
+        :return: DataFrame (without the row column).
+        """
+        if not self.complete():
+            raise RuntimeError(f"Shards of {self.path} without result: " + ', '.join(
+                str(shard) for shard in range(self.plan['shards']) if not self.done(shard)))
+        results = [read_table(self.file(shard, '.result.parquet')) for shard in range(self.plan['shards'])]
+        data = pd.concat(results, ignore_index=True).sort_values('row', kind='stable')
+        return data.drop(columns='row').reset_index(drop=True)
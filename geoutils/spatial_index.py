@@ -0,0 +1,137 @@
+import numpy as np
+
+
+class PointIndex:
+    """
+    Grid-bucket spatial index over a set of points (e.g. road traffic count points) in a projected co-ordinate
+    reference system. Points are sorted by the grid cell that contains them, so the points of any block of cells
+    are found with array indexing. Queries are vectorised over all query points: k-nearest neighbours are found
+    by searching blocks of cells of increasing size and within-radius queries by searching the block of cells
+    covering the radius.
+    """
+
+    def __init__(self, x, y, cell_size=None, chunk_cells=10 ** 6):
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        if np.isnan(self.x).any() or np.isnan(self.y).any():
+            raise ValueError("Co-ordinates of indexed points must not be NaN.")
+        self.chunk_cells = chunk_cells
+        if cell_size is None:
+            # on average a few points per cell
+            area = max(np.ptp(self.x), 1.0) * max(np.ptp(self.y), 1.0)
+            cell_size = max(np.sqrt(4 * area / max(len(self.x), 1)), 1.0)
+        self.cell_size = float(cell_size)
+
+        cx = np.floor(self.x / self.cell_size).astype(np.int64)
+        cy = np.floor(self.y / self.cell_size).astype(np.int64)
+        self.cx0, self.cy0 = cx.min(), cy.min()
+        self.ncx, self.ncy = cx.max() - self.cx0 + 1, cy.max() - self.cy0 + 1
+        keys = (cx - self.cx0) * self.ncy + (cy - self.cy0)
+        self.order = np.argsort(keys, kind='stable')
+        self.starts = np.searchsorted(keys[self.order], np.arange(self.ncx * self.ncy + 1))
+
+    def cells(self, qx, qy):
+        qcx = np.floor(qx / self.cell_size).astype(np.int64) - self.cx0
+        qcy = np.floor(qy / self.cell_size).astype(np.int64) - self.cy0
+        return qcx, qcy
+
+    def candidates(self, qx, qy, level):
+        """
+        Points in the block of (2 * level + 1) x (2 * level + 1) cells centred on the cell of each query point.
+        :return: tuple of arrays of query positions and point positions (one entry per candidate pair).
+        """
+        qcx, qcy = self.cells(qx, qy)
+        offsets = np.arange(-level, level + 1)
+        ccx = qcx[:, None, None] + offsets[None, :, None]
+        ccy = qcy[:, None, None] + offsets[None, None, :]
+        inside = (ccx >= 0) & (ccx < self.ncx) & (ccy >= 0) & (ccy < self.ncy)
+        keys = np.where(inside, ccx * self.ncy + ccy, 0).ravel()
+        start = self.starts[keys]
+        counts = np.where(inside.ravel(), self.starts[keys + 1] - start, 0)
+
+        ncells = (2 * level + 1) ** 2
+        qid = np.repeat(np.repeat(np.arange(len(qx)), ncells), counts)
+        offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        pid = self.order[np.repeat(start, counts) + offset]
+        return qid, pid
+
+    def query(self, qx, qy, k=1):
+        """
+        k nearest indexed points of each query point (ties resolved by position of the indexed points).
+        :param qx: array of x co-ordinates of the query points.
+        :param qy: array of y co-ordinates of the query points.
+        :param k: number of neighbours.
+        :return: tuple of arrays of shape (len(qx), k): distances (inf if not found) and positions of the
+        indexed points (-1 if not found, e.g. for NaN co-ordinates).
+        """
+        qx = np.asarray(qx, dtype=float)
+        qy = np.asarray(qy, dtype=float)
+        distances = np.full((len(qx), k), np.inf)
+        indices = np.full((len(qx), k), -1, dtype=np.int64)
+
+        remaining = np.flatnonzero(~(np.isnan(qx) | np.isnan(qy)))
+        level = 1
+        while remaining.size:
+            if (2 * level + 1) ** 2 > max(64, self.ncx * self.ncy // 4):
+                self.query_brute_force(qx, qy, k, remaining, distances, indices)
+                break
+            unresolved = []
+            step = max(1, self.chunk_cells // (2 * level + 1) ** 2)
+            for start in range(0, len(remaining), step):
+                chunk = remaining[start:start + step]
+                qid, pid = self.candidates(qx[chunk], qy[chunk], level)
+                dist = np.hypot(self.x[pid] - qx[chunk][qid], self.y[pid] - qy[chunk][qid])
+                sort = np.lexsort((pid, dist, qid))
+                qid, pid, dist = qid[sort], pid[sort], dist[sort]
+                rank = np.arange(len(qid)) - np.searchsorted(qid, qid)
+
+                # Points outside the block of cells are further away than level * cell_size
+                kth = np.full(len(chunk), np.inf)
+                kth[qid[rank == k - 1]] = dist[rank == k - 1]
+                done = kth < level * self.cell_size
+                keep = (rank < k) & done[qid]
+                distances[chunk[qid[keep]], rank[keep]] = dist[keep]
+                indices[chunk[qid[keep]], rank[keep]] = pid[keep]
+                unresolved.append(chunk[~done])
+            remaining = np.concatenate(unresolved)
+            level *= 2
+        return distances, indices
+
+    def query_brute_force(self, qx, qy, k, queries, distances, indices):
+        """
+        Exact k-nearest neighbours by computing distances to all indexed points (used for query points far from
+        any indexed point).
+        """
+        n = len(self.x)
+        step = max(1, 10 ** 7 // max(n, 1))
+        for start in range(0, len(queries), step):
+            chunk = queries[start:start + step]
+            dist = np.hypot(self.x[None, :] - qx[chunk, None], self.y[None, :] - qy[chunk, None])
+            pos = np.argsort(dist, axis=1, kind='stable')[:, :k]
+            distances[chunk, :pos.shape[1]] = np.take_along_axis(dist, pos, axis=1)
+            indices[chunk, :pos.shape[1]] = pos
+
+    def within(self, qx, qy, radius, weights=None):
+        """
+        Number of indexed points, and sum of their weights, within a radius of each query point.
+        :param qx: array of x co-ordinates of the query points.
+        :param qy: array of y co-ordinates of the query points.
+        :param radius: radius in co-ordinate units.
+        :param weights: optional array of weights of the indexed points (e.g. traffic counts).
+        :return: tuple of arrays: counts and sums of weights (NaN weights are ignored).
+        """
+        qx = np.asarray(qx, dtype=float)
+        qy = np.asarray(qy, dtype=float)
+        weights = np.ones(len(self.x)) if weights is None else np.nan_to_num(np.asarray(weights, dtype=float))
+        counts = np.zeros(len(qx), dtype=np.int64)
+        sums = np.zeros(len(qx))
+        valid = np.flatnonzero(~(np.isnan(qx) | np.isnan(qy)))
+        level = int(np.ceil(radius / self.cell_size))
+        step = max(1, self.chunk_cells // (2 * level + 1) ** 2)
+        for start in range(0, len(valid), step):
+            chunk = valid[start:start + step]
+            qid, pid = self.candidates(qx[chunk], qy[chunk], level)
+            inside = np.hypot(self.x[pid] - qx[chunk][qid], self.y[pid] - qy[chunk][qid]) <= radius
+            counts[chunk] = np.bincount(qid[inside], minlength=len(chunk))
+            sums[chunk] = np.bincount(qid[inside], weights=weights[pid[inside]], minlength=len(chunk))
+        return counts, sums
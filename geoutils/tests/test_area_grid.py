@@ -0,0 +1,43 @@
+import numpy as np
+import geopandas
+import pytest
+from shapely.geometry import Polygon, box
+from geoutils import AreaIndex, AreaGrid
+
+
+@pytest.fixture
+def index():
+    return AreaIndex(geopandas.GeoDataFrame(
+        {'code': ['E001', 'E002', 'E003']},
+        geometry=[Polygon([(0, 0), (3000, 0), (3000, 1000), (0, 2570)]),
+                  Polygon([(3000, 0), (5000, 0), (5000, 3000), (3000, 1000)]),
+                  box(0, 3000, 5000, 4000).difference(box(1000, 3200, 1800, 3800))],
+        crs='epsg:27700'
+    ))
+
+
+class TestAreaGrid:
+
+    def test_same_as_area_index(self, index, tmp_path):
+        grid = AreaGrid.build(index, str(tmp_path / 'labels.npy'), resolution=100, strip_rows=7)
+        rng = np.random.RandomState(0)
+        eastings = np.r_[rng.uniform(-500, 5500, 3000), rng.randint(-500, 5500, 3000), np.nan]
+        northings = np.r_[rng.uniform(-500, 4500, 3000), rng.randint(-500, 4500, 3000), 10]
+        np.testing.assert_array_equal(grid.assign(eastings, northings), index.assign(eastings, northings))
+
+    def test_mostly_labelled_by_indexing(self, index, tmp_path):
+        grid = AreaGrid.cached(index, str(tmp_path / 'labels.npy'), resolution=100)
+        labels = np.asarray(grid.labels)
+        assert labels.shape == (40, 50)
+        assert set(np.unique(labels)) == {-2, -1, 0, 1, 2}
+        assert (labels == -2).mean() < 0.25
+        assert labels[4, 14] == -1 and labels[38, 5] == 0 and labels[5, 45] == 2
+
+    def test_rebuilt_for_other_areas_or_resolution(self, index, tmp_path):
+        path = str(tmp_path / 'labels.npy')
+        AreaGrid.cached(index, path, resolution=100)
+        assert AreaGrid.cached(index, path, resolution=200).labels.shape == (20, 25)
+        other = AreaIndex(index.areas.iloc[[1, 0, 2]])
+        grid = AreaGrid.cached(other, path, resolution=200)
+        assert grid.meta['fingerprint'] == other.fingerprint()
+        assert grid.assign([4000, 500], [500, 500]).tolist() == [0, 1]
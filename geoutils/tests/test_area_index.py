@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+import geopandas
+import pytest
+from shapely.geometry import box
+from geoutils import AreaIndex
+
+
+@pytest.fixture
+def areas():
+    return geopandas.GeoDataFrame(
+        {'code': ['E001', 'E002', 'W001'], 'ruc11': ['Urban', 'Rural', 'Urban']},
+        geometry=[box(0, 0, 1000, 1000), box(1000, 0, 2000, 1000), box(0, 1000, 2000, 3000)],
+        crs='epsg:27700'
+    )
+
+
+@pytest.fixture
+def data():
+    return pd.DataFrame({
+        'ID': [0, 1, 2, 3, 4, 5],
+        'eastings': [500, 1500, 500, 5000, 500, 'Invalid postcode'],
+        'northings': [500, 500, 2500, 5000, 500, 'Invalid postcode']
+    })
+
+
+class TestAreaIndex:
+
+    def test_assign(self, areas, data):
+        actual = AreaIndex(areas).assign(data.eastings, data.northings, chunk_size=2)
+        assert actual.tolist() == [0, 1, 2, -1, 0, -1]
+
+    def test_assign_processes(self, areas, data):
+        actual = AreaIndex(areas).assign(data.eastings, data.northings, processes=2, chunk_size=1)
+        assert actual.tolist() == [0, 1, 2, -1, 0, -1]
+
+    def test_same_as_sjoin(self, areas):
+        rng = np.random.RandomState(0)
+        data = pd.DataFrame({'ID': range(300), 'eastings': rng.randint(-100, 2100, 300),
+                             'northings': rng.randint(-100, 3100, 300)})
+        points = geopandas.GeoDataFrame(data, geometry=geopandas.points_from_xy(data.eastings, data.northings),
+                                        crs='epsg:27700')
+        expected = geopandas.sjoin(points, areas, how='inner', predicate='within').sort_values('ID')
+        actual = AreaIndex(areas).link(data)
+        assert actual['ID'].tolist() == expected['ID'].tolist()
+        assert actual['code'].tolist() == expected['code'].tolist()
+
+    def test_save_and_load(self, areas, data, tmp_path, monkeypatch):
+        shpfile = str(tmp_path / 'areas.gpkg')
+        areas.to_file(shpfile)
+        store = str(tmp_path / 'areas.feather')
+        AreaIndex.cached(shpfile, store)
+
+        def not_read(shpfilename):
+            raise AssertionError("boundary file read again")
+
+        with monkeypatch.context() as m:
+            m.setattr(AreaIndex, 'from_shapefile', not_read)
+            actual = AreaIndex.cached(shpfile, store).link(data)
+        assert actual.columns.tolist() == ['ID', 'eastings', 'northings', 'index_right', 'code', 'ruc11']
+        assert actual['code'].tolist() == ['E001', 'E002', 'W001', 'E001']
+
+    def test_store_of_other_boundary_file(self, areas, data, tmp_path):
+        store = str(tmp_path / 'areas.feather')
+        first, second = str(tmp_path / 'first.gpkg'), str(tmp_path / 'second.gpkg')
+        areas.to_file(first)
+        areas.assign(code=['E101', 'E102', 'W101']).to_file(second)
+        AreaIndex.cached(first, store)
+        assert AreaIndex.cached(second, store).link(data)['code'].tolist() == ['E101', 'E102', 'W101', 'E101']
+        # a store saved without the fingerprint of its boundary file is not trusted
+        AreaIndex(areas).save(store)
+        assert AreaIndex.cached(second, store).link(data)['code'].tolist() == ['E101', 'E102', 'W101', 'E101']
+
+    def test_fingerprint(self, areas):
+        assert AreaIndex(areas).fingerprint() == AreaIndex(areas.copy()).fingerprint()
+        assert AreaIndex(areas).fingerprint() != AreaIndex(areas.assign(code=['a', 'b', 'c'])).fingerprint()
+        moved = areas.set_geometry(areas.translate(1, 0))
+        assert AreaIndex(areas).fingerprint() != AreaIndex(moved).fingerprint()
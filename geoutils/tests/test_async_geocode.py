@@ -0,0 +1,63 @@
+import asyncio
+from aiohttp import web
+from geoutils import AsyncGeocoder
+
+KNOWN = {'CH53HJ': {'postcode': 'CH5 3HJ', 'eastings': 331379, 'northings': 366865, 'country': 'Wales'}}
+
+
+async def run_with_server(geocoder, postcodes, fail_first, bad_json=False):
+    """
+    Geocode postcodes against a local stand-in for postcodes.io that fails the first requests with 503 (or with
+    a 200 response that is not json).
+    """
+    calls = {'post': 0}
+
+    async def bulk(request):
+        calls['post'] += 1
+        if calls['post'] <= fail_first and bad_json:
+            return web.Response(text='<html>Bad gateway</html>', content_type='text/html')
+        if calls['post'] <= fail_first:
+            return web.json_response({'error': 'Service unavailable'}, status=503)
+        queries = (await request.json())['postcodes']
+        return web.json_response({'result': [{'query': q, 'result': KNOWN.get(q)} for q in queries]})
+
+    async def single(request):
+        return web.json_response({'error': 'Invalid postcode'}, status=404)
+
+    app = web.Application()
+    app.add_routes([web.post('/postcodes', bulk), web.get('/postcodes/{postcode}', single)])
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    geocoder.url = f'http://127.0.0.1:{port}/postcodes'
+    try:
+        return await geocoder.geocode_async(postcodes), calls['post']
+    finally:
+        await runner.cleanup()
+
+
+class TestAsyncGeocoder:
+
+    def test_retries_and_order(self):
+        geocoder = AsyncGeocoder(batch_size=2, rate=1000, backoff=0.01)
+        actual, posts = asyncio.run(run_with_server(geocoder, ['CH5 3HJ', 'XX', 'CH5,3HJ'], fail_first=2))
+        assert actual == [['CH5 3HJ', 331379, 366865, 'Wales'], ['Invalid postcode'] * 4,
+                          ['CH5 3HJ', 331379, 366865, 'Wales']]
+        assert geocoder.retried == 2 and posts == 4
+
+    def test_gives_up_after_retries(self):
+        geocoder = AsyncGeocoder(rate=1000, retries=1, backoff=0.01)
+        actual, posts = asyncio.run(run_with_server(geocoder, ['CH5 3HJ'], fail_first=10))
+        assert actual == [['HTTP error 503'] * 4] and posts == 2
+
+    def test_retries_invalid_json(self):
+        geocoder = AsyncGeocoder(batch_size=1, rate=1000, retries=2, backoff=0.01)
+        actual, posts = asyncio.run(run_with_server(geocoder, ['CH5 3HJ', 'XX'], fail_first=1, bad_json=True))
+        assert actual == [['CH5 3HJ', 331379, 366865, 'Wales'], ['Invalid postcode'] * 4]
+        assert geocoder.retried == 1 and posts == 3
+
+        geocoder = AsyncGeocoder(rate=1000, retries=1, backoff=0.01)
+        actual, posts = asyncio.run(run_with_server(geocoder, ['CH5 3HJ'], fail_first=10, bad_json=True))
+        assert actual == [['Request failed (invalid json response)'] * 4] and posts == 2
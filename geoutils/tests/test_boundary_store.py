@@ -0,0 +1,55 @@
+import shutil
+import geopandas
+import pytest
+from shapely.geometry import box
+from geoutils import BoundaryStore, coordinates_bbox
+
+
+@pytest.fixture
+def archives(tmp_path):
+    paths = []
+    for country, x0 in [('England', 0), ('Wales', 100000)]:
+        shp = geopandas.GeoDataFrame(
+            {'code': [f'{country}{i}' for i in range(50)], 'label': 'x'},
+            geometry=[box(x0 + i * 2000, 0, x0 + i * 2000 + 2000, 5000) for i in range(50)],
+            crs='epsg:27700'
+        )
+        (tmp_path / country).mkdir()
+        shp.to_file(str(tmp_path / country / f'{country}_oa_2011.shp'))
+        paths.append(shutil.make_archive(str(tmp_path / f'{country}_oa_2011'), 'zip', str(tmp_path / country)))
+    return paths
+
+
+class TestBoundaryStore:
+
+    def test_read_bbox(self, archives, tmp_path):
+        store = BoundaryStore(str(tmp_path / 'store'), row_group_size=10)
+        store.add('EW_oa_2011', archives, drop=['label'])
+        shp = store.read('EW_oa_2011', bbox=coordinates_bbox([3000, 5000, 'Invalid postcode'], [100, 200, 300]))
+        assert shp.columns.tolist() == ['code', 'geometry']
+        assert shp['code'].tolist() == ['England1', 'England2']
+        assert len(store.read('EW_oa_2011')) == 100
+
+    def test_read_tiles(self, archives, tmp_path):
+        store = BoundaryStore(str(tmp_path / 'store'))
+        store.add('EW_oa_2011', archives)
+        shp = store.read('EW_oa_2011', bbox=[(500, 500, 600, 600), (198500, 500, 198600, 600)])
+        assert shp['code'].tolist() == ['England0', 'Wales49']
+
+    def test_added_once(self, archives, tmp_path):
+        store = BoundaryStore(str(tmp_path / 'store'), offline=True)
+        path = store.add('EW_oa_2011', archives)
+        for archive in archives:
+            shutil.move(archive, archive + '.moved')
+        assert store.add('EW_oa_2011', archives) == path
+        with pytest.raises(FileNotFoundError):
+            store.add('EW_oa_2011', ['https://not.downloaded/x.zip'])
+
+    def test_rebuilt_when_arguments_change(self, archives, tmp_path):
+        store = BoundaryStore(str(tmp_path / 'store'))
+        store.add('EW_oa_2011', archives, drop=['label'])
+        assert store.read('EW_oa_2011').columns.tolist() == ['code', 'geometry']
+        store.add('EW_oa_2011', archives)
+        assert store.read('EW_oa_2011').columns.tolist() == ['code', 'label', 'geometry']
+        store.add('EW_oa_2011', archives[:1])
+        assert len(store.read('EW_oa_2011')) == 50
@@ -0,0 +1,37 @@
+import json
+import pandas as pd
+from geoutils import ChunkCheckpoint, file_fingerprint
+
+
+class TestChunkCheckpoint:
+
+    def test_resume_truncates_partial_chunk(self, tmp_path):
+        output = str(tmp_path / 'out.csv')
+        checkpoint = ChunkCheckpoint(output, {'chunksize': 2})
+        checkpoint.append(pd.DataFrame({'a': [1, 2]}), state=[2])
+        with open(output, 'a') as f:
+            f.write('3\n4')  # crash while writing the second chunk
+
+        checkpoint = ChunkCheckpoint(output, {'chunksize': 2})
+        assert (checkpoint.chunks, checkpoint.state, checkpoint.complete) == (1, [2], False)
+        checkpoint.append(pd.DataFrame({'a': [5, 6]}), state=[4])
+        checkpoint.finish()
+        assert pd.read_csv(output)['a'].tolist() == [1, 2, 5, 6]
+        assert ChunkCheckpoint(output, {'chunksize': 2}).complete
+
+    def test_other_fingerprint_restarts(self, tmp_path):
+        output = str(tmp_path / 'out.csv')
+        ChunkCheckpoint(output, {'chunksize': 2}).append(pd.DataFrame({'a': [1, 2]}))
+        checkpoint = ChunkCheckpoint(output, {'chunksize': 3})
+        assert checkpoint.chunks == 0
+        checkpoint.append(pd.DataFrame({'a': [7]}))
+        assert pd.read_csv(output)['a'].tolist() == [7]
+        with open(output + '.manifest.json') as f:
+            assert json.load(f)['fingerprint'] == {'chunksize': 3}
+
+    def test_file_fingerprint(self, tmp_path):
+        path = tmp_path / 'in.csv'
+        path.write_text('id\n1\n')
+        before = file_fingerprint(str(path))
+        path.write_text('id\n1\n2\n')
+        assert file_fingerprint(str(path)) != before
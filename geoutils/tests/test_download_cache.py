@@ -0,0 +1,90 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import pytest
+from geoutils import DownloadCache, request_url_to_dataframe
+
+CSV = b"Annual mean\nline 2\nline 3\nline 4\nline 5\nukgridcode,x,y,pm102008g\n1,500,500,12.5\n2,1500,500,MISSING\n"
+UTF8_CSV = "Annual mean\nline 2\nline 3\nline 4\nline 5\nukgridcode,x,y,pm10 µg/m³\n1,500,500,12.5\n".encode()
+
+
+class PCMHandler(BaseHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self):
+        PCMHandler.requests.append((self.path, self.headers.get('If-None-Match')))
+        if self.path == '/utf8.csv':
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/csv; charset=utf-8')
+            self.send_header('Content-Length', str(len(UTF8_CSV)))
+            self.end_headers()
+            self.wfile.write(UTF8_CSV)
+        elif self.path != '/mappm102008g.csv':
+            self.send_response(404)
+            self.end_headers()
+        elif self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+        else:
+            self.send_response(200)
+            self.send_header('ETag', '"v1"')
+            self.send_header('Content-Length', str(len(CSV)))
+            self.end_headers()
+            self.wfile.write(CSV)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    PCMHandler.requests = []
+    httpd = HTTPServer(('127.0.0.1', 0), PCMHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_port}'
+    httpd.shutdown()
+
+
+class TestDownloadCache:
+
+    def test_revalidation(self, server, tmp_path):
+        link = server + '/mappm102008g.csv'
+        first = DownloadCache(str(tmp_path)).get_dataframe(link, header=5)
+        second = DownloadCache(str(tmp_path)).get_dataframe(link, header=5)
+        assert first.columns.tolist() == ['ukgridcode', 'x', 'y', 'pm102008g']
+        assert second.equals(first)
+        assert PCMHandler.requests == [('/mappm102008g.csv', None), ('/mappm102008g.csv', '"v1"')]
+
+    def test_offline(self, server, tmp_path):
+        link = server + '/mappm102008g.csv'
+        DownloadCache(str(tmp_path)).get_dataframe(link, header=5)
+        cache = DownloadCache(str(tmp_path), offline=True)
+        assert cache.get_dataframe(link, header=5).shape == (2, 4)
+        assert cache.get_dataframe(server + '/mapno22008.csv', header=5) is None
+        assert cache.get_content(link) is None
+        assert len(PCMHandler.requests) == 1
+
+    def test_not_found(self, server, tmp_path):
+        assert DownloadCache(str(tmp_path)).get_dataframe(server + '/mapno22008.csv', header=5) is None
+
+    def test_content(self, server, tmp_path):
+        link = server + '/mappm102008g.csv'
+        assert DownloadCache(str(tmp_path)).get_content(link) == CSV
+        assert DownloadCache(str(tmp_path)).get_content(link) == CSV
+
+    def test_encoding_of_response(self, server, tmp_path):
+        link = server + '/utf8.csv'
+        assert request_url_to_dataframe(link, header=5).columns[-1] == 'pm10 µg/m³'
+        assert DownloadCache(str(tmp_path)).get_dataframe(link, header=5).columns[-1] == 'pm10 µg/m³'
+        assert DownloadCache(str(tmp_path), offline=True).get_dataframe(link, header=5).columns[-1] == 'pm10 µg/m³'
+
+    def test_shared_between_processes(self, server, tmp_path):
+        # caches opened by two processes before either downloads anything
+        first, second = DownloadCache(str(tmp_path)), DownloadCache(str(tmp_path))
+        first.get_content(server + '/mappm102008g.csv')
+        second.get_dataframe(server + '/utf8.csv', header=5)
+        index = DownloadCache(str(tmp_path)).index
+        assert sorted(index) == [server + '/mappm102008g.csv', server + '/utf8.csv']
+        assert second.index == index
+        assert not [name for name in os.listdir(tmp_path / 'objects') if name.endswith('.tmp')]
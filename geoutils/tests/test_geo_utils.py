@@ -1,3 +1,5 @@
+import json
+import pytest
 from geoutils import *
 import numpy as np
 
@@ -34,4 +36,71 @@ class TestRequestUrlToDataframe:
 
     def test_not_csv_file(self):
         expected = None
-        assert request_url_to_dataframe('https://uk-air.defra.gov.uk', header=5) == expected
\ No newline at end of file
+        assert request_url_to_dataframe('https://uk-air.defra.gov.uk', header=5) == expected
+
+class FakeResponse:
+
+    def __init__(self, status_code, payload):
+        self.status_code = status_code
+        self.payload = payload
+        self.content = json.dumps(payload).encode()
+
+    def json(self):
+        return self.payload
+
+
+class FakePostcodesSession:
+    """Stand-in for requests.Session answering from a dict of known postcodes."""
+
+    def __init__(self, known):
+        self.known = known
+        self.posts = []
+        self.gets = []
+
+    def post(self, url, json):
+        self.posts.append(json['postcodes'])
+        return FakeResponse(200, {'result': [
+            {'query': p, 'result': self.known.get(p)} for p in json['postcodes']
+        ]})
+
+    def get(self, url):
+        self.gets.append(url)
+        return FakeResponse(404, {'error': 'Invalid postcode'})
+
+
+class TestGeocodeUKBatch:
+
+    @pytest.fixture
+    def session(self):
+        return FakePostcodesSession({
+            'CH53HJ': {'postcode': 'CH5 3HJ', 'eastings': 331379, 'northings': 366865, 'country': 'Wales'},
+            'TD75LG': {'postcode': 'TD7 5LG', 'eastings': 323821, 'northings': 623110, 'country': 'Scotland'}
+        })
+
+    def test_order_and_format(self, session):
+        expected = [['TD7 5LG', 323821, 623110, 'Scotland'],
+                    ['Invalid postcode', 'Invalid postcode', 'Invalid postcode', 'Invalid postcode'],
+                    ['CH5 3HJ', 331379, 366865, 'Wales']]
+        assert geocode_uk_batch(['TD7 5LG', 'CH5 3HJ4', 'CH5,3HJ'], session=session) == expected
+
+    def test_batches_of_at_most_100(self, session):
+        geocode_uk_batch(['CH5 3HJ'] * 250, batch_size=500, session=session)
+        assert [len(p) for p in session.posts] == [100, 100, 50]
+        assert session.gets == []
+
+
+class TestFindNearestIdxs:
+
+    def test_ties_and_duplicates(self):
+        assert find_nearest_idxs(['2001', '2003', '2003', '2005'], [2004, '2002', 2001, 2010]) == \
+               [[1, 2, 3], [0, 1, 2], [0], [3]]
+
+    def test_nan(self):
+        assert all(np.isnan(i) for i in find_nearest_idxs([1, 2], [np.nan, 'abc', None]))
+        assert np.isnan(find_nearest_idxs(['abc'], [1])[0])
+
+    def test_same_as_find_nearest_idx(self):
+        rng = np.random.default_rng(0)
+        array = rng.integers(0, 20, 50)
+        values = rng.integers(-5, 25, 100)
+        assert find_nearest_idxs(array, values) == [find_nearest_idx(array, v) for v in values]
@@ -0,0 +1,42 @@
+import time
+from geoutils import GeocodeCache, geocode_uk_unique
+
+
+class CountingGeocoder:
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, postcodes):
+        self.calls.append(list(postcodes))
+        return [['Invalid postcode'] * 4 if p == 'XX' else
+                ['Too many requests'] * 4 if p == 'YY' else
+                [p[:-3] + ' ' + p[-3:], 1.0, 2.0, 'England'] for p in postcodes]
+
+
+class TestGeocodeUKUnique:
+
+    def test_unique_postcodes_geocoded_once(self):
+        geocoder = CountingGeocoder()
+        actual = geocode_uk_unique(['CH5 3HJ', 'ch53hj', 'XX', 'CH5,3HJ'], geocoder)
+        assert geocoder.calls == [['CH53HJ', 'XX']]
+        assert actual == [['CH5 3HJ', 1.0, 2.0, 'England']] * 2 + [['Invalid postcode'] * 4] \
+            + [['CH5 3HJ', 1.0, 2.0, 'England']]
+
+    def test_cache_shared_across_runs(self, tmp_path):
+        path = str(tmp_path / 'geocodes.sqlite')
+        geocoder = CountingGeocoder()
+        geocode_uk_unique(['CH5 3HJ', 'XX', 'YY'], geocoder, GeocodeCache(path))
+        cache = GeocodeCache(path)
+        actual = geocode_uk_unique(['CH5 3HJ', 'XX', 'YY'], geocoder, cache)
+        assert geocoder.calls == [['CH53HJ', 'XX', 'YY'], ['YY']]
+        assert actual[:2] == [['CH5 3HJ', 1.0, 2.0, 'England'], ['Invalid postcode'] * 4]
+        assert (cache.hits, cache.misses) == (2, 1)
+
+    def test_negative_ttl(self, tmp_path):
+        path = str(tmp_path / 'geocodes.sqlite')
+        geocoder = CountingGeocoder()
+        geocode_uk_unique(['XX', 'CH5 3HJ'], geocoder, GeocodeCache(path, negative_ttl=0))
+        time.sleep(0.01)
+        geocode_uk_unique(['XX', 'CH5 3HJ'], geocoder, GeocodeCache(path, negative_ttl=0))
+        assert geocoder.calls == [['XX', 'CH53HJ'], ['XX']]
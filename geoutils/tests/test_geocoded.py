@@ -0,0 +1,106 @@
+import pandas as pd
+import pytest
+from geoutils import read_geocoded, CoordinateTable, typed_geocodes, read_table, write_table, normalise_crs, \
+    check_metre_crs, crs_transformer, IRISH_GRID, BNG
+
+
+@pytest.fixture
+def geocoded(tmp_path):
+    path = str(tmp_path / 'geocoded.csv')
+    pd.DataFrame({
+        'ID': ['01', '02', '03', '04', '05'],
+        'year': [2008, 2008, 2008, 2012, 2012],
+        'postcode': ['AB1 1AA', 'AB1 1AA', 'XX', 'AB1 1AB', 'AB1 1AA'],
+        'eastings': [100, 100, 'Invalid postcode', 200, 100],
+        'northings': [300, 300, 'Invalid postcode', 400, 300],
+        'country': ['Scotland', 'Scotland', 'Invalid postcode', 'Scotland', 'Scotland']
+    }).to_csv(path, index=False)
+    return path
+
+
+class TestGeocoded:
+
+    def test_read_geocoded(self, geocoded):
+        data = read_geocoded(geocoded, 'ID')
+        assert data['ID'].tolist() == ['01', '02', '04', '05']
+        assert data['eastings'].tolist() == [100, 100, 200, 100]
+
+    def test_missing_column(self, geocoded):
+        with pytest.raises(ValueError):
+            read_geocoded(geocoded, 'id_twin')
+
+    def test_broadcast(self, geocoded):
+        data = read_geocoded(geocoded, 'ID')
+        table = CoordinateTable(data)
+        assert len(table) == 3
+        linked = pd.DataFrame({'value': table.coords['eastings'] + table.coords['year']})
+        assert table.broadcast(linked)['value'].tolist() == [2108, 2108, 2212, 2112]
+
+
+class TestTypedGeocodes:
+
+    def test_typed_geocodes(self, geocoded):
+        data = typed_geocodes(pd.read_csv(geocoded).assign(
+            eastings=lambda df: df['eastings'].where(df['ID'] != 4, 'Postcode not found'),
+            northings=lambda df: df['northings'].where(df['ID'] != 4, 'Postcode not found'),
+            country=lambda df: df['country'].where(df['ID'] != 4, 'Postcode not found')
+        ))
+        assert data.columns.tolist() == ['ID', 'year', 'postcode', 'eastings', 'northings', 'country', 'status']
+        assert data['status'].dtype == 'int8'
+        assert data['status'].tolist() == [0, 0, 1, 2, 0]
+        assert data['eastings'].isna().tolist() == [False, False, True, True, False]
+        assert data['country'].isna().tolist() == [False, False, True, True, False]
+
+    @pytest.mark.parametrize('extension', ['.parquet', '.feather'])
+    def test_columnar_round_trip(self, geocoded, tmp_path, extension):
+        path = str(tmp_path / ('geocoded' + extension))
+        write_table(typed_geocodes(pd.read_csv(geocoded, dtype={'ID': str})), path)
+        data = read_table(path)
+        assert data['year'].dtype == 'category'
+        assert data['country'].dtype == 'category'
+        assert data['eastings'].dtype == 'float64'
+        assert read_geocoded(path, 'ID')['ID'].tolist() == ['01', '02', '04', '05']
+
+    @pytest.mark.parametrize('extension', ['.csv', '.parquet', '.feather'])
+    def test_read_arguments(self, tmp_path, extension):
+        path = str(tmp_path / ('data' + extension))
+        write_table(pd.DataFrame({'ID': [1, 2, 3], 'postcode': ['A', 'Invalid postcode', None]}), path)
+        data = read_table(path, dtype={'ID': str}, na_values=['Invalid postcode'])
+        assert data['ID'].tolist() == ['1', '2', '3']
+        assert data['postcode'].isna().tolist() == [False, True, True]
+        if extension != '.csv':
+            with pytest.raises(TypeError):
+                read_table(path, usecols=['ID'])
+
+
+class TestNormaliseCrs:
+
+    @pytest.fixture
+    def mixed(self):
+        return pd.DataFrame({
+            'ID': [1, 2, 3, 4],
+            'eastings': [333900, 331379, 'Invalid postcode', 146300],
+            'northings': [374200, 366865, 'Invalid postcode', 529700],
+            'country': ['Northern Ireland', 'Wales', 'Invalid postcode', 'Northern Ireland']
+        })
+
+    def test_irish_grid_to_bng(self, mixed):
+        data = normalise_crs(mixed)
+        assert data.columns.tolist() == ['ID', 'eastings', 'northings', 'country', 'crs']
+        assert data['crs'].tolist()[:2] == [BNG, BNG] and pd.isna(data['crs'][2])
+        x, y = crs_transformer(IRISH_GRID, BNG).transform(333900, 374200)
+        assert data['eastings'].tolist()[:3] == [round(x), 331379, 'Invalid postcode']
+        assert data['northings'].tolist()[:3] == [round(y), 366865, 'Invalid postcode']
+
+    def test_idempotent(self, mixed):
+        data = normalise_crs(mixed)
+        pd.testing.assert_frame_equal(normalise_crs(data), data)
+
+    def test_metre_crs_only(self, mixed):
+        assert check_metre_crs('epsg:2157') == 'epsg:2157'
+        for crs in ['epsg:4326', 'epsg:2229', 'not a crs']:
+            with pytest.raises(ValueError):
+                normalise_crs(mixed, crs)
+
+    def test_transformer_cached(self):
+        assert crs_transformer(IRISH_GRID, BNG) is crs_transformer(IRISH_GRID, BNG)
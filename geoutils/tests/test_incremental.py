@@ -0,0 +1,57 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from geoutils import row_fingerprints, IncrementalOutput, read_table
+
+
+def compute(data):
+    return data.assign(value=data['postcode'].str.lower())
+
+
+def run(data, path, version=None):
+    fingerprints = row_fingerprints(data, ['ID', 'year', 'postcode'], version=version)
+    output = IncrementalOutput(path, fingerprints)
+    merged, merged_fingerprints = output.merge(compute(data[output.changed]), fingerprints[output.changed])
+    output.write(merged, merged_fingerprints)
+    return output
+
+
+@pytest.fixture
+def data():
+    return pd.DataFrame({'ID': ['01', '02', '03'], 'year': [2008, 2008, 2012], 'postcode': ['A', 'B', 'C']})
+
+
+class TestIncrementalOutput:
+
+    def test_fingerprints(self, data):
+        fingerprints = row_fingerprints(data, ['ID', 'year', 'postcode'])
+        assert fingerprints.dtype == np.uint64 and len(set(fingerprints)) == 3
+        np.testing.assert_array_equal(row_fingerprints(data.astype(str), ['ID', 'year', 'postcode']), fingerprints)
+        assert (row_fingerprints(data, ['ID', 'year', 'postcode'], version='v2') != fingerprints).all()
+
+    @pytest.mark.parametrize('extension', ['.csv', '.parquet'])
+    def test_only_changed_rows(self, data, tmp_path, extension):
+        path = str(tmp_path / ('out' + extension))
+        assert run(data, path).changed.all()
+        assert not run(data, path).changed.any()
+
+        data = pd.concat([data, pd.DataFrame({'ID': ['04'], 'year': [2012], 'postcode': ['D']})])
+        data.loc[data['ID'] == '02', 'postcode'] = 'E'
+        data = data[data['ID'] != '03']
+        output = run(data, path)
+        assert output.changed.tolist() == [False, True, True]
+        assert output.kept.tolist() == [True, False, False]
+        actual = read_table(path, dtype={'ID': str})
+        assert actual['ID'].tolist() == ['01', '02', '04'] and actual['value'].tolist() == ['a', 'e', 'd']
+
+    def test_dataset_version(self, data, tmp_path):
+        path = str(tmp_path / 'out.csv')
+        run(data, path, version=['v1', 'v1', 'v1'])
+        assert run(data, path, version=['v1', 'v1', 'v2']).changed.tolist() == [False, False, True]
+
+    def test_interrupted_write(self, data, tmp_path):
+        path = str(tmp_path / 'out.csv')
+        run(data, path)
+        os.remove(path + '.fingerprints.npy')
+        assert run(data, path).changed.all()
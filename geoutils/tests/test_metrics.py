@@ -0,0 +1,60 @@
+import sys
+import json
+import geoutils.metrics
+from geoutils import RunMetrics
+
+
+class TestRunMetrics:
+
+    def test_stages_and_counters(self, tmp_path):
+        metrics = RunMetrics()
+        metrics.add('http_requests')
+        with metrics.stage('geocode', rows=100) as stage:
+            metrics.add('http_requests', 2)
+            metrics.add('http_bytes', 512)
+            metrics.add('geocode_cache_hits', 3)
+            metrics.add('geocode_cache_misses', 1)
+        assert stage['counters'] == {'http_requests': 2, 'http_bytes': 512, 'geocode_cache_hits': 3,
+                                     'geocode_cache_misses': 1}
+        assert stage['rows_per_second'] > 0 and stage['peak_rss_mb'] > 0
+
+        path = str(tmp_path / 'metrics.json')
+        metrics.write(path)
+        with open(path) as f:
+            summary = json.load(f)
+        assert summary['counters']['http_requests'] == 3
+        assert summary['cache_hit_ratios'] == {'geocode_cache': 0.75}
+        assert [s['stage'] for s in summary['stages']] == ['geocode']
+
+    def test_progress_throttled(self, capsys):
+        metrics = RunMetrics(progress_interval=3600)
+        for done in range(1, 11):
+            metrics.progress('geocode', done, 10)
+        lines = capsys.readouterr().err.splitlines()
+        assert len(lines) == 1 and lines[0].startswith('  geocode: 10/10 (')
+
+    def test_no_progress(self, capsys):
+        metrics = RunMetrics(progress_interval=None)
+        metrics.progress('geocode', 10, 10)
+        assert capsys.readouterr().err == ''
+
+    def test_increments(self):
+        metrics = RunMetrics()
+        metrics.add('http_requests')
+        with metrics.stage('geocode'):
+            before = metrics.snapshot()
+            metrics.add('http_requests', 2)
+            metrics.add('http_bytes', 512)
+            increments = metrics.increments(before)
+            before['http_requests'] = 100
+        assert increments == {'http_requests': 2, 'http_bytes': 512}
+        assert metrics.counters['http_requests'] == 3 and len(metrics.stages) == 1
+
+    def test_without_resource_module(self, monkeypatch):
+        # e.g. Windows without psutil
+        monkeypatch.setattr(geoutils.metrics, 'resource', None)
+        monkeypatch.setitem(sys.modules, 'psutil', None)
+        metrics = RunMetrics()
+        with metrics.stage('geocode', rows=10) as stage:
+            pass
+        assert stage['peak_rss_mb'] is None and metrics.summary()['peak_rss_mb'] is None
@@ -0,0 +1,64 @@
+import os
+import pytest
+import numpy as np
+import pandas as pd
+from geoutils import PostcodeIndex
+
+
+@pytest.fixture
+def onspd(tmp_path):
+    csvfile = tmp_path / 'ONSPD.csv'
+    pd.DataFrame([
+        ['CH5 3HJ', '', 331379, 366865, 'W92000004'],
+        ['TD7 5LG', '', 323821, 623110, 'S92000003'],
+        ['BT1 1AA', '', 333868, 374431, 'N92000002'],
+        ['AB1 0AA', '199906', 385386, 801193, 'S92000003'],
+        ['GY1 1AA', '', np.nan, np.nan, 'L93000001']
+    ], columns=['pcds', 'doterm', 'oseast1m', 'osnrth1m', 'ctry']).to_csv(csvfile, index=False)
+    return str(csvfile)
+
+
+class TestPostcodeIndex:
+
+    def test_lookup(self, onspd):
+        index = PostcodeIndex.from_onspd(onspd)
+        actual = index.geocode(['td75lg', 'CH5,3HJ', 'CH5 3HJ4', 12321, 'AB1 0AA', 'ZZ1 1ZZ'])
+        expected = [['TD7 5LG', 323821.0, 623110.0, 'Scotland'],
+                    ['CH5 3HJ', 331379.0, 366865.0, 'Wales'],
+                    ['Invalid postcode'] * 4,
+                    ['Invalid postcode'] * 4,
+                    ['Postcode not found'] * 4,
+                    ['Postcode not found'] * 4]
+        assert actual == expected
+
+    def test_missing_coordinates(self, onspd):
+        index = PostcodeIndex.from_onspd(onspd)
+        row = index.geocode(['GY1 1AA'])[0]
+        assert row[0] == 'GY1 1AA' and np.isnan(row[1]) and row[3] == 'Channel Islands'
+
+    def test_empty_index(self, onspd, tmp_path):
+        onspd_empty = str(tmp_path / 'ONSPD_empty.csv')
+        pd.read_csv(onspd).head(0).to_csv(onspd_empty, index=False)
+        index = PostcodeIndex.from_onspd(onspd_empty)
+        assert index.geocode(['TD7 5LG', 'xx']) == [['Postcode not found'] * 4, ['Invalid postcode'] * 4]
+        assert index.geocode([]) == []
+
+    def test_index_is_reused(self, onspd, tmp_path):
+        PostcodeIndex.from_onspd(onspd)
+        index = PostcodeIndex.from_onspd(str(tmp_path / 'ONSPD_index'))
+        assert isinstance(index.postcodes, np.memmap)
+        assert index.postcodes.tolist() == [b'BT11AA', b'CH53HJ', b'GY11AA', b'TD75LG']
+
+    def test_rebuilt_when_csv_changes(self, onspd):
+        assert PostcodeIndex.from_onspd(onspd).geocode(['TD7 5LG'])[0][1] == 323821.0
+        index = PostcodeIndex.from_onspd(onspd)
+        assert os.path.exists(os.path.join(index.index_dir, 'source.json'))
+        df = pd.read_csv(onspd)
+        df.loc[df['pcds'] == 'TD7 5LG', ['oseast1m', 'osnrth1m']] = [100, 200]
+        df.to_csv(onspd, index=False)
+        stat = os.stat(onspd)
+        os.utime(onspd, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        assert PostcodeIndex.from_onspd(onspd).geocode(['TD7 5LG'])[0][1:3] == [100.0, 200.0]
+        # built again with other arguments
+        assert PostcodeIndex.from_onspd(onspd, include_terminated=True).geocode(['AB1 0AA'])[0][0] == 'AB1 0AA'
+        assert PostcodeIndex.from_onspd(onspd).geocode(['AB1 0AA'])[0][0] == 'Postcode not found'
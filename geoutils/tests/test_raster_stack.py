@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+from geoutils import RasterStack
+
+
+@pytest.fixture
+def rasters(tmp_path):
+    paths = []
+    for n in range(1, 4):
+        data = (np.arange(600 * 700, dtype=np.int16).reshape(600, 700) % 100) + n * 100
+        data[0, 0] = -1
+        path = str(tmp_path / f"class_{n}.tif")
+        with rasterio.open(path, 'w', driver='GTiff', height=600, width=700, count=1, dtype='int16',
+                           crs='EPSG:27700', transform=from_origin(0, 600000, 1000, 1000), nodata=-1) as dst:
+            dst.write(data, 1)
+        paths.append(path)
+    return paths
+
+
+def sample_point_by_point(paths, coords):
+    values = []
+    for path in paths:
+        with rasterio.open(path) as src:
+            values.append([x[0] for x in src.sample(coords)])
+    return np.array(values, dtype=float).T
+
+
+class TestRasterStack:
+
+    @pytest.mark.parametrize('xs, ys', [
+        ([500, 1500, 351200, 699999, 351300], [599999, 598500, 402100, 0, 402000]),
+        ([120500, 120900, 121400], [300100, 300900, 301500])
+    ])
+    def test_same_as_rasterio_sample(self, rasters, xs, ys):
+        expected = sample_point_by_point(rasters, list(zip(xs, ys)))
+        with RasterStack(rasters, names=['a', 'b', 'c']) as stack:
+            actual = stack.sample(xs, ys)
+            # nodata pixels keep their value, co-ordinates outside the rasters (e.g. on the lower edge) are NaN
+            expected[~stack.index(xs, ys)[2]] = np.nan
+        assert actual.columns.tolist() == ['a', 'b', 'c']
+        np.testing.assert_array_equal(actual.to_numpy(), expected)
+
+    def test_outside_and_invalid(self, rasters):
+        with RasterStack(rasters) as stack:
+            actual = stack.sample([-10, 800000, 'Invalid postcode'], [10, 10, 'Invalid postcode'])
+        assert actual.isna().all().all()
+
+    def test_block_plan(self, rasters):
+        with RasterStack(rasters, block_size=16) as stack:
+            rows, cols, inside = stack.index([500, 650500], [599500, 500])
+            plan = stack.read_plan(rows, cols)
+        assert len(plan) == 2 and all(w.width == 16 for w, pos in plan)
+
+    def test_buffer_means(self, rasters):
+        with RasterStack(rasters, names=['a', 'b', 'c']) as stack:
+            actual = stack.buffer_means([1500, 351200], [599500, 402100], [0, 1000])
+            expected = stack.sample([1500, 351200], [599500, 402100])
+        assert actual.columns.tolist() == ['a_0m', 'a_1000m', 'b_0m', 'b_1000m', 'c_0m', 'c_1000m']
+        np.testing.assert_array_equal(actual[['a_0m', 'b_0m', 'c_0m']].to_numpy(), expected.to_numpy())
+        # the nodata corner cell is left out of the mean
+        assert actual['a_1000m'][0] == np.mean([101, 102, 101])
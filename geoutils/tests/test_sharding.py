@@ -0,0 +1,162 @@
+import os
+import time
+import numpy as np
+import pandas as pd
+import pytest
+from geoutils import hilbert_keys, spatial_shards, ShardDirectory, file_fingerprint
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({'ID': [f'{i:03d}' for i in range(200)], 'year': 2008,
+                         'eastings': rng.integers(100000, 600000, 200),
+                         'northings': rng.integers(50000, 1000000, 200)})
+
+
+def link(data):
+    return data.assign(total=data['eastings'] + data['northings'])
+
+
+def merged(directory):
+    # year is written as a categorical column (see write_table)
+    return directory.merge().astype({'year': np.int64})
+
+
+def run(directory):
+    shard = directory.claim()
+    while shard is not None:
+        directory.write(shard, link(directory.read(shard)))
+        shard = directory.claim()
+
+
+class TestHilbertKeys:
+
+    def test_curve(self):
+        # every cell of a 16 by 16 grid is visited once and consecutive cells are neighbours
+        order = 4
+        ys, xs = np.divmod(np.arange(256), 16)
+        keys = hilbert_keys(xs + 0.5, ys + 0.5, order=order, bounds=(0, 0, 16, 16))
+        assert sorted(keys) == list(range(256))
+        path = np.argsort(keys)
+        steps = np.abs(np.diff(xs[path])) + np.abs(np.diff(ys[path]))
+        assert (steps == 1).all()
+
+    def test_invalid(self):
+        keys = hilbert_keys([1000, 'error'], [1000, np.nan], order=4)
+        assert keys[0] < 256 and keys[1] == 256
+
+
+class TestSpatialShards:
+
+    def test_balanced_and_compact(self, data):
+        shards = spatial_shards(data['eastings'], data['northings'], 4)
+        assert np.bincount(shards).tolist() == [50, 50, 50, 50]
+        # shards are tiles along the curve: their bounding boxes are smaller than the one of the data
+        area = np.ptp(data['eastings']) * np.ptp(data['northings'])
+        for shard in range(4):
+            rows = data[shards == shard]
+            assert np.ptp(rows['eastings']) * np.ptp(rows['northings']) < area
+
+
+class TestShardDirectory:
+
+    def test_merge(self, data, tmp_path):
+        directory = ShardDirectory(str(tmp_path / 'shards'))
+        directory.create(data, 4, {'linkers': ['total']})
+        assert directory.plan['settings'] == {'linkers': ['total']} and directory.plan['rows'] == 200
+        assert not directory.complete()
+        with pytest.raises(RuntimeError):
+            directory.merge()
+        run(directory)
+        assert directory.complete()
+        pd.testing.assert_frame_equal(merged(directory), link(data))
+
+    @pytest.mark.parametrize('shards', [1, 3, 7])
+    def test_deterministic(self, data, tmp_path, shards):
+        directory = ShardDirectory(str(tmp_path / 'shards'))
+        directory.create(data, shards)
+        run(directory)
+        pd.testing.assert_frame_equal(merged(directory), link(data))
+
+    def test_empty_shards(self, data, tmp_path):
+        directory = ShardDirectory(str(tmp_path / 'shards'))
+        directory.create(data.head(2), 4)
+        assert directory.plan['bboxes'].count(None) == 2
+        run(directory)
+        pd.testing.assert_frame_equal(merged(directory), link(data.head(2)))
+
+    def test_claims(self, data, tmp_path):
+        first = ShardDirectory(str(tmp_path / 'shards'))
+        first.create(data, 2)
+        second = ShardDirectory(str(tmp_path / 'shards'))
+        assert first.claim() == 0
+        assert second.claim() == 1
+        assert first.claim() is None
+
+        # the claim of a crashed worker is taken over after the timeout
+        stale = ShardDirectory(str(tmp_path / 'shards'), claim_timeout=60)
+        old = time.time() - 120
+        os.utime(first.file(0, '.claim'), (old, old))
+        assert stale.claim() == 0
+        assert not os.path.exists(first.file(1, '.result.parquet'))
+        second.write(1, link(second.read(1)))
+        assert not os.path.exists(second.file(1, '.claim')) and second.done(1)
+
+    def test_stale_claim_renewed_during_takeover(self, data, tmp_path, monkeypatch):
+        directory = ShardDirectory(str(tmp_path / 'shards'), claim_timeout=60)
+        directory.create(data, 1)
+        path = directory.file(0, '.claim')
+        with open(path, 'w') as f:
+            f.write('crashed\n')
+        old = time.time() - 120
+        os.utime(path, (old, old))
+        rename = os.rename
+
+        def rename_after_other_worker(src, dst):
+            # another worker takes the stale claim over between the check and the rename
+            os.remove(src)
+            with open(src, 'w') as f:
+                f.write('live\n')
+            rename(src, dst)
+
+        monkeypatch.setattr(os, 'rename', rename_after_other_worker)
+        assert directory.claim() is None
+        monkeypatch.setattr(os, 'rename', rename)
+        with open(path) as f:
+            assert f.read() == 'live\n'
+        assert sorted(os.listdir(directory.path)) == ['plan.json', 'shard_0.claim', 'shard_0.parquet']
+
+    def test_heartbeat(self, data, tmp_path):
+        directory = ShardDirectory(str(tmp_path / 'shards'), claim_timeout=60)
+        directory.create(data, 1)
+        assert directory.claim() == 0
+        old = time.time() - 120
+        os.utime(directory.file(0, '.claim'), (old, old))
+        with directory.heartbeat(0, interval=0.05):
+            time.sleep(0.3)
+            assert ShardDirectory(directory.path, claim_timeout=60).claim() is None
+        assert time.time() - os.path.getmtime(directory.file(0, '.claim')) < 60
+
+    def test_create_again(self, data, tmp_path):
+        directory = ShardDirectory(str(tmp_path / 'shards'))
+        directory.create(data, 4)
+        run(directory)
+        assert directory.claim() is None
+        directory.create(data.head(50), 2)
+        assert sorted(os.listdir(directory.path)) == ['plan.json', 'shard_0.parquet', 'shard_1.parquet']
+        assert not directory.complete()
+        run(directory)
+        pd.testing.assert_frame_equal(merged(directory), link(data.head(50)))
+
+    def test_matches(self, data, tmp_path):
+        geocoded = tmp_path / 'geocoded.csv'
+        data.to_csv(geocoded, index=False)
+        source = {'geocodedata': file_fingerprint(str(geocoded)), 'arguments': {'shards': '4'}}
+        directory = ShardDirectory(str(tmp_path / 'shards'))
+        assert not directory.matches(source)
+        directory.create(data, 4, source=source)
+        assert directory.matches(source)
+        assert not directory.matches(dict(source, arguments={'shards': '8'}))
+        data.head(10).to_csv(geocoded, index=False)
+        assert not directory.matches({'geocodedata': file_fingerprint(str(geocoded)), 'arguments': {'shards': '4'}})
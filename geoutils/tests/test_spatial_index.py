@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+from geoutils import PointIndex
+
+
+@pytest.fixture
+def points():
+    rng = np.random.RandomState(0)
+    x = np.r_[rng.uniform(0, 50000, 2000), 70000, 70000]
+    y = np.r_[rng.uniform(0, 80000, 2000), 90000, 90000]
+    return x, y
+
+
+class TestPointIndex:
+
+    def test_query_same_as_brute_force(self, points):
+        x, y = points
+        rng = np.random.RandomState(1)
+        qx = np.r_[rng.uniform(-5000, 75000, 500), np.nan, 1e7, 70000]
+        qy = np.r_[rng.uniform(-5000, 95000, 500), 0, 1e7, 90000]
+        distances, indices = PointIndex(x, y).query(qx, qy, k=3)
+
+        dist = np.hypot(x[None, :] - qx[:-3, None], y[None, :] - qy[:-3, None])
+        expected = np.argsort(dist, axis=1, kind='stable')[:, :3]
+        np.testing.assert_array_equal(indices[:-3], expected)
+        np.testing.assert_allclose(distances[:-3], np.take_along_axis(dist, expected, axis=1))
+        assert (indices[-3] == -1).all() and np.isinf(distances[-3]).all()
+        assert indices[-2, 0] == 2000 and indices[-1, :2].tolist() == [2000, 2001]
+
+    def test_k_larger_than_points(self):
+        distances, indices = PointIndex([0, 10], [0, 0]).query([1], [0], k=3)
+        assert indices.tolist() == [[0, 1, -1]] and distances[0, 2] == np.inf
+
+    def test_within(self, points):
+        x, y = points
+        weights = np.arange(len(x), dtype=float)
+        qx, qy = np.array([25000, 100, np.nan]), np.array([40000, 100, 0])
+        counts, sums = PointIndex(x, y, cell_size=700).within(qx, qy, 3000, weights)
+        inside = np.hypot(x[None, :] - qx[:2, None], y[None, :] - qy[:2, None]) <= 3000
+        assert counts.tolist() == inside.sum(axis=1).tolist() + [0]
+        np.testing.assert_allclose(sums, (inside * weights).sum(axis=1).tolist() + [0])
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+from affine import Affine
+from rasterio.transform import from_origin
+from geoutils import SummedAreaTable, disc_strips
+
+
+def brute_force_mean(array, row, col, radius, shape):
+    values = []
+    for r in range(array.shape[0]):
+        for c in range(array.shape[1]):
+            dy, dx = r - row, c - col
+            near = max(abs(dy), abs(dx)) <= radius if shape == 'square' else dy ** 2 + dx ** 2 <= radius ** 2
+            if near and not np.isnan(array[r, c]):
+                values.append(array[r, c])
+    return np.mean(values) if values else np.nan
+
+
+@pytest.fixture
+def grid():
+    array = np.random.default_rng(0).uniform(0, 100, (30, 40))
+    array[5:8, 10:20] = np.nan
+    return array
+
+
+class TestSummedAreaTable:
+
+    @pytest.mark.parametrize('shape', ['circle', 'square'])
+    @pytest.mark.parametrize('radius', [500, 1000, 2000, 3500])
+    def test_same_as_brute_force(self, grid, shape, radius):
+        table = SummedAreaTable(grid, Affine(1000, 0, 0, 0, 1000, 0))
+        rows, cols = np.meshgrid(np.arange(0, 30, 3), np.arange(0, 40, 3))
+        xs, ys = cols.ravel() * 1000 + 300, rows.ravel() * 1000 + 900
+        expected = [brute_force_mean(grid, r, c, radius / 1000, shape) for r, c in zip(rows.ravel(), cols.ravel())]
+        np.testing.assert_allclose(table.buffer_mean(xs, ys, radius, shape), expected)
+
+    def test_north_up_raster(self, grid):
+        table = SummedAreaTable(grid, from_origin(0, 30000, 1000, 1000), nodata=-1)
+        actual = table.buffer_means([500, 10500, 'Invalid postcode', -10], [29500, 15500, 'Invalid postcode', 10],
+                                    [0, 1000])
+        assert actual.columns.tolist() == [0, 1000]
+        np.testing.assert_allclose(actual[0], [grid[0, 0], grid[14, 10], np.nan, np.nan])
+        np.testing.assert_allclose(actual[1000][:2], [brute_force_mean(grid, 0, 0, 1, 'circle'),
+                                                      brute_force_mean(grid, 14, 10, 1, 'circle')])
+
+    def test_strips(self):
+        assert disc_strips(0) == [(0, 0, 0)]
+        assert disc_strips(1) == [(0, 0, 1), (1, 1, 0), (-1, -1, 0)]
+        assert len(disc_strips(100, strips=8)) == 15
+        rows = {dy for dy0, dy1, w in disc_strips(100, strips=8) for dy in range(dy0, dy1 + 1)}
+        assert rows == set(range(-100, 101))
+
+    def test_invalid_shape(self, grid):
+        with pytest.raises(ValueError):
+            SummedAreaTable(grid, Affine(1000, 0, 0, 0, 1000, 0)).buffer_mean([0], [0], 1000, 'hexagon')
@@ -0,0 +1,134 @@
+import numpy as np
+import pandas as pd
+
+BUFFER_SHAPES = ('circle', 'square')
+
+
+class SummedAreaTable:
+    """
+    Summed-area table (integral image) of a grid, e.g. a DEFRA PCM pollution layer or a land cover raster band.
+    The sums and counts of the valid (not NaN and not nodata) cells are accumulated once, after which the sum over
+    any rectangle of cells takes four lookups. Buffer means around many co-ordinates are computed in one vectorised
+    pass with a cost per co-ordinate that does not depend on the radius.
+    """
+
+    def __init__(self, array, transform, nodata=None):
+        """
+        :param array: 2D array of the grid.
+        :param transform: affine transform from (col, row) to (x, y) co-ordinates with square cells, e.g. the
+        transform of a raster or Affine(1000, 0, 0, 0, 1000, 0) for the rows of northings of a PollutionCube layer.
+        :param nodata: value of cells without data (NaN cells are always without data).
+        """
+        if abs(transform.a) != abs(transform.e) or transform.b != 0 or transform.d != 0:
+            raise ValueError("The cells of the grid must be square and aligned with the co-ordinate axes.")
+        array = np.asarray(array, dtype=float)
+        valid = ~np.isnan(array)
+        if nodata is not None:
+            valid &= array != nodata
+        self.transform = transform
+        self.size = abs(transform.a)
+        self.shape = array.shape
+        self.sums = np.zeros((array.shape[0] + 1, array.shape[1] + 1))
+        self.sums[1:, 1:] = np.where(valid, array, 0).cumsum(axis=0).cumsum(axis=1)
+        self.counts = np.zeros((array.shape[0] + 1, array.shape[1] + 1), dtype=np.int64)
+        self.counts[1:, 1:] = valid.cumsum(axis=0).cumsum(axis=1)
+
+    def index(self, xs, ys):
+        """
+        Cell indices of co-ordinates.
+        :return: tuple of arrays: rows, cols and whether the co-ordinates are inside the grid.
+        """
+        xs = pd.to_numeric(pd.Series(np.asarray(xs, dtype=object)), errors='coerce').to_numpy(float)
+        ys = pd.to_numeric(pd.Series(np.asarray(ys, dtype=object)), errors='coerce').to_numpy(float)
+        cols, rows = ~self.transform * (xs, ys)
+        with np.errstate(invalid='ignore'):
+            rows, cols = np.floor(rows), np.floor(cols)
+            inside = (rows >= 0) & (rows < self.shape[0]) & (cols >= 0) & (cols < self.shape[1])
+        rows = np.where(inside, rows, 0).astype(np.int64)
+        cols = np.where(inside, cols, 0).astype(np.int64)
+        return rows, cols, inside
+
+    def rectangle(self, table, r0, c0, r1, c1):
+        """
+        Sums of a summed-area table over rectangles of cells (first and last rows and columns, clipped to the
+        grid).
+        """
+        r0, r1 = np.clip(r0, 0, self.shape[0]), np.clip(r1 + 1, 0, self.shape[0])
+        c0, c1 = np.clip(c0, 0, self.shape[1]), np.clip(c1 + 1, 0, self.shape[1])
+        return table[r1, c1] - table[r0, c1] - table[r1, c0] + table[r0, c0]
+
+    def buffer_mean(self, xs, ys, radius, shape='circle', strips=8):
+        """
+        Mean of the valid cells within a buffer around co-ordinates. The buffer holds the cells whose centres are
+        within radius of the centre of the cell containing each co-ordinate ('circle'), or the square of cells
+        within radius along each axis ('square'). Circles are made of at most 2 * strips - 1 rectangles, exact
+        unless the radius is more than about strips cells.
+        :param xs: array of x co-ordinates (eastings).
+        :param ys: array of y co-ordinates (northings).
+        :param radius: radius in the units of the co-ordinates (metres).
+        :param shape: 'circle' or 'square'.
+        :param strips: maximum number of rectangles per half circle.
+        :return: numpy array of means (NaN outside the grid or without valid cells in the buffer).
+        """
+        if shape not in BUFFER_SHAPES:
+            raise ValueError(f"Buffer shape must be one of {', '.join(BUFFER_SHAPES)}, not {shape}.")
+        rows, cols, inside = self.index(xs, ys)
+        k = int(np.floor(radius / self.size + 1e-9))
+        rectangles = [(-k, k, k)] if shape == 'square' else disc_strips(radius / self.size, strips)
+        sums = np.zeros(len(rows))
+        counts = np.zeros(len(rows), dtype=np.int64)
+        for dy0, dy1, w in rectangles:
+            sums += self.rectangle(self.sums, rows + dy0, cols - w, rows + dy1, cols + w)
+            counts += self.rectangle(self.counts, rows + dy0, cols - w, rows + dy1, cols + w)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = sums / counts
+        means[~inside | (counts == 0)] = np.nan
+        return means
+
+    def buffer_means(self, xs, ys, radii, shape='circle', strips=8):
+        """
+        Buffer means (see buffer_mean) for several radii.
+        :return: pandas DataFrame with a column per radius.
+        """
+        return pd.DataFrame({radius: self.buffer_mean(xs, ys, radius, shape, strips) for radius in radii})
+
+
+def disc_strips(radius, strips=8):
+    """
+    Rectangles of cells whose centres are within radius (in cells) of the centre cell, as horizontal strips of
+    rows with the same half width. If there are more than strips distinct widths per half, the rows are split into
+    strips of equal height and each strip takes the width of its middle row.
+    :param radius: radius in cells.
+    :param strips: maximum number of strips per half.
+    :return: list of tuples of first row offset, last row offset and half width (in cells).
+    """
+    k = int(np.floor(radius + 1e-9))
+    widths = np.floor(np.sqrt(np.maximum(radius ** 2 - np.arange(k + 1) ** 2, 0)) + 1e-9).astype(int)
+    bounds = np.flatnonzero(np.diff(widths)) + 1
+    if len(bounds) + 1 > strips:
+        bounds = np.unique(np.linspace(0, k + 1, strips + 1).round().astype(int))[1:-1]
+    starts = np.r_[0, bounds]
+    stops = np.r_[bounds, k + 1] - 1
+    halves = [(start, stop, int(widths[(start + stop) // 2])) for start, stop in zip(starts, stops)]
+    rectangles = [(-halves[0][1], halves[0][1], halves[0][2])]
+    for start, stop, w in halves[1:]:
+        rectangles += [(start, stop, w), (-stop, -start, w)]
+    return rectangles
+
+
+def buffer_columns(tables, xs, ys, radii, shape='circle', strips=8):
+    """
+    Buffer means of several grids around the same co-ordinates.
+    :param tables: dict of name to SummedAreaTable.
+    :param xs: array of x co-ordinates (eastings).
+    :param ys: array of y co-ordinates (northings).
+    :param radii: radii in metres.
+    :param shape: 'circle' or 'square'.
+    :param strips: maximum number of rectangles per half circle.
+    :return: pandas DataFrame with columns '<name>_<radius>m'.
+    """
+    out = {}
+    for name, table in tables.items():
+        for radius in radii:
+            out[f'{name}_{radius:g}m'] = table.buffer_mean(xs, ys, radius, shape, strips)
+    return pd.DataFrame(out)
@@ -1,10 +1,11 @@
 import sys
 import argparse
+import hashlib
 import pandas as pd
-import geopandas
 import os
+import geoutils
 import ukcensusapi.Nomisweb as CensusApi
-from functools import reduce
+from concurrent.futures import ThreadPoolExecutor
 
 
 def main():
@@ -18,9 +19,19 @@ def main():
                     " census data for England and Wales only. To find out more about census data "
                     "available go to https://www.nomisweb.co.uk/query/select/getdatasetbytheme.asp"
     )
-    parser.add_argument("--geocodedata", "-f", help="Input file with participant IDs, year and geographical "
-                                                    "co-ordinates in eastings/northings (epsg:27700).")
+    parser.add_argument("--geocodedata", "-f", help="Input file (csv, parquet or feather) with participant IDs, year "
+                                                    "and geographical co-ordinates in eastings/northings "
+                                                    "(epsg:27700).")
     parser.add_argument("--shapefile", "-s", help="Pathway to shapefile.")
+    parser.add_argument("--shapefile_store", help="Feather file for saving the boundaries of the shapefile "
+                                                  "after the first run (read instead of the shapefile when it "
+                                                  "exists).")
+    parser.add_argument("--shapefile_grid", help="Rasterised label grid (.npy) of the shapefile boundaries, "
+                                                 "built on the first run, for linking without polygon tests "
+                                                 "away from the boundaries.")
+    parser.add_argument("--grid_resolution", help="Cell size in metres of the label grid.", default=100)
+    parser.add_argument("--threads", "-t", help="Number of cores for linking geocoded data with the shapefile.",
+                        default=1)
     parser.add_argument("--shapefile_area_id", help="Column name of geographical area ids in shapefile.")
     parser.add_argument("--idcol", "-i", help="Column name for participant IDs.")
     parser.add_argument("--out", "-o", help="Output filename.")
@@ -30,6 +41,12 @@ def main():
                                                           "Must have the format: TABLE (name of census table) and"
                                                           "CENSUS_VAR_CODE (code for census table - must have a"
                                                           " corresponding script in the 'api-dir').", default=False)
+    parser.add_argument("--census_cache", help="Directory for caching the downloaded census tables between runs "
+                                               "(a table is downloaded again when its API script changes).",
+                        default="census_cache")
+    parser.add_argument("--workers", "-w", help="Number of census tables downloaded concurrently.", default=4)
+    parser.add_argument("--format", help="Output file format (columnar files keep the column types).",
+                        choices=['csv', 'parquet', 'feather'], default='csv')
 
     # Read arguments from command line
     args = parser.parse_args()
@@ -37,93 +54,122 @@ def main():
     # Read in geocoded data
     print("Reading geocoded data...")
     typedict = {args.idcol: str}
-    data = pd.read_csv(args.geocodedata,
-                       na_values=['Postcode not found', 'Invalid postcode'],
-                       dtype=typedict)
+    data = geoutils.read_table(args.geocodedata,
+                               na_values=['Postcode not found', 'Invalid postcode'],
+                               dtype=typedict)
     print("Done.")
 
     # Link data with 2001 and 2011 LSOA geography
     print("\nLinking geocoded data with shapefile"
           " boundary shapefiles from https://census.ukdataservice.ac.uk/get-data/boundary-data.aspx...")
-    data = link_geocode_with_shapefile(data, args.shapefile)
+    data = link_geocode_with_shapefile(data, args.shapefile, store=args.shapefile_store,
+                                       processes=int(args.threads), grid=args.shapefile_grid,
+                                       resolution=float(args.grid_resolution))
     data = data[[args.idcol, 'eastings', 'northings', 'year', args.shapefile_area_id]]
     print("Done.\n")
 
     # Read in info on which census data to download
     table_info = pd.read_csv(args.census_table_info)
 
-    # Get all nomisweb data
-    data_list = []
-    for index, script, ctable in table_info[['SCRIPT', 'CENSUS_VAR_CODE']].itertuples():
-        print("Downloading data for " + ctable + "...")
-        pysc = open(os.path.join(args.api_dir, script + ".py")).read()
-        exec(pysc)
-        cdata = locals()[ctable]
-        os.system("rm " + ctable + "*")
-
-        # add context - descriptions of values to the CELL column
-        api = CensusApi.Nomisweb(".")
-        api.contextify(ctable, cdata.columns[1], cdata)
-
-        # reshape data
-        if cdata.columns[3] != "CELL_NAME":
-            cdata.rename(columns={cdata.columns[3]: "CELL_NAME"}, inplace=True)
-        cdata.CELL_NAME = cdata.CELL_NAME.str.replace("[(!?:;,)%*.]+", ".", regex=True)
-        cdata.CELL_NAME = cdata.CELL_NAME.str.replace(" ", ".", regex=True)
-        cdata.drop(cdata.columns[1], axis=1, inplace=True)
-        cdata = cdata.pivot_table(index="GEOGRAPHY_CODE", columns="CELL_NAME", values="OBS_VALUE").reset_index()
-        cdata.index.name = None
-
-        # change column names to include census table
-        keys = cdata.columns[1:]
-        cols = {key: ctable + "." + key for key in keys}
-        cdata.rename(columns=cols, inplace=True)
-
-        # Append to list
-        data_list.append(cdata)
-        print(cdata.head())
-        print("Done.")
-
-    # merge list of nomisweb data
-    nomisdata = reduce(lambda df1, df2: pd.merge(df1, df2, on='GEOGRAPHY_CODE'), data_list)
+    # Get all nomisweb data (tables are fetched concurrently and kept in the census cache between runs)
+    os.makedirs(args.census_cache, exist_ok=True)
+    tables = table_info[['SCRIPT', 'CENSUS_VAR_CODE']].itertuples(index=False, name=None)
+    with ThreadPoolExecutor(max_workers=int(args.workers)) as executor:
+        data_list = list(executor.map(lambda t: get_census_table(t[0], t[1], args.api_dir, args.census_cache),
+                                      tables))
+
+    # reshape all tables in one pivot (geographies missing from any table are dropped)
+    nomisdata = pivot_census_tables(data_list)
+    print(nomisdata.head())
 
     # merge geocoded data with nomisweb data
-    data = pd.merge(data, nomisdata, left_on=args.shapefile_area_id, right_on="GEOGRAPHY_CODE", how="inner")
-    data.drop(['eastings', 'northings', 'year', 'code', 'GEOGRAPHY_CODE'], axis=1,inplace=True)
+    data = data.join(nomisdata, on=args.shapefile_area_id, how="inner").reset_index(drop=True)
+    data.drop(['eastings', 'northings', 'year', 'code'], axis=1, inplace=True)
     print(data.head())
     print(data.columns)
 
     # write output
-    out = args.out + "_nomisweb.csv.gz"
+    out = args.out + "_nomisweb." + {'csv': 'csv.gz'}.get(args.format, args.format)
     print(f"Writing results to {out}...")
-    data.to_csv(out, index=False, compression='gzip')
+    geoutils.write_table(data, out)
+
+
+def get_census_table(script, ctable, api_dir, cache_dir):
+    """
+    Get a census table with its UKCensusAPI script, unless it is in the cache.
+    :param script: name of the script in api_dir (without .py).
+    :param ctable: census table code (name of the DataFrame defined by the script).
+    :param api_dir: directory with Nomisweb API scripts generated interactively via UKCensusAPI.
+    :param cache_dir: directory of cached tables (feather files named after the table and a hash of the script).
+    :return: long DataFrame with GEOGRAPHY_CODE, CELL_NAME (prefixed with the table code) and OBS_VALUE columns.
+    """
+    pysc = open(os.path.join(api_dir, script + ".py")).read()
+    path = os.path.join(cache_dir, f"{ctable}.{hashlib.sha256(pysc.encode()).hexdigest()[:16]}.feather")
+    if os.path.exists(path):
+        print("Reading " + ctable + " from the census cache.")
+        return pd.read_feather(path)
+
+    print("Downloading data for " + ctable + "...")
+    namespace = {}
+    exec(pysc, namespace)
+    cdata = namespace[ctable]
+
+    # add context - descriptions of values to the CELL column
+    api = CensusApi.Nomisweb(".")
+    api.contextify(ctable, cdata.columns[1], cdata)
+
+    # keep long format with cell names including the census table
+    if cdata.columns[3] != "CELL_NAME":
+        cdata = cdata.rename(columns={cdata.columns[3]: "CELL_NAME"})
+    cell_name = cdata.CELL_NAME.str.replace("[(!?:;,)%*.]+", ".", regex=True).str.replace(" ", ".", regex=True)
+    cdata = pd.DataFrame({"GEOGRAPHY_CODE": cdata.GEOGRAPHY_CODE.to_numpy(),
+                          "CELL_NAME": (ctable + "." + cell_name).to_numpy(),
+                          "OBS_VALUE": cdata.OBS_VALUE.to_numpy()})
+    cdata.to_feather(path + ".tmp")
+    os.replace(path + ".tmp", path)
+    print("Done " + ctable + ".")
+    return cdata
+
+
+def pivot_census_tables(data_list):
+    """
+    Reshape long census tables into one wide table, keeping the geographies found in every table.
+    :param data_list: list of long DataFrames (see get_census_table).
+    :return: DataFrame indexed by GEOGRAPHY_CODE with a column per table and cell, in the order of data_list.
+    """
+    long = pd.concat(data_list, keys=range(len(data_list)), names=["TABLE"]).reset_index(level=0)
+    wide = long.pivot_table(index="GEOGRAPHY_CODE", columns="CELL_NAME", values="OBS_VALUE")
+    wide.columns.name = None
+
+    # keep the order of the tables (cells sorted within tables) and drop geographies missing from a table
+    order = long.groupby("CELL_NAME")["TABLE"].first().sort_index(kind="stable").sort_values(kind="stable")
+    tables = long.groupby("GEOGRAPHY_CODE")["TABLE"].nunique()
+    # reindex, as pivot_table drops geographies and cells whose values are all missing
+    return wide.reindex(index=tables.index[tables == len(data_list)], columns=list(order.index))
+
 
-def link_geocode_with_shapefile(data, shpfilename):
+def link_geocode_with_shapefile(data, shpfilename, store=None, processes=1, grid=None, resolution=100):
     """
     Link co-ordinate data with geographical regions.
     :param data: Geocoded data with eastings and northings columns (BNG co-ordinate reference system).
     :param shpfilename: URL to or downloaded boundary shapefile for reading.
+    :param store: optional feather file for saving the boundaries (read instead of the shapefile when it exists).
+    :param processes: number of processes for assigning co-ordinates to regions.
+    :param grid: optional label grid (.npy) of the regions, built if it does not exist.
+    :param resolution: size of the cells of the label grid in metres.
     :return:
     """
-    # Brittish national grid (BNG) co-ordinate reference system (CRS)
-    bng = {'init': 'epsg:27700'}
+    # Read in boundaries and build spatial index (CRS changed to BNG if necessary)
+    index = geoutils.AreaIndex.cached(shpfilename, store)
+    if grid is not None:
+        index = geoutils.AreaGrid.cached(index, grid, resolution=resolution)
 
-    # Read in england and wales shapefiles from web
-    shp = geopandas.read_file(shpfilename)
-
-    # Change CRS if necessary
-    if shp.crs != bng:
-        shp = shp.to_crs(bng)
-
-    # Create GeoDataFrame from co-ordinates in data
+    # Co-ordinates in data
     data = data.dropna()
-    data = geopandas.GeoDataFrame(
-        data, geometry=geopandas.points_from_xy(data.eastings.astype(int), data.northings.astype(int)),
-        crs=bng
-    )
+    data = data.assign(eastings=data.eastings.astype(int), northings=data.northings.astype(int))
 
-    # Spatial join data with shapefile
-    data = geopandas.sjoin(data, shp, how="inner", op='within')
+    # Join data with regions containing the co-ordinates
+    data = index.link(data, processes=processes)
 
     # Return joined data
     return data
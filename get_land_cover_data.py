@@ -1,29 +1,79 @@
-import rasterio
+import os
+import re
+import glob
+import argparse
 import pandas as pd
-import geopandas
+import geoutils
 
-# Download data on land cover 2007 from centre of ecology and hydrology (CEH)
+# Download data on land cover (1km percentage target and aggregate class rasters) from centre of ecology and
+# hydrology (CEH)
 
-# read in geocoded data
-geo_data = pd.read_csv("data/TEDS_geocoded_2008_postcodes.csv")
-geo_data = geo_data[(geo_data.eastings != "Postcode not found") & (geo_data.eastings != "Invalid postcode")]
-geo_data.dropna(inplace=True)
 
-# Get coords
-coords = [(x, y) for x, y in zip(geo_data.eastings.astype(int), geo_data.northings.astype(int))]
+def main():
+    # Initiate parser and add arguments
+    parser = argparse.ArgumentParser(
+        description="Python programme for linking geocoded postcodes with the CEH land cover map (percentage cover "
+                    "of each target and aggregate class in 1km squares)."
+    )
+    parser.add_argument("--geocodedata", "-f", help="Input file (csv, parquet or feather) with participant IDs, year "
+                                                    "and geographical co-ordinates.",
+                        default="data/TEDS_geocoded_2008_postcodes.csv")
+    parser.add_argument("--rasterdir", "-d", help="Directory of the land cover map with the "
+                                                  "'percentage_target_class' and 'percentage_aggregate_class' "
+                                                  "directories.", default="land_cover_data/lcm-2007-1km_3755987")
+    parser.add_argument("--year", "-y", help="Year of the land cover map.", default=2007)
+    parser.add_argument("--buffers", "-b", help="Radii in metres separated by comma (e.g. 500,1000,2000) of "
+                                                "buffers for the mean percentage cover around each postcode.")
+    parser.add_argument("--buffer-shape", help="Shape of the buffers.", choices=['circle', 'square'],
+                        default='circle')
+    parser.add_argument("--outputfile", "-o", help="Output filename (.csv.gz, .parquet or "
+                                                  ".feather).", default="data/TEDS_land_cover_data.csv.gz")
 
-# read in each raster image and get values for target classes
-for n in range(1, 24):
-    src = rasterio.open("land_cover_data/lcm-2007-1km_3755987/percentage_target_class/LCM2007_GB_1K_PC_TargetClass_" +
-                        str(n) + ".tif")
-    geo_data['LCM_TargetClass_' + str(n)] = [x[0] for x in src.sample(coords)]
+    # Read arguments from command line
+    args = parser.parse_args()
 
-# read in each raster image and get values for aggregate classes
-for n in range(1, 11):
-    src = rasterio.open("land_cover_data/lcm-2007-1km_3755987/percentage_aggregate_class/LCM2007_GB_1K_PC_AggregateClass_"
-                        + str(n) + ".tif")
-    geo_data['LCM_AggregateClass_' + str(n)] = [x[0] for x in src.sample(coords)]
+    # read in geocoded data
+    geo_data = geoutils.read_table(args.geocodedata)
+    geo_data = geo_data[(geo_data.eastings != "Postcode not found") & (geo_data.eastings != "Invalid postcode")]
+    geo_data.dropna(inplace=True)
 
-# write data
-geo_data.drop(['year', 'postcode', 'eastings', 'northings', 'country'], axis=1, inplace=True)
-geo_data.to_csv("data/TEDS_land_cover_data.csv.gz", index=False, compression='gzip')
+    # get values for target and aggregate classes
+    paths, names = land_cover_rasters(args.rasterdir, args.year)
+    with geoutils.RasterStack(paths, names) as stack:
+        values = stack.sample(geo_data.eastings.astype(int), geo_data.northings.astype(int))
+        if args.buffers:
+            radii = [float(r) for r in args.buffers.split(',')]
+            values = pd.concat([values, stack.buffer_means(geo_data.eastings.astype(int),
+                                                           geo_data.northings.astype(int), radii,
+                                                           args.buffer_shape)], axis=1)
+    geo_data = pd.concat([geo_data.reset_index(drop=True), values], axis=1)
+
+    # write data
+    geo_data.drop(['year', 'postcode', 'eastings', 'northings', 'country', 'crs'], axis=1, inplace=True,
+                  errors='ignore')
+    geoutils.write_table(geo_data, args.outputfile)
+
+
+def land_cover_rasters(rasterdir, year):
+    """
+    Find the percentage target and aggregate class rasters of a land cover map, e.g.
+    'percentage_target_class/LCM2007_GB_1K_PC_TargetClass_1.tif'.
+    :param rasterdir: directory of the land cover map.
+    :param year: year of the land cover map.
+    :return: tuple of lists of raster filenames and column names (i.e. 'LCM_TargetClass_1').
+    """
+    paths, names = [], []
+    for directory, cls in [('percentage_target_class', 'TargetClass'),
+                           ('percentage_aggregate_class', 'AggregateClass')]:
+        files = glob.glob(os.path.join(rasterdir, directory, f"LCM{year}_GB_1K_PC_{cls}_*.tif"))
+        numbers = {int(re.search(r"_(\d+)\.tif$", f).group(1)): f for f in files}
+        for n in sorted(numbers):
+            paths.append(numbers[n])
+            names.append(f"LCM_{cls}_{n}")
+    if not paths:
+        raise FileNotFoundError(f"No land cover rasters for {year} found in {rasterdir}.")
+    return paths, names
+
+
+if __name__ == "__main__":
+    main()
@@ -1,36 +1,90 @@
+import argparse
 import pandas as pd
 import numpy as np
+import geoutils
 
 # Download data on 'AADF Data - major and minor roads' from https://roadtraffic.dft.gov.uk/downloads
 
-# read traffic data
-road_data = pd.read_csv("traffic_data/dft_traffic_counts_aadf.csv")
-
-# select 2008 data and columns in traffic data
-road_data = road_data[['year', 'local_authority_name', 'road_name', 'road_category',
-                       'road_type', 'easting', 'northing', 'link_length_km', 'estimation_method',
-                       'all_motor_vehicles']]
-road_data = road_data[road_data.year == 2008]
-road_data.road_type.value_counts()
-
-# read in geocoded data
-geo_data = pd.read_csv("data/TEDS_geocoded_2008_postcodes.csv")
-geo_data = geo_data[(geo_data.eastings != "Postcode not found") & (geo_data.eastings != "Invalid postcode")]
-geo_data.dropna(inplace=True)
-
-# find major/minor road nearest to postcode
-nearest_road = []
-for index, id_twin, easting, northing in geo_data[['id_twin', 'eastings', 'northings']].itertuples():
-    east = ((np.array(road_data["easting"]) - int(easting)) ** 2)
-    north = ((np.array(road_data["northing"]) - int(northing)) ** 2)
-    road_data["distance"] = np.sqrt(east + north) / 1000
-    row = road_data[road_data.distance == road_data.distance.min()].values.tolist()[0]
-    row = [id_twin] + row
-    nearest_road.append(np.array(row))
-
-data = pd.DataFrame(nearest_road)
-data.columns = ['id_twin'] + road_data.columns.tolist()
-data.drop(['local_authority_name', 'year', 'easting', 'northing'], axis=1, inplace=True)
-
-# write data
-data.to_csv("data/TEDS_traffic_data.csv.gz", index=False, compression='gzip')
+ROAD_COLUMNS = ['year', 'local_authority_name', 'road_name', 'road_category', 'road_type', 'easting', 'northing',
+                'link_length_km', 'estimation_method', 'all_motor_vehicles']
+
+
+def main():
+    # Initiate parser and add arguments
+    parser = argparse.ArgumentParser(
+        description="Python programme for linking geocoded postcodes with the nearest major/minor road traffic "
+                    "count points from https://roadtraffic.dft.gov.uk/downloads."
+    )
+    parser.add_argument("--geocodedata", "-f", help="Input file (csv, parquet or feather) with participant IDs, year "
+                                                    "and geographical co-ordinates.",
+                        default="data/TEDS_geocoded_2008_postcodes.csv")
+    parser.add_argument("--trafficdata", "-r", help="AADF traffic counts file.",
+                        default="traffic_data/dft_traffic_counts_aadf.csv")
+    parser.add_argument("--year", "-y", help="Year of traffic data.", default=2008)
+    parser.add_argument("--idcol", "-i", help="Column name for participant IDs.", default="id_twin")
+    parser.add_argument("--knearest", "-k", help="Number of nearest roads.", default=1)
+    parser.add_argument("--radius", help="Radii in metres, separated by comma, for counting roads and summing "
+                                         "traffic (all_motor_vehicles) around each postcode.")
+    parser.add_argument("--outputfile", "-o", help="Output filename (.csv.gz, .parquet or "
+                                                  ".feather).", default="data/TEDS_traffic_data.csv.gz")
+
+    # Read arguments from command line
+    args = parser.parse_args()
+
+    # read traffic data and select year and columns
+    road_data = pd.read_csv(args.trafficdata)
+    road_data = road_data[ROAD_COLUMNS]
+    road_data = road_data[road_data.year == int(args.year)]
+
+    # read in geocoded data
+    geo_data = geoutils.read_table(args.geocodedata)
+    geo_data = geo_data[(geo_data.eastings != "Postcode not found") & (geo_data.eastings != "Invalid postcode")]
+    geo_data.dropna(inplace=True)
+
+    # find major/minor roads nearest to postcode
+    radii = [float(r) for r in args.radius.split(',')] if args.radius else []
+    data = link_nearest_roads(geo_data[[args.idcol]], geo_data.eastings.astype(int), geo_data.northings.astype(int),
+                              road_data, k=int(args.knearest), radii=radii)
+    suffixes = [''] + ['_' + str(rank) for rank in range(2, int(args.knearest) + 1)]
+    data.drop([col + suffix for col in ['local_authority_name', 'year', 'easting', 'northing'] for suffix in suffixes],
+              axis=1, inplace=True)
+
+    # write data
+    geoutils.write_table(data, args.outputfile)
+
+
+def link_nearest_roads(data, eastings, northings, road_data, k=1, radii=(), weight_col='all_motor_vehicles'):
+    """
+    Link co-ordinates with the nearest road traffic count points using a spatial index over the count points.
+    :param data: DataFrame (e.g. participant IDs) with one row per co-ordinate.
+    :param eastings: east co-ordinates in metres.
+    :param northings: north co-ordinates in metres.
+    :param road_data: DataFrame of count points with columns easting and northing.
+    :param k: number of nearest count points.
+    :param radii: radii in metres for counting count points and summing weight_col around each co-ordinate.
+    :param weight_col: column of road_data summed within each radius.
+    :return: data with the columns of the nearest count point and its distance in km, the columns of the
+    2nd to kth nearest count points (suffixed '_2' to '_k'), and n_roads_<radius>m and <weight_col>_<radius>m.
+    """
+    index = geoutils.PointIndex(road_data['easting'], road_data['northing'])
+    eastings = np.asarray(eastings, dtype=float)
+    northings = np.asarray(northings, dtype=float)
+    distances, indices = index.query(eastings, northings, k=k)
+
+    dfs = [data.reset_index(drop=True)]
+    for rank in range(k):
+        nearest = road_data.iloc[np.where(indices[:, rank] >= 0, indices[:, rank], 0)].reset_index(drop=True)
+        nearest['distance'] = distances[:, rank] / 1000
+        nearest.loc[indices[:, rank] < 0, :] = np.nan
+        if rank > 0:
+            nearest = nearest.add_suffix('_' + str(rank + 1))
+        dfs.append(nearest)
+    for radius in radii:
+        counts, sums = index.within(eastings, northings, radius, road_data[weight_col])
+        name = '%gm' % radius
+        dfs.append(pd.DataFrame({'n_roads_' + name: counts, weight_col + '_' + name: sums}))
+    return pd.concat(dfs, axis=1)
+
+
+if __name__ == "__main__":
+    main()
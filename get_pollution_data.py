@@ -4,6 +4,7 @@ import pandas as pd
 from datetime import date
 from tabulate import tabulate
 import scrapedefra
+import geoutils
 
 POLLUTANTS = {'PM10', 'PM2.5', 'NO2', 'NOX', 'CO', 'SO2', 'OZONE', 'BENZENE'}
 
@@ -13,19 +14,41 @@ def main():
         description="Python programme for scraping annual pollution statistics for geocoded UK postcodes"
                     " from https://uk-air.defra.gov.uk/data/pcm-data. "
     )
-    parser.add_argument("--geocodedata", "-f", help="Input file with participant IDs, year and geographical "
-                                                    "co-ordinates.")
+    parser.add_argument("--geocodedata", "-f", help="Input file (csv, parquet or feather) with participant IDs, year "
+                                                    "and geographical co-ordinates.")
     parser.add_argument("--idcol", "-i", help="Column name for participant IDs.")
     parser.add_argument("--outputfile", "-o", help="Output filename.")
     parser.add_argument("--pollutants", "-p", help="List of pollutants separated by column.",
                         default='PM10,PM2.5,NO2,NOX,SO2,OZONE,BENZENE')
+    parser.add_argument("--cachedir", "-c", help="Directory for caching downloads from "
+                                                 "https://uk-air.defra.gov.uk between runs.")
+    parser.add_argument("--offline", help="Only use downloads found in the cache directory.",
+                        action="store_true")
+    parser.add_argument("--cube", help="Memory-mapped pollution cube (.npy) used for linking, built from "
+                                       "https://uk-air.defra.gov.uk/data/pcm-data if it does not exist.")
+    parser.add_argument("--workers", "-w", help="Number of threads for downloading and parsing pollution data.",
+                        default=4)
+    parser.add_argument("--buffers", "-b", help="Radii in metres separated by comma (e.g. 500,1000,2000) of "
+                                                "buffers for mean pollution around each postcode (requires --cube).")
+    parser.add_argument("--buffer-shape", help="Shape of the buffers.", choices=['circle', 'square'],
+                        default='circle')
+    parser.add_argument("--incremental", help="Only link rows (ID, year and co-ordinates) that are new or changed "
+                                              "since the previous run, or whose pollution data (download links) "
+                                              "changed, and merge them into the existing output (row fingerprints "
+                                              "are kept in <output>.fingerprints.npy).", action="store_true")
+    parser.add_argument("--format", help="Output file format (columnar files keep the column types).",
+                        choices=['csv', 'parquet', 'feather'], default='csv')
+    parser.add_argument("--metrics", help="JSON file for the run metrics (time, rows per second, HTTP requests, "
+                                          "bytes and cache hit ratios of each stage and peak memory).")
 
     # Read arguments from command line
     args = parser.parse_args()
 
     # Read in geocoded data
     print("Reading geocoded data...")
-    data = pd.read_csv(args.geocodedata)
+    with geoutils.METRICS.stage('read') as stage:
+        data = geoutils.read_table(args.geocodedata)
+        stage['rows'] = len(data)
     print("Done.")
 
     print("\nScraping pollution data...")
@@ -37,11 +60,21 @@ def main():
             sys.exit(f"Error: {p} is not a valid pollutant.\n"
                      f"Valid pollutants: {', '.join(POLLUTANTS)}.")
 
+    radii = [float(r) for r in args.buffers.split(',')] if args.buffers else None
+    if radii and args.cube is None:
+        sys.exit("Error: --buffers requires a pollution cube (--cube).")
+
     # Years of postcode data collection
     years = data.year.dropna().unique()
 
     # Intialise class to scrape pollution data
-    sc = scrapedefra.ScrapeDefraPollution(years, pollutants)
+    cache = None
+    if args.cachedir is not None:
+        cache = geoutils.DownloadCache(args.cachedir, offline=args.offline)
+    elif args.offline:
+        sys.exit("Error: --offline requires a cache directory (--cachedir).")
+    with geoutils.METRICS.stage('scrape'):
+        sc = scrapedefra.ScrapeDefraPollution(years, pollutants, cache=cache)
 
     # Print info df
     print("\nInformation on selected pollutants:")
@@ -59,15 +92,46 @@ def main():
 
     # Link postcode data with the pollution data
     print(f"\n\nLinking postcodes to data on selected pollutants: {', '.join(pollutants)}...")
-    p_data = sc.linking_func(data, args.idcol)
+    cube = None
+    if args.cube is not None:
+        with geoutils.METRICS.stage('cube'):
+            cube = sc.get_cube(args.cube, workers=int(args.workers))
+    out = args.outputfile + "_pollution_data." + args.format
+    output = None
+    if args.incremental:
+        # The fingerprint of a row includes the download links of the pollution data of its year
+        links = sc.get_download_links()
+        versions = {year: '|'.join([links[(year, p)] for p in pollutants] + [str(radii), args.buffer_shape])
+                    for year in years}
+        fingerprints = geoutils.row_fingerprints(data, [args.idcol, 'year', 'eastings', 'northings'],
+                                                 version=data['year'].map(versions).to_numpy())
+        output = geoutils.IncrementalOutput(out, fingerprints)
+        print(f"{int(output.kept.sum())} row(s) kept from {out}, {int(output.changed.sum())} new or changed "
+              f"row(s) to link.")
+        data = data[output.changed].assign(fingerprint=fingerprints[output.changed])
+
+    with geoutils.METRICS.stage('link', rows=len(data)):
+        if len(data):
+            p_data = sc.linking_func(data, args.idcol, workers=int(args.workers), cube=cube, radii=radii,
+                                     shape=args.buffer_shape)
+        else:
+            p_data = data
 
     # Write data
 
-    out = args.outputfile + "_pollution_data" + ".csv"
     print(f"Writing results to {out}...")
-    p_data.to_csv(out, index=False)
+    with geoutils.METRICS.stage('write', rows=len(p_data)):
+        if output is not None:
+            p_data, fingerprints = output.merge(p_data.drop('fingerprint', axis=1), p_data['fingerprint'])
+            output.write(p_data, fingerprints)
+        else:
+            geoutils.write_table(p_data, out)
     print("Done.")
 
+    if args.metrics is not None:
+        geoutils.METRICS.write(args.metrics)
+        print(f"Run metrics written to {args.metrics}.")
+
 
 
 if __name__ == "__main__":
@@ -0,0 +1,185 @@
+import os
+import sys
+import argparse
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+import geoutils
+import scrapedefra
+from get_pollution_data import POLLUTANTS
+from get_major_road_data import ROAD_COLUMNS, link_nearest_roads
+from get_land_cover_data import land_cover_rasters
+
+LINKERS = ['pollution', 'census', 'landcover', 'roads', 'urban']
+
+URBAN_CLASSIFICATION_URLS = [
+    'https://borders.ukdataservice.ac.uk/ukborders/easy_download/prebuilt/shape/England_oa_ru_classn_2011.zip',
+    'https://borders.ukdataservice.ac.uk/ukborders/easy_download/prebuilt/shape/Wales_oa_ru_classn_2011.zip'
+]
+
+
+def main():
+    # Initiate parser and add arguments
+    parser = argparse.ArgumentParser(
+        description="Python programme for linking geocoded postcodes with several exposures in one run. The "
+                    "geocoded data is read once, each distinct co-ordinate (and year) is linked once by each of "
+                    "the selected linkers, which run concurrently, and the results are written to one file with "
+                    "a row per geocoded postcode. Unlike the single exposure scripts, postcodes that cannot be "
+                    "linked are kept with missing values."
+    )
+    parser.add_argument("--geocodedata", "-f", help="Input file (csv, parquet or feather) with participant IDs, year "
+                                                    "and geographical co-ordinates.",
+                        default="data/TEDS_geocoded_2008_postcodes.csv")
+    parser.add_argument("--idcol", "-i", help="Column name for participant IDs.", default="id_twin")
+    parser.add_argument("--outputfile", "-o", help="Output filename (.csv.gz, .parquet or .feather).",
+                        default="data/TEDS_exposures.csv.gz")
+    parser.add_argument("--linkers", "-l", help="Linkers separated by comma: " + ", ".join(LINKERS) + ".",
+                        default="pollution,landcover,roads,urban")
+    parser.add_argument("--workers", "-w", help="Number of threads for downloading and parsing data in each "
+                                                "linker.", default=4)
+    # pollution
+    parser.add_argument("--pollutants", "-p", help="List of pollutants separated by column.",
+                        default='PM10,PM2.5,NO2,NOX,SO2,OZONE,BENZENE')
+    parser.add_argument("--cachedir", "-c", help="Directory for caching downloads from "
+                                                 "https://uk-air.defra.gov.uk between runs.")
+    parser.add_argument("--offline", help="Only use downloads found in the cache directory.",
+                        action="store_true")
+    parser.add_argument("--cube", help="Memory-mapped pollution cube (.npy) used for linking pollution data.")
+    # census
+    parser.add_argument("--shapefile", "-s", help="Pathway to shapefile of the census geography.")
+    parser.add_argument("--shapefile_store", help="Feather file for saving the boundaries of the shapefile.")
+    parser.add_argument("--shapefile_area_id", help="Column name of geographical area ids in shapefile.")
+    parser.add_argument("--api_dir", "-d", help="Directory with Nomisweb API scripts generated interactively via"
+                                                " UKCensusAPI.")
+    parser.add_argument("--census_table_info", help="CSV file with info on which census tables to download.")
+    parser.add_argument("--census_cache", help="Directory for caching the downloaded census tables.",
+                        default="census_cache")
+    # land cover
+    parser.add_argument("--rasterdir", help="Directory of the land cover map.",
+                        default="land_cover_data/lcm-2007-1km_3755987")
+    parser.add_argument("--lcm_year", help="Year of the land cover map.", default=2007)
+    # roads
+    parser.add_argument("--trafficdata", help="AADF traffic counts file.",
+                        default="traffic_data/dft_traffic_counts_aadf.csv")
+    parser.add_argument("--traffic_year", help="Year of traffic data.", default=2008)
+    parser.add_argument("--knearest", "-k", help="Number of nearest roads.", default=1)
+    parser.add_argument("--radius", help="Radii in metres, separated by comma, for counting roads and summing "
+                                         "traffic (all_motor_vehicles) around each postcode.")
+    parser.add_argument("--metrics", help="JSON file for the run metrics (time, rows per second, HTTP requests, "
+                                          "bytes and cache hit ratios of each linker and peak memory).")
+    # urban classification
+    parser.add_argument("--boundary_store", help="Boundary store directory for the output area urban/rural "
+                                                 "classification.", default="boundary_data")
+
+    # Read arguments from command line
+    args = parser.parse_args()
+
+    linkers = args.linkers.split(',')
+    for linker in linkers:
+        if linker not in LINKERS:
+            sys.exit(f"Error: {linker} is not a valid linker.\nValid linkers: {', '.join(LINKERS)}.")
+
+    # Read in geocoded data once and reduce it to distinct co-ordinates
+    print("Reading geocoded data...")
+    with geoutils.METRICS.stage('read') as stage:
+        data = geoutils.read_geocoded(args.geocodedata, args.idcol)
+        table = geoutils.CoordinateTable(data)
+        stage['rows'] = len(data)
+    print(f"Done ({len(data)} postcodes, {len(table)} distinct co-ordinates and years).")
+
+    # Run linkers concurrently on the distinct co-ordinates
+    functions = {'pollution': link_pollution, 'census': link_census, 'landcover': link_land_cover,
+                 'roads': link_roads, 'urban': link_urban_classification}
+
+    def run(linker):
+        print(f"Linking {linker}...")
+        with geoutils.METRICS.stage(linker, rows=len(table)):
+            linked = functions[linker](table.coords, args)
+        print(f"Done {linker}.")
+        return linked
+
+    with ThreadPoolExecutor(max_workers=len(linkers)) as executor:
+        results = list(executor.map(run, linkers))
+
+    # Broadcast the results back to the postcodes and write one output
+    data = pd.concat([data] + [table.broadcast(linked) for linked in results], axis=1)
+    print(f"Writing results to {args.outputfile}...")
+    with geoutils.METRICS.stage('write', rows=len(data)):
+        geoutils.write_table(data, args.outputfile)
+    print("Done.")
+
+    if args.metrics is not None:
+        geoutils.METRICS.write(args.metrics)
+        print(f"Run metrics written to {args.metrics}.")
+
+
+def area_attributes(index, coords):
+    """
+    Attributes of the areas containing co-ordinates.
+    :param index: geoutils.AreaIndex.
+    :param coords: DataFrame with eastings and northings columns.
+    :return: DataFrame with a row per co-ordinate (missing values outside the areas).
+    """
+    positions = index.assign(coords['eastings'], coords['northings'])
+    areas = index.areas
+    attributes = pd.DataFrame(areas.drop(columns=areas.geometry.name)).reset_index(drop=True)
+    return attributes.reindex(positions).reset_index(drop=True)
+
+
+def link_pollution(coords, args):
+    pollutants = args.pollutants.split(',')
+    for p in pollutants:
+        if p not in POLLUTANTS:
+            raise ValueError(f"{p} is not a valid pollutant.")
+    cache = geoutils.DownloadCache(args.cachedir, offline=args.offline) if args.cachedir else None
+    sc = scrapedefra.ScrapeDefraPollution(coords['year'].unique(), pollutants, cache=cache)
+    cube = sc.get_cube(args.cube, workers=int(args.workers)) if args.cube else None
+    linked = sc.linking_func(coords.assign(row=np.arange(len(coords))), 'row', workers=int(args.workers),
+                             cube=cube)
+    return linked.sort_values('row')[pollutants]
+
+
+def link_census(coords, args):
+    from get_census_data import get_census_table, pivot_census_tables
+
+    index = geoutils.AreaIndex.cached(args.shapefile, args.shapefile_store)
+    area_ids = area_attributes(index, coords)[args.shapefile_area_id]
+
+    os.makedirs(args.census_cache, exist_ok=True)
+    table_info = pd.read_csv(args.census_table_info)
+    tables = table_info[['SCRIPT', 'CENSUS_VAR_CODE']].itertuples(index=False, name=None)
+    with ThreadPoolExecutor(max_workers=int(args.workers)) as executor:
+        data_list = list(executor.map(lambda t: get_census_table(t[0], t[1], args.api_dir, args.census_cache),
+                                      tables))
+    nomisdata = pivot_census_tables(data_list).reindex(area_ids)
+    return pd.concat([area_ids.reset_index(drop=True), nomisdata.reset_index(drop=True)], axis=1)
+
+
+def link_land_cover(coords, args):
+    paths, names = land_cover_rasters(args.rasterdir, args.lcm_year)
+    with geoutils.RasterStack(paths, names) as stack:
+        return stack.sample(coords['eastings'], coords['northings'])
+
+
+def link_roads(coords, args):
+    road_data = pd.read_csv(args.trafficdata)
+    road_data = road_data[ROAD_COLUMNS]
+    road_data = road_data[road_data.year == int(args.traffic_year)]
+    radii = [float(r) for r in args.radius.split(',')] if args.radius else []
+    linked = link_nearest_roads(pd.DataFrame(index=coords.index), coords['eastings'], coords['northings'],
+                                road_data, k=int(args.knearest), radii=radii)
+    suffixes = [''] + ['_' + str(rank) for rank in range(2, int(args.knearest) + 1)]
+    return linked.drop([col + suffix for col in ['local_authority_name', 'year', 'easting', 'northing']
+                        for suffix in suffixes], axis=1)
+
+
+def link_urban_classification(coords, args):
+    store = geoutils.BoundaryStore(args.boundary_store)
+    store.add("OA_ru_classn_2011", URBAN_CLASSIFICATION_URLS,
+              drop=["assign_chr", "assign_chg", "bound_chgi", "ruc11cd", "name", "label"])
+    areas = store.read("OA_ru_classn_2011", bbox=geoutils.coordinates_bbox(coords['eastings'], coords['northings']))
+    return area_attributes(geoutils.AreaIndex(areas), coords).drop('code', axis=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+import os
+import sys
+import argparse
+import multiprocessing as mp
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+import geoutils
+import scrapedefra
+from get_pollution_data import POLLUTANTS
+from get_land_cover_data import land_cover_rasters
+from link_exposures import URBAN_CLASSIFICATION_URLS, area_attributes
+
+LINKERS = ['pollution', 'census', 'landcover', 'urban']
+
+STEPS = ['plan', 'work', 'merge', 'all']
+
+# Arguments of the plan step recorded in the plan (with a fingerprint of the geocoded data)
+PLAN_ARGUMENTS = ['idcol', 'shards', 'linkers', 'pollutants', 'cube', 'shapefile', 'shapefile_area_id', 'api_dir',
+                  'census_table_info', 'rasterdir', 'lcm_year', 'boundary_store']
+
+
+def main():
+    # Initiate parser and add arguments
+    parser = argparse.ArgumentParser(
+        description="Python programme for linking national-scale geocoded data with exposures on several processes "
+                    "or nodes. The plan step sorts the co-ordinates along a Hilbert curve, partitions them into "
+                    "spatial shards written to a shared directory and prepares the datasets once (pollution cube, "
+                    "boundary store, census tables). Workers (run the work step on each node) claim shards from "
+                    "the shared directory and only read the boundaries, pollution grid and raster windows "
+                    "covering their shard. The merge step writes the results in the order of the input."
+    )
+    parser.add_argument("--step", help="Step to run ('all': plan unless the shard directory has a plan of the same "
+                                       "geocoded data and arguments, work with --processes local workers and "
+                                       "merge).", choices=STEPS, default='all')
+    parser.add_argument("--sharddir", "-d", help="Shared directory of the shards.", default="shards")
+    parser.add_argument("--shards", "-n", help="Number of shards.", default=16)
+    parser.add_argument("--processes", "-t", help="Number of local worker processes (work and all steps).",
+                        default=1)
+    parser.add_argument("--claim-timeout", help="Number of seconds after which the shard of a worker that stopped "
+                                                "touching its claim (every quarter of the timeout while linking) is "
+                                                "taken over by another worker.", default=3600)
+    parser.add_argument("--geocodedata", "-f", help="Input file (csv, parquet or feather) with participant IDs, year "
+                                                    "and geographical co-ordinates (plan step).")
+    parser.add_argument("--idcol", "-i", help="Column name for participant IDs (plan step).", default="id_twin")
+    parser.add_argument("--outputfile", "-o", help="Output filename (.csv.gz, .parquet or .feather, merge step).",
+                        default="data/TEDS_exposures.csv.gz")
+    parser.add_argument("--linkers", "-l", help="Linkers separated by comma: " + ", ".join(LINKERS) + ".",
+                        default="pollution,landcover,urban")
+    # pollution
+    parser.add_argument("--pollutants", "-p", help="List of pollutants separated by column.",
+                        default='PM10,PM2.5,NO2,NOX,SO2,OZONE,BENZENE')
+    parser.add_argument("--cachedir", "-c", help="Directory for caching downloads from "
+                                                 "https://uk-air.defra.gov.uk between runs.")
+    parser.add_argument("--offline", help="Only use downloads found in the cache directory.",
+                        action="store_true")
+    parser.add_argument("--cube", help="Memory-mapped pollution cube (.npy) on the shared file system, built "
+                                       "by the plan step if it does not exist.", default="pcm.npy")
+    parser.add_argument("--workers", "-w", help="Number of threads for downloading pollution data and census "
+                                                "tables in the plan step.", default=4)
+    # census
+    parser.add_argument("--shapefile", "-s", help="Pathway to shapefile of the census geography.")
+    parser.add_argument("--shapefile_area_id", help="Column name of geographical area ids in shapefile.")
+    parser.add_argument("--api_dir", help="Directory with Nomisweb API scripts generated interactively via "
+                                          "UKCensusAPI.")
+    parser.add_argument("--census_table_info", help="CSV file with info on which census tables to download.")
+    parser.add_argument("--census_cache", help="Directory for caching the downloaded census tables.",
+                        default="census_cache")
+    # land cover
+    parser.add_argument("--rasterdir", help="Directory of the land cover map.",
+                        default="land_cover_data/lcm-2007-1km_3755987")
+    parser.add_argument("--lcm_year", help="Year of the land cover map.", default=2007)
+    # boundaries (urban classification and census geography)
+    parser.add_argument("--boundary_store", help="Boundary store directory on the shared file system.",
+                        default="boundary_data")
+
+    # Read arguments from command line
+    args = parser.parse_args()
+
+    directory = geoutils.ShardDirectory(args.sharddir, claim_timeout=float(args.claim_timeout))
+    if args.geocodedata is not None and not os.path.exists(args.geocodedata):
+        sys.exit(f"Error: {args.geocodedata} not found.")
+
+    # the all step reuses the plan of the shard directory if made from the same geocoded data and arguments
+    planned = directory.planned() and (args.geocodedata is None or directory.matches(plan_source(args)))
+    if args.step == 'all' and directory.planned() and not planned:
+        print(f"The plan of {args.sharddir} was made from other geocoded data or arguments.")
+
+    if args.step == 'plan' or (args.step == 'all' and not planned):
+        linkers = args.linkers.split(',')
+        for linker in linkers:
+            if linker not in LINKERS:
+                sys.exit(f"Error: {linker} is not a valid linker.\nValid linkers: {', '.join(LINKERS)}.")
+        if args.geocodedata is None:
+            sys.exit("Error: the plan step requires the geocoded data (--geocodedata).")
+        if 'census' in linkers and None in (args.shapefile, args.shapefile_area_id, args.api_dir,
+                                            args.census_table_info):
+            sys.exit("Error: the census linker requires --shapefile, --shapefile_area_id, --api_dir and "
+                     "--census_table_info.")
+        plan(directory, args, linkers)
+
+    if args.step in ('work', 'all'):
+        processes = [mp.Process(target=work, args=(args.sharddir, float(args.claim_timeout)))
+                     for _ in range(int(args.processes))]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+    if args.step in ('merge', 'all'):
+        if not directory.complete():
+            sys.exit(f"Error: not all shards of {args.sharddir} are linked yet.")
+        print("Merging shards...")
+        data = directory.merge()
+        print(f"Writing results to {args.outputfile}...")
+        geoutils.write_table(data, args.outputfile)
+        print("Done.")
+
+
+def plan(directory, args, linkers):
+    """
+    Read the geocoded data, prepare the datasets of the linkers on the shared file system and write the shards.
+    :param directory: geoutils.ShardDirectory.
+    :param args: arguments of the script.
+    :param linkers: list of linkers.
+    """
+    print("Reading geocoded data...")
+    data = geoutils.read_geocoded(args.geocodedata, args.idcol)
+    print(f"Done ({len(data)} postcodes).")
+    settings = {'linkers': linkers}
+
+    if 'pollution' in linkers:
+        pollutants = args.pollutants.split(',')
+        for p in pollutants:
+            if p not in POLLUTANTS:
+                sys.exit(f"Error: {p} is not a valid pollutant.\nValid pollutants: {', '.join(POLLUTANTS)}.")
+        print("Preparing the pollution cube...")
+        cache = geoutils.DownloadCache(args.cachedir, offline=args.offline) if args.cachedir else None
+        sc = scrapedefra.ScrapeDefraPollution(data['year'].unique(), pollutants, cache=cache)
+        cube = sc.get_cube(args.cube, workers=int(args.workers))
+        # year of pollution data for each pollutant and year of postcode data collection
+        years = sc.pollution_data.drop_duplicates(['pollutant', 'year_postcode_data_collected'])
+        settings['pollution'] = {
+            'cube': os.path.abspath(cube.path), 'pollutants': pollutants,
+            'years': {f'{row.pollutant}|{row.year_postcode_data_collected}': str(row.year_pollution_data_collected)
+                      for row in years.itertuples(index=False)}
+        }
+
+    if 'census' in linkers:
+        from get_census_data import get_census_table
+
+        print("Preparing the census geography and tables...")
+        store = geoutils.BoundaryStore(args.boundary_store)
+        name = os.path.splitext(os.path.basename(args.shapefile))[0]
+        store.add(name, [args.shapefile])
+        os.makedirs(args.census_cache, exist_ok=True)
+        tables = pd.read_csv(args.census_table_info)[['SCRIPT', 'CENSUS_VAR_CODE']].values.tolist()
+        with ThreadPoolExecutor(max_workers=int(args.workers)) as executor:
+            list(executor.map(lambda t: get_census_table(t[0], t[1], args.api_dir, args.census_cache), tables))
+        settings['census'] = {
+            'store': os.path.abspath(args.boundary_store), 'name': name, 'area_id': args.shapefile_area_id,
+            'api_dir': os.path.abspath(args.api_dir), 'cache': os.path.abspath(args.census_cache), 'tables': tables
+        }
+
+    if 'landcover' in linkers:
+        paths, names = land_cover_rasters(args.rasterdir, args.lcm_year)
+        settings['landcover'] = {'paths': [os.path.abspath(p) for p in paths], 'names': names}
+
+    if 'urban' in linkers:
+        print("Preparing the urban/rural classification...")
+        store = geoutils.BoundaryStore(args.boundary_store)
+        store.add("OA_ru_classn_2011", URBAN_CLASSIFICATION_URLS,
+                  drop=["assign_chr", "assign_chg", "bound_chgi", "ruc11cd", "name", "label"])
+        settings['urban'] = {'store': os.path.abspath(args.boundary_store)}
+
+    directory.create(data, int(args.shards), settings, source=plan_source(args))
+    print(f"{args.shards} shard(s) written to {directory.path}.")
+
+
+def plan_source(args):
+    """
+    Fingerprint of the geocoded data and arguments of the plan step (see geoutils.ShardDirectory.matches).
+    :param args: arguments of the script.
+    :return: dict.
+    """
+    return {'geocodedata': geoutils.file_fingerprint(args.geocodedata),
+            'arguments': {key: str(getattr(args, key)) for key in PLAN_ARGUMENTS}}
+
+
+def work(sharddir, claim_timeout=3600):
+    """
+    Worker: link the shards of a shard directory until no shard is left.
+    :param sharddir: shared directory of the shards.
+    :param claim_timeout: number of seconds after which the shard of a worker that did not finish is taken over.
+    """
+    directory = geoutils.ShardDirectory(sharddir, claim_timeout=claim_timeout)
+    plan = directory.plan
+    shard = directory.claim()
+    while shard is not None:
+        print(f"Linking shard {shard} (process {os.getpid()})...")
+        with directory.heartbeat(shard):
+            linked = link_shard(directory.read(shard), plan['bboxes'][shard], plan['settings'])
+        directory.write(shard, linked)
+        print(f"Done shard {shard}.")
+        shard = directory.claim()
+
+
+def link_shard(data, bbox, settings):
+    """
+    Link the rows of a shard, reading only the data covering the bounding box of the shard.
+    :param data: DataFrame of the rows of the shard.
+    :param bbox: bounding box (xmin, ymin, xmax, ymax) of the co-ordinates of the shard.
+    :param settings: settings of the plan.
+    :return: DataFrame of the rows of the shard with the linked columns.
+    """
+    if len(data) == 0:
+        return data
+    table = geoutils.CoordinateTable(data)
+    coords = table.coords
+    functions = {'pollution': shard_pollution, 'census': shard_census, 'landcover': shard_land_cover,
+                 'urban': shard_urban_classification}
+    linked = [functions[linker](coords, bbox, settings[linker]) for linker in settings['linkers']]
+    return pd.concat([data.reset_index(drop=True)] + [table.broadcast(df) for df in linked], axis=1)
+
+
+def shard_pollution(coords, bbox, settings):
+    # pages of the memory-mapped cube outside the shard are never read
+    cube = scrapedefra.PollutionCube(settings['cube'])
+    out = pd.DataFrame(index=coords.index)
+    for year in coords['year'].unique():
+        rows = (coords['year'] == year).to_numpy()
+        for pollutant in settings['pollutants']:
+            pollution_year = settings['years'][f'{pollutant}|{year}']
+            out.loc[rows, pollutant] = cube.lookup(pollutant, pollution_year, coords['eastings'][rows],
+                                                   coords['northings'][rows])
+    return out[settings['pollutants']]
+
+
+def shard_census(coords, bbox, settings):
+    from get_census_data import get_census_table, pivot_census_tables
+
+    areas = geoutils.BoundaryStore(settings['store']).read(settings['name'], bbox=bbox)
+    area_ids = area_attributes(geoutils.AreaIndex(areas), coords)[settings['area_id']]
+    data_list = [get_census_table(script, ctable, settings['api_dir'], settings['cache'])
+                 for script, ctable in settings['tables']]
+    nomisdata = pivot_census_tables(data_list).reindex(area_ids)
+    return pd.concat([area_ids.reset_index(drop=True), nomisdata.reset_index(drop=True)], axis=1)
+
+
+def shard_land_cover(coords, bbox, settings):
+    # only the window (or blocks) of the rasters covering the co-ordinates is read
+    with geoutils.RasterStack(settings['paths'], settings['names']) as stack:
+        return stack.sample(coords['eastings'], coords['northings'])
+
+
+def shard_urban_classification(coords, bbox, settings):
+    areas = geoutils.BoundaryStore(settings['store']).read("OA_ru_classn_2011", bbox=bbox)
+    return area_attributes(geoutils.AreaIndex(areas), coords).drop('code', axis=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import numpy as np
+import pandas as pd
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import geoutils
+import scrapedefra
+from get_pollution_data import POLLUTANTS
+from get_land_cover_data import land_cover_rasters
+from link_exposures import URBAN_CLASSIFICATION_URLS, area_attributes
+
+
+def main():
+    # Initiate parser and add arguments
+    parser = argparse.ArgumentParser(
+        description="Local lookup service linking postcodes or co-ordinates with exposures. The geocoding index, "
+                    "pollution cube, boundaries and land cover rasters are loaded once and batch requests are "
+                    "answered from memory by concurrent threads. Endpoints: POST /geocode {\"postcodes\": [...]}, "
+                    "POST /link {\"postcodes\": [...] or \"eastings\": [...] and \"northings\": [...], \"year\": "
+                    "2008 or \"years\": [...]}, GET /health and GET /metrics."
+    )
+    parser.add_argument("--host", help="Address to listen on.", default="127.0.0.1")
+    parser.add_argument("--port", "-p", help="Port to listen on.", default=8750)
+    parser.add_argument("--onspd", help="ONS Postcode Directory csv file or index directory built from it (postcodes "
+                                        "are geocoded with https://postcodes.io/ if not given).")
+    parser.add_argument("--cube", help="Memory-mapped pollution cube (.npy), built from "
+                                       "https://uk-air.defra.gov.uk/data/pcm-data if it does not exist.")
+    parser.add_argument("--pollutants", help="List of pollutants separated by comma.",
+                        default='PM10,PM2.5,NO2,NOX,SO2,OZONE,BENZENE')
+    parser.add_argument("--cachedir", "-c", help="Directory for caching downloads from "
+                                                 "https://uk-air.defra.gov.uk between runs.")
+    parser.add_argument("--offline", help="Only use downloads found in the cache directory.",
+                        action="store_true")
+    parser.add_argument("--buffers", "-b", help="Radii in metres separated by comma of buffers for mean pollution "
+                                                "around each postcode.")
+    parser.add_argument("--rasterdir", help="Directory of the land cover map.")
+    parser.add_argument("--lcm_year", help="Year of the land cover map.", default=2007)
+    parser.add_argument("--boundary_store", help="Boundary store directory for the output area urban/rural "
+                                                 "classification.")
+    parser.add_argument("--workers", "-w", help="Number of threads for building the pollution cube.", default=4)
+
+    # Read arguments from command line
+    args = parser.parse_args()
+
+    pollutants = args.pollutants.split(',')
+    for p in pollutants:
+        if p not in POLLUTANTS:
+            sys.exit(f"Error: {p} is not a valid pollutant.\nValid pollutants: {', '.join(POLLUTANTS)}.")
+    if args.offline and args.cachedir is None:
+        sys.exit("Error: --offline requires a cache directory (--cachedir).")
+
+    print("Loading data...")
+    start = time.perf_counter()
+    try:
+        service = LookupService(
+            onspd=args.onspd, cube=args.cube, pollutants=pollutants,
+            cache=geoutils.DownloadCache(args.cachedir, offline=args.offline) if args.cachedir else None,
+            radii=[float(r) for r in args.buffers.split(',')] if args.buffers else None,
+            land_cover=land_cover_rasters(args.rasterdir, args.lcm_year) if args.rasterdir else None,
+            boundary_store=args.boundary_store, workers=int(args.workers)
+        )
+    except ValueError as e:
+        sys.exit(f"Error: {e}")
+    print(f"Done ({time.perf_counter() - start:.1f}s).")
+
+    httpd = serve(service, args.host, int(args.port))
+    print(f"Listening on http://{args.host}:{httpd.server_port} (Ctrl+C to stop).")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    httpd.server_close()
+    print("Stopped.")
+
+
+class LookupService:
+    """
+    Datasets loaded once for answering many small lookups: an ONSPD postcode index (or https://postcodes.io/),
+    a pollution cube (with summed-area tables for buffer means built on first use), the output area urban/rural
+    classification and the land cover rasters read into memory. All methods can be called from several threads.
+    """
+
+    def __init__(self, onspd=None, cube=None, pollutants=(), cache=None, radii=None, land_cover=None,
+                 boundary_store=None, workers=1):
+        """
+        :param onspd: ONSPD csv file or index directory (see geoutils.PostcodeIndex.from_onspd).
+        :param cube: filename of the pollution cube (built if it does not exist).
+        :param pollutants: pollutants of the cube.
+        :param cache: optional geoutils.DownloadCache used to build the cube.
+        :param radii: optional buffer radii in metres for mean pollution.
+        :param land_cover: optional tuple of lists of land cover raster filenames and column names.
+        :param boundary_store: optional geoutils.BoundaryStore directory for the urban/rural classification.
+        :param workers: number of threads for building the pollution cube.
+        """
+        self.postcode_index = geoutils.PostcodeIndex.from_onspd(onspd) if onspd else None
+        self.radii = radii or []
+        self.lock = threading.Lock()
+
+        self.cube = None
+        self.pollution_years = {}
+        if cube is not None:
+            if os.path.exists(cube) and os.path.exists(cube + '.json'):
+                self.cube = scrapedefra.PollutionCube(cube)
+            if self.cube is None or not set(pollutants) <= set(self.cube.pollutants):
+                sc = scrapedefra.ScrapeDefraPollution([2001], list(pollutants), cache=cache)
+                self.cube = sc.get_cube(cube, workers=workers)
+            # nearest year of pollution data of each pollutant
+            for pollutant in pollutants:
+                years = sorted(int(y) for p, y in self.cube.layers if p == pollutant)
+                if not years:
+                    raise ValueError(f"No data for {pollutant} in the pollution cube {cube}.")
+                self.pollution_years[pollutant] = (years, geoutils.NearestValueIndex(years))
+
+        self.land_cover = None
+        if land_cover is not None:
+            with geoutils.RasterStack(*land_cover) as stack:
+                self.land_cover = stack
+                self.bands = {}
+                # nodata pixels keep the nodata value (as geoutils.RasterStack.sample)
+                for name, ds in zip(stack.names, stack.datasets):
+                    self.bands[name] = ds.read(1).astype(np.float32)
+
+        self.urban = None
+        if boundary_store is not None:
+            store = geoutils.BoundaryStore(boundary_store)
+            store.add("OA_ru_classn_2011", URBAN_CLASSIFICATION_URLS,
+                      drop=["assign_chr", "assign_chg", "bound_chgi", "ruc11cd", "name", "label"])
+            self.urban = geoutils.AreaIndex(store.read("OA_ru_classn_2011"))
+
+    def datasets(self):
+        """
+        Names of the datasets loaded.
+        """
+        return [name for name, value in [('postcode_index', self.postcode_index), ('pollution', self.cube),
+                                         ('land_cover', self.land_cover), ('urban', self.urban)]
+                if value is not None]
+
+    def geocode(self, postcodes):
+        """
+        Geocode postcodes (co-ordinates in the British National Grid, see geoutils.normalise_crs).
+        :param postcodes: list of postcodes.
+        :return: DataFrame with columns: postcode, eastings, northings, country and crs (error messages as in
+        geoutils.geocode_uk).
+        """
+        if self.postcode_index is not None:
+            data = self.postcode_index.lookup(postcodes)
+        else:
+            data = pd.DataFrame(geoutils.geocode_uk_unique(list(postcodes), geoutils.geocode_uk_batch),
+                                columns=['postcode', 'eastings', 'northings', 'country'])
+        return geoutils.normalise_crs(data)
+
+    def link(self, coords):
+        """
+        Link co-ordinates with the exposures loaded.
+        :param coords: DataFrame with eastings, northings and year columns (co-ordinates that are not numbers,
+        e.g. geocoding errors, give missing values).
+        :return: DataFrame with a row per co-ordinate.
+        """
+        eastings = pd.to_numeric(coords['eastings'], errors='coerce')
+        northings = pd.to_numeric(coords['northings'], errors='coerce')
+        out = {}
+        if self.cube is not None:
+            years = pd.to_numeric(coords['year'], errors='coerce').to_numpy(float)
+            for pollutant, (available, index) in self.pollution_years.items():
+                values = np.full((len(coords), 1 + len(self.radii)), np.nan)
+                distinct = pd.unique(years[~np.isnan(years)])
+                for year, nearest in zip(distinct, index.nearest_idx(distinct)):
+                    rows = years == year
+                    pollution_year = available[nearest[0]]
+                    values[rows, 0] = self.cube.lookup(pollutant, pollution_year, eastings[rows], northings[rows])
+                    if self.radii:
+                        with self.lock:
+                            table = self.cube.summed_area_table(pollutant, pollution_year)
+                        for i, radius in enumerate(self.radii, start=1):
+                            values[rows, i] = table.buffer_mean(eastings[rows], northings[rows], radius)
+                out[pollutant] = values[:, 0]
+                for i, radius in enumerate(self.radii, start=1):
+                    out[f'{pollutant}_{radius:g}m'] = values[:, i]
+        if self.land_cover is not None:
+            rows, cols, inside = self.land_cover.index(eastings, northings)
+            for name, band in self.bands.items():
+                out[name] = np.where(inside, band[rows, cols], np.nan)
+        linked = pd.DataFrame(out, index=coords.index)
+        if self.urban is not None:
+            valid = coords[eastings.notna() & northings.notna()]
+            attributes = area_attributes(self.urban, valid.astype({'eastings': float, 'northings': float}))
+            linked = linked.join(attributes.drop('code', axis=1).set_index(valid.index))
+        return linked
+
+    def lookup(self, request):
+        """
+        Answer a request of the /geocode or /link endpoint.
+        :param request: dict with postcodes (list), or eastings and northings (lists), and year or years.
+        :return: DataFrame of the response.
+        """
+        if 'postcodes' in request:
+            data = self.geocode(request['postcodes'])
+        elif 'eastings' in request and 'northings' in request:
+            data = pd.DataFrame({'eastings': request['eastings'], 'northings': request['northings']})
+        else:
+            raise ValueError("Request must contain postcodes, or eastings and northings.")
+        if 'years' in request:
+            data.insert(0, 'year', request['years'])
+        elif 'year' in request:
+            data.insert(0, 'year', request['year'])
+        else:
+            data.insert(0, 'year', np.nan)
+        return pd.concat([data, self.link(data)], axis=1)
+
+
+def serve(service, host='127.0.0.1', port=8750):
+    """
+    HTTP server of a LookupService (each request is handled in its own thread):
+    - POST /geocode with {"postcodes": [...]},
+    - POST /link with {"postcodes": [...]} or {"eastings": [...], "northings": [...]} and "year" (one year for all
+      rows) or "years" (a year per row),
+    - GET /health lists the datasets loaded and GET /metrics returns geoutils.METRICS.summary().
+    Responses are json lists of records (missing values as null) or {"error": message} with status 400.
+    :param service: LookupService.
+    :param host: address to listen on.
+    :param port: port to listen on (0 for any free port).
+    :return: http.server.ThreadingHTTPServer (call serve_forever to start).
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            if self.path == '/health':
+                self.send(200, json.dumps({'status': 'ok', 'datasets': service.datasets()}))
+            elif self.path == '/metrics':
+                self.send(200, json.dumps(geoutils.METRICS.summary()))
+            else:
+                self.send(404, json.dumps({'error': 'Not found'}))
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            if self.path not in ('/geocode', '/link'):
+                self.send(404, json.dumps({'error': 'Not found'}))
+                return
+            try:
+                request = json.loads(body)
+                if self.path == '/geocode':
+                    response = service.geocode(request['postcodes'])
+                else:
+                    response = service.lookup(request)
+            except (ValueError, KeyError, TypeError) as e:
+                self.send(400, json.dumps({'error': f"{type(e).__name__}: {e}"}))
+                return
+            geoutils.METRICS.add('lookup_requests')
+            geoutils.METRICS.add('lookup_rows', len(response))
+            self.send(200, response.to_json(orient='records'))
+
+        def send(self, status, content):
+            content = content.encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+    httpd = ThreadingHTTPServer((host, port), Handler)
+    httpd.daemon_threads = True
+    return httpd
+
+
+if __name__ == "__main__":
+    main()
@@ -4,8 +4,12 @@ import multiprocessing as mp
 import geoutils
 import re
 import sys
+import requests
 from tabulate import tabulate
 
+# requests.Session per worker process (opened on first use by geocode_batch)
+_session = None
+
 def main():
     # Initiate parser and add arguments
     parser = argparse.ArgumentParser(
@@ -18,46 +22,200 @@ def main():
     )
     parser.add_argument("--inputfile", "-f", help="Input file with participant IDs and postcodes.")
     parser.add_argument("--idcol", "-i", help="Column name for participant IDs.")
-    parser.add_argument("--outputfile", "-o", help="Output filename.")
+    parser.add_argument("--outputfile", "-o", help="Output filename. Parquet (.parquet) and feather (.feather) "
+                                                   "files have numeric co-ordinates and a status column "
+                                                   "(0: OK, 1: Invalid postcode, 2: Postcode not found, "
+                                                   "3: other error).")
     parser.add_argument("--threads", "-t", help="Number of cores for multithreaded functions.", default=1)
+    parser.add_argument("--batch-size", "-b", help="Number of postcodes sent per bulk request to postcodes.io "
+                                                   "(max 100).", default=100)
+    parser.add_argument("--engine", "-e", help="Geocoding engine: 'api' (https://postcodes.io/ with a pool of "
+                                               "--threads processes), 'async' (https://postcodes.io/ from one "
+                                               "process with asyncio) or 'offline' (local ONS Postcode "
+                                               "Directory, see --onspd).",
+                        choices=['api', 'async', 'offline'], default='api')
+    parser.add_argument("--onspd", help="ONS Postcode Directory csv file or index directory built from it "
+                                        "(used by the 'offline' engine).")
+    parser.add_argument("--max-in-flight", help="Maximum number of concurrent requests (used by the 'async' "
+                                                "engine).", default=10)
+    parser.add_argument("--rate", help="Maximum number of requests per second (used by the 'async' engine).",
+                        default=10)
+    parser.add_argument("--cache", "-c", help="SQLite file used as a persistent geocode cache shared "
+                                              "across runs.")
+    parser.add_argument("--negative-ttl", help="Number of days before cached 'Invalid postcode' and "
+                                               "'Postcode not found' results are looked up again.", default=30)
+    parser.add_argument("--chunksize", help="Number of participants (input rows) read, geocoded and written at a "
+                                            "time. The progress is saved to outputfile.manifest.json after each "
+                                            "chunk and a restarted run resumes from the last completed chunk. "
+                                            "By default the whole inputfile is processed at once.")
+
+    parser.add_argument("--incremental", help="Only geocode rows (ID, year and postcode) that are new or changed "
+                                              "since the previous run and merge them into the existing "
+                                              "outputfile (row fingerprints are kept in "
+                                              "outputfile.fingerprints.npy).", action="store_true")
+    parser.add_argument("--crs", help="Projected co-ordinate reference system, with axes in metres, of the output "
+                                      "co-ordinates (recorded in a crs column). Northern Irish postcodes, geocoded "
+                                      "in the Irish Grid, are transformed into it.", default=geoutils.BNG)
+    parser.add_argument("--metrics", help="JSON file for the run metrics (time, rows per second, HTTP requests, "
+                                          "bytes, retries and cache hit ratios of each stage and peak memory).")
 
     # Read arguments from command line
     args = parser.parse_args()
+    try:
+        geoutils.check_metre_crs(args.crs)
+    except ValueError as e:
+        sys.exit(f"Error: {e}")
 
-    # Read data, check file format and drop NAs
-    print("Reading and formatting data...")
-    data = read_and_format_data(
-        args.inputfile, args.idcol
-    ).dropna()
-    print("Done.")
+    # Clean and geocode postcodes
+    if args.engine == 'offline':
+        if args.onspd is None:
+            sys.exit("Error: the 'offline' engine requires an ONS Postcode Directory (--onspd).")
+        print(f"Geocoding postcodes with the ONS Postcode Directory {args.onspd}...")
+        geocoder = geoutils.PostcodeIndex.from_onspd(args.onspd).geocode
+    elif args.engine == 'async':
+        print(f"Geocoding postcodes with at most {args.max_in_flight} concurrent request(s) "
+              f"and {args.rate} request(s) per second...")
+        geocoder = geoutils.AsyncGeocoder(
+            batch_size=args.batch_size, max_in_flight=args.max_in_flight, rate=float(args.rate)
+        ).geocode
+    else:
+        print("Number of cores available: ", mp.cpu_count())
+        print(f"Geocoding postcodes with {args.threads} core(s)...")
 
+        def geocoder(postcodes):
+            batch_size = int(args.batch_size)
+            pool = mp.Pool(int(args.threads), initializer=init_geocode_worker)
+            dt = []
+            for rows, counters in pool.imap(
+                geocode_batch,
+                [postcodes[i:i + batch_size] for i in range(0, len(postcodes), batch_size)]
+            ):
+                dt.extend(rows)
+                for name, n in counters.items():
+                    geoutils.METRICS.add(name, n)
+                geoutils.METRICS.progress('geocode', len(dt), len(postcodes))
+            pool.close()
+            return dt
 
-    # Clean and geocode postcodes
-    print("Number of cores available: ", mp.cpu_count())
-    print(f"Geocoding postcodes with {args.threads} core(s)...")
-    pool = mp.Pool(int(args.threads))
-    dt = pool.map(
-        apply_geo_fun,
-        [
-            (pid, year, postcode) for pid, orig_col, postcode, year in data.itertuples(index=False)
-        ]
-    )
-    pool.close()
+    # Each distinct postcode is geocoded once (or read from the cache) and joined back
+    cache = None
+    if args.cache is not None:
+        cache = geoutils.GeocodeCache(args.cache, negative_ttl=float(args.negative_ttl) * 24 * 3600)
 
-    data = pd.DataFrame(dt)
-    data.columns = [args.idcol, "year", "postcode", "eastings", "northings", "country"]
-    print("Done.")
+    if args.chunksize is None:
+        # Read data, check file format and drop NAs
+        print("Reading and formatting data...")
+        with geoutils.METRICS.stage('read') as stage:
+            data = read_and_format_data(
+                args.inputfile, args.idcol
+            ).dropna()
+            stage['rows'] = len(data)
+        print("Done.")
+
+        # Only rows new or changed since the previous run are geocoded in incremental mode
+        fingerprints = geoutils.row_fingerprints(data, [args.idcol, "year", "value"], version=args.crs)
+        output = geoutils.IncrementalOutput(args.outputfile, fingerprints) if args.incremental else None
+        if output is not None:
+            print(f"{int(output.kept.sum())} row(s) kept from {args.outputfile}, "
+                  f"{int(output.changed.sum())} new or changed row(s) to geocode.")
+            data, fingerprints = data[output.changed], fingerprints[output.changed]
+
+        with geoutils.METRICS.stage('geocode', rows=len(data)):
+            data = geocode_data(data, args.idcol, geocoder, cache, crs=args.crs)
+        print("Done.")
+
+        # Write (typed columns with a status column for parquet and feather files)
+        with geoutils.METRICS.stage('write', rows=len(data)):
+            if geoutils.table_format(args.outputfile) != 'csv':
+                data = geoutils.typed_geocodes(data)
+            if output is not None:
+                data, fingerprints = output.merge(data, fingerprints)
+                output.write(data, fingerprints)
+            else:
+                geoutils.write_table(data, args.outputfile)
+        ct = pd.crosstab(data["year"], data["country"], margins=True)
+    elif args.incremental:
+        sys.exit("Error: --incremental cannot be used with --chunksize.")
+    elif geoutils.table_format(args.outputfile) != 'csv':
+        sys.exit("Error: --chunksize requires a csv outputfile.")
+    else:
+        with geoutils.METRICS.stage('geocode_in_chunks') as stage:
+            ct = geocode_in_chunks(args.inputfile, args.idcol, args.outputfile, int(args.chunksize), geocoder,
+                                   cache, crs=args.crs)
+            stage['rows'] = int(ct.loc['All', 'All'])
 
     # Print sample size of participants in countries at different time points
     print("\nFrequency table for country of residence:\n")
-    ct = pd.crosstab(data["year"], data["country"], margins=True)
     print(tabulate(
         ct, ct.columns.values.tolist(), tablefmt='orgtbl'
     ))
     print("\n")
 
-    # Write
-    data.to_csv(args.outputfile, index=False)
+    if cache is not None:
+        print(f"Geocode cache {args.cache}: {cache.hits} hit(s), {cache.misses} miss(es).")
+        cache.close()
+
+    if args.metrics is not None:
+        geoutils.METRICS.write(args.metrics)
+        print(f"Run metrics written to {args.metrics}.")
+
+
+def geocode_data(data, idcol, geocoder, cache=None, crs=geoutils.BNG):
+    """
+    Geocode the postcodes of formatted data (see read_and_format_data) and transform the co-ordinates into one
+    co-ordinate reference system (see geoutils.normalise_crs).
+    :param data: pd.DataFrame with ID, year and postcode (value) column.
+    :param idcol: name of the column containing the participant ID's.
+    :param geocoder: function geocoding a list of distinct postcodes (see geoutils.geocode_uk_unique).
+    :param cache: optional geoutils.GeocodeCache.
+    :param crs: co-ordinate reference system of the output co-ordinates.
+    :return: pd.DataFrame with ID, year, postcode, eastings, northings, country and crs column.
+    """
+    dt = geoutils.geocode_uk_unique(data["value"].tolist(), geocoder, cache)
+    data = pd.concat([
+        data[[idcol, "year"]].reset_index(drop=True),
+        pd.DataFrame(dt, columns=["postcode", "eastings", "northings", "country"])
+    ], axis=1)
+    data.columns = [idcol, "year", "postcode", "eastings", "northings", "country"]
+    return geoutils.normalise_crs(data, crs)
+
+
+def geocode_in_chunks(inputfile, idcol, outputfile, chunksize, geocoder, cache=None, crs=geoutils.BNG):
+    """
+    Read, geocode and write the data chunk by chunk, resuming from the checkpoint manifest of the outputfile if a
+    previous run with the same inputfile and chunksize was interrupted. Rows are written chunk by chunk (all
+    postcode columns of a chunk of participants, then the next chunk).
+    :param inputfile: csv file with participant ID column and subsequent columns containing postcodes.
+    :param idcol: name of the column containing the participant ID's.
+    :param outputfile: output csv file.
+    :param chunksize: number of input rows per chunk.
+    :param geocoder: function geocoding a list of distinct postcodes (see geoutils.geocode_uk_unique).
+    :param cache: optional geoutils.GeocodeCache.
+    :param crs: co-ordinate reference system of the output co-ordinates.
+    :return: frequency table of country of residence by year.
+    """
+    checkpoint = geoutils.ChunkCheckpoint(outputfile, {'input': geoutils.file_fingerprint(inputfile),
+                                                       'idcol': idcol, 'chunksize': chunksize, 'crs': crs})
+    counts = checkpoint.state or []
+    if checkpoint.complete:
+        print(f"{outputfile} is complete ({checkpoint.chunks} chunk(s)).")
+    else:
+        if checkpoint.chunks:
+            print(f"Resuming after {checkpoint.chunks} completed chunk(s) of {outputfile}.")
+        for number, data in read_and_format_chunks(inputfile, idcol, chunksize, skip=checkpoint.chunks):
+            data = geocode_data(data.dropna(), idcol, geocoder, cache, crs)
+            counts = pd.concat([pd.DataFrame(counts, columns=["year", "country", "n"]),
+                                data.groupby(["year", "country"]).size().rename("n").reset_index()])
+            counts = [[year, country, int(n)] for (year, country), n
+                      in counts.groupby(["year", "country"])["n"].sum().items()]
+            checkpoint.append(data, state=counts)
+            print(f"Chunk {number + 1} ({len(data)} postcodes) written.")
+        checkpoint.finish()
+        print("Done.")
+
+    counts = pd.DataFrame(counts, columns=["year", "country", "n"])
+    return pd.crosstab(counts["year"], counts["country"], values=counts["n"], aggfunc="sum",
+                       margins=True).fillna(0).astype(int)
 
 
 def read_and_format_data(inputfile, idcol):
@@ -73,7 +231,33 @@ def read_and_format_data(inputfile, idcol):
     # Read in data with pandas
     data = pd.read_csv(inputfile)
 
-    # Check that the columns containing postcodes are correctly formatted
+    # Change DataFrame to long format and create year column
+    return melt_postcodes(data, idcol, postcode_years(data, idcol, inputfile))
+
+
+def read_and_format_chunks(inputfile, idcol, chunksize, skip=0):
+    """
+    Read and format data on the participants postcodes in chunks of rows (see read_and_format_data).
+    :param inputfile: csv file with participant ID column and subsequent columns containing postcodes.
+    :param idcol: name of the column containing the participant ID's.
+    :param chunksize: number of rows per chunk.
+    :param skip: number of chunks skipped (without parsing) at the start of the file.
+    :return: generator of tuples of chunk number and pd.DataFrame with ID, year and postcode column.
+    """
+    yr_dict = postcode_years(pd.read_csv(inputfile, nrows=5), idcol, inputfile)
+    chunks = pd.read_csv(inputfile, chunksize=chunksize, skiprows=range(1, skip * chunksize + 1))
+    for number, data in enumerate(chunks, start=skip):
+        yield number, melt_postcodes(data, idcol, yr_dict)
+
+
+def postcode_years(data, idcol, inputfile):
+    """
+    Check that the columns containing postcodes are correctly formatted.
+    :param data: pd.DataFrame read from the inputfile.
+    :param idcol: name of the column containing the participant ID's.
+    :param inputfile: name of the inputfile (for error messages).
+    :return: dict of postcode column name to year.
+    """
     if idcol not in data.columns:
         sys.exit(print(f"Error: '{idcol}', column not found in {inputfile}."
                        f"\nCheck the column names of your inputfile:\n {data.head()}"))
@@ -87,24 +271,43 @@ def read_and_format_data(inputfile, idcol):
         print(f"Columns {','.join(postcode_cols_list[1:])} and {postcode_cols_list[0]}, "
               f"assumed to contain participant postcodes from the years {','.join(years[1:])} "
               f"and {years[0]}, respectively.")
+    return {key: var for key, var in zip(postcode_cols_list, years)}
 
-    # Change DataFrame to long format and create year column
+
+def melt_postcodes(data, idcol, yr_dict):
+    """
+    Change DataFrame to long format and create year column.
+    :param data: pd.DataFrame with participant ID column and subsequent columns containing postcodes.
+    :param idcol: name of the column containing the participant ID's.
+    :param yr_dict: dict of postcode column name to year.
+    :return: pd.DataFrame with ID, year and postcode column.
+    """
     data = data.melt(id_vars=idcol)
-    yr_dict = {key: var for key, var in zip(postcode_cols_list, years)}
     data['year'] = data['variable'].map(yr_dict)
-
-    # Return pd.DataFrame
     return data
 
-def apply_geo_fun(tup):
+
+def init_geocode_worker():
     """
-    Function to add ID and year variables to list returned from geocode_uk function.
-    :param tup: tuple of (pid, year, postcode).
-    :return: list of ID, year and data from geocode_uk function.
+    Initialise a geocoding worker process: progress is only reported by the main process.
     """
-    return list(tup[:2]) + geoutils.geocode_uk(tup[2])
+    geoutils.METRICS.progress_interval = None
 
 
+def geocode_batch(postcodes):
+    """
+    Geocode a batch of postcodes using the postcodes.io bulk lookup. Each worker process keeps one
+    keep-alive session open for all of its batches.
+    :param postcodes: list of postcodes.
+    :return: tuple of list of lists of data from geocode_uk_batch function and dict of the metrics counters
+    incremented by the worker for the batch.
+    """
+    global _session
+    if _session is None:
+        _session = requests.Session()
+    before = geoutils.METRICS.snapshot()
+    rows = geoutils.geocode_uk_batch(postcodes, batch_size=len(postcodes), session=_session)
+    return rows, geoutils.METRICS.increments(before)
 
 
 if __name__ == "__main__":
@@ -1 +1,3 @@
 from .scrape_defra_website import *
+from .grid_index import *
+from .pollution_cube import *
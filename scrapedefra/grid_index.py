@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+
+
+class UKGridIndex:
+    """
+    Dense lookup table over the 1x1km PCM reference grid (columns: ukgridcode, x, y with x and y the
+    co-ordinates of the centre of each km square). Each grid square is stored at [x // 1000, y // 1000] so the
+    nearest grid code of a whole column of co-ordinates is found with array indexing instead of a scan of the
+    reference grid.
+    """
+
+    def __init__(self, reference, size=1000, tolerance=1000):
+        self.size = size
+        self.tolerance = tolerance
+        self.codes = reference['ukgridcode'].astype(str).to_numpy(dtype=object)
+        self.x = reference['x'].to_numpy(dtype=float)
+        self.y = reference['y'].to_numpy(dtype=float)
+
+        col = np.floor(self.x / size).astype(np.int64)
+        row = np.floor(self.y / size).astype(np.int64)
+        self.col0, self.row0 = col.min(), row.min()
+        shape = (col.max() - self.col0 + 1, row.max() - self.row0 + 1)
+
+        # Position in the reference grid of each km square (-1 if missing), first occurrence wins
+        self.grid = np.full(shape, -1, dtype=np.int32)
+        order = np.arange(len(reference))[::-1]
+        self.grid[col[order] - self.col0, row[order] - self.row0] = order
+
+        # x co-ordinate of each column of the grid (NaN if the column has no km squares)
+        self.col_x = np.full(shape[0], np.nan)
+        self.col_x[col - self.col0] = self.x
+
+    def nearest_idx(self, eastings, northings):
+        """
+        Position in the reference grid of the nearest km square: the nearest column (x) of the grid is selected
+        first and then the nearest km square (y) within that column. Positions further than the tolerance from
+        the co-ordinates are returned as -1.
+        :param eastings: array of east co-ordinates in metres.
+        :param northings: array of north co-ordinates in metres.
+        :return: numpy array of positions in the reference grid.
+        """
+        eastings = pd.to_numeric(pd.Series(np.asarray(eastings, dtype=object)), errors='coerce').to_numpy(float)
+        northings = pd.to_numeric(pd.Series(np.asarray(northings, dtype=object)), errors='coerce').to_numpy(float)
+        ok = ~(np.isnan(eastings) | np.isnan(northings))
+        idx = np.full(len(eastings), -1, dtype=np.int64)
+        if not ok.any():
+            return idx
+        e, n = eastings[ok], northings[ok]
+
+        # Columns and rows within the tolerance of the co-ordinates
+        reach = int(np.ceil(self.tolerance / self.size))
+        offsets = np.arange(-reach, reach + 1)
+        cols = np.floor(e / self.size).astype(np.int64)[:, None] - self.col0 + offsets
+        rows = np.floor(n / self.size).astype(np.int64)[:, None] - self.row0 + offsets
+        cols_in = (cols >= 0) & (cols < self.grid.shape[0])
+        rows_in = (rows >= 0) & (rows < self.grid.shape[1])
+        cols, rows = np.where(cols_in, cols, 0), np.where(rows_in, rows, 0)
+
+        # Nearest column(s) of the grid
+        dx = np.abs(self.col_x[cols] - e[:, None])
+        dx[~cols_in | np.isnan(dx)] = np.inf
+        dx_min = dx.min(axis=1)
+        nearest_col = (dx == dx_min[:, None]) & (dx_min[:, None] <= self.tolerance)
+
+        # Nearest km square within the nearest column(s), ties resolved by order in the reference grid
+        pos = self.grid[cols[:, :, None], rows[:, None, :]]
+        valid = nearest_col[:, :, None] & rows_in[:, None, :] & (pos >= 0)
+        pos = np.where(valid, pos, 0).reshape(len(e), -1)
+        valid = valid.reshape(len(e), -1)
+        dy = np.where(valid, np.abs(self.y[pos] - n[:, None]), np.inf)
+        key = np.where(dy == dy.min(axis=1)[:, None], pos, np.iinfo(np.int32).max)
+        best = pos[np.arange(len(e)), key.argmin(axis=1)]
+        best[~(dy.min(axis=1) <= self.tolerance)] = -1
+
+        idx[ok] = best
+        return idx
+
+    def nearest_codes(self, eastings, northings):
+        """
+        Grid codes of the nearest km squares (NaN beyond the tolerance or for invalid co-ordinates).
+        :param eastings: array of east co-ordinates in metres.
+        :param northings: array of north co-ordinates in metres.
+        :return: numpy array of grid codes (str).
+        """
+        idx = self.nearest_idx(eastings, northings)
+        codes = self.codes[np.where(idx >= 0, idx, 0)]
+        codes[idx < 0] = np.nan
+        return codes
@@ -0,0 +1,183 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from affine import Affine
+from geoutils import request_url_to_dataframe, SummedAreaTable
+from .grid_index import UKGridIndex
+
+# Extent of the British National Grid in km squares (east, north)
+BNG_EXTENT_KM = (700, 1300)
+
+
+class PollutionCube:
+    """
+    DEFRA PCM pollution data for several pollutants and years stored in one memory-mapped float32 array indexed
+    [pollutant, year, north_km, east_km] (km squares of the British National Grid), with a json sidecar holding
+    the metric, header label, comments (units) and download link of each layer and a mask of the km squares of
+    the PCM grid (path + '.squares.npy'). Processes on the same machine opening the same cube share it through
+    the page cache. The json sidecar is written last, so a cube is only opened once a build has completed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path + '.json') as f:
+            self.meta = json.load(f)
+        self.pollutants = self.meta['pollutants']
+        self.years = self.meta['years']
+        self.size = self.meta['size']
+        self.layers = {(layer['pollutant'], layer['year']): layer for layer in self.meta['layers']}
+        self.cube = np.load(path, mmap_mode='r')
+        self.tables = {}
+        if os.path.exists(path + '.squares.npy'):
+            self.squares = np.load(path + '.squares.npy')
+        else:
+            # cube built without the mask: squares with data in any layer
+            self.squares = ~np.isnan(self.cube).all(axis=(0, 1))
+        self.grid_index = None
+
+    @classmethod
+    def build(cls, tables, path, cache=None, workers=1, size=1000):
+        """
+        Build the cube from the tables scraped by ScrapeDefraPollution.get_tables.
+        :param tables: pandas DataFrame with columns: pollutant, year_pollution_data_collected, metric,
+        header_label, comments, download_link (only 'Annual mean' and 'DGT120' metrics are used).
+        :param path: filename of the cube (.npy), the metadata is written to path + '.json'.
+        :param cache: optional geoutils.DownloadCache.
+        :param workers: number of threads for downloading and parsing the pollution data.
+        :param size: size of the grid squares in metres.
+        :return: PollutionCube.
+        """
+        tables = tables[(tables['metric'] == 'Annual mean') | (tables['metric'] == 'DGT120')]
+        tables = tables.drop_duplicates(['pollutant', 'year_pollution_data_collected'])
+        pollutants = sorted(tables['pollutant'].unique())
+        years = sorted(tables['year_pollution_data_collected'].astype(str).unique())
+        shape = (len(pollutants), len(years), BNG_EXTENT_KM[1] * 1000 // size, BNG_EXTENT_KM[0] * 1000 // size)
+
+        cube = np.lib.format.open_memmap(path + '.tmp', mode='w+', dtype=np.float32, shape=shape)
+        cube[:] = np.nan
+        squares = np.zeros(shape[2:], dtype=bool)
+
+        def fill(row):
+            df = request_url_to_dataframe(row.download_link, header=5, cache=cache)
+            x = np.floor(df['x'].to_numpy(dtype=float) / size).astype(np.int64)
+            y = np.floor(df['y'].to_numpy(dtype=float) / size).astype(np.int64)
+            values = pd.to_numeric(df.iloc[:, 3], errors='coerce').to_numpy(dtype=np.float32)
+            inside = (x >= 0) & (x < shape[3]) & (y >= 0) & (y < shape[2])
+            cube[pollutants.index(row.pollutant), years.index(str(row.year_pollution_data_collected)),
+                 y[inside], x[inside]] = values[inside]
+            squares[y[inside], x[inside]] = True
+
+        with ThreadPoolExecutor(max_workers=int(workers)) as executor:
+            list(executor.map(fill, tables.itertuples(index=False)))
+        cube.flush()
+        del cube
+
+        meta = {
+            'pollutants': pollutants,
+            'years': years,
+            'size': size,
+            'layers': [{
+                'pollutant': row.pollutant,
+                'year': str(row.year_pollution_data_collected),
+                'metric': row.metric,
+                'header_label': row.header_label,
+                'comments': None if pd.isna(row.comments) else row.comments,
+                'download_link': row.download_link
+            } for row in tables.itertuples(index=False)]
+        }
+        with open(path + '.json.tmp', 'w') as f:
+            json.dump(meta, f, indent=1)
+        np.save(path + '.squares.tmp.npy', squares)
+        # the previous sidecar is removed first and the new one moved in last, so an interrupted build never
+        # leaves a cube with the sidecar of another build
+        if os.path.exists(path + '.json'):
+            os.remove(path + '.json')
+        os.replace(path + '.tmp', path)
+        os.replace(path + '.squares.tmp.npy', path + '.squares.npy')
+        os.replace(path + '.json.tmp', path + '.json')
+        return cls(path)
+
+    def has_layers(self, pollution_data):
+        """
+        Check that the cube contains the pollution data needed, built from the same download links and metrics
+        (layers of files replaced or revised under another link on the pcm-data page are out of date).
+        :param pollution_data: DataFrame from ScrapeDefraPollution.info.
+        :return: bool.
+        """
+        # first table of each pollutant and year, as in build
+        needed = pollution_data[(pollution_data['metric'] == 'Annual mean') | (pollution_data['metric'] == 'DGT120')]
+        needed = needed.drop_duplicates(['pollutant', 'year_pollution_data_collected'])
+        for row in needed.itertuples(index=False):
+            layer = self.layers.get((row.pollutant, str(row.year_pollution_data_collected)))
+            if layer is None or layer['download_link'] != row.download_link or layer['metric'] != row.metric:
+                return False
+        return True
+
+    def layer(self, pollutant, year):
+        if (pollutant, str(year)) not in self.layers:
+            raise KeyError(f"No {pollutant} data for {year} in the pollution cube {self.path}.")
+        return self.cube[self.pollutants.index(pollutant), self.years.index(str(year))]
+
+    def summed_area_table(self, pollutant, year):
+        """
+        Summed-area table of a layer, built on first use and kept for later calls.
+        :param pollutant: pollutant (e.g. 'PM10').
+        :param year: year of pollution data collection.
+        :return: geoutils.SummedAreaTable.
+        """
+        key = (pollutant, str(year))
+        if key not in self.tables:
+            self.tables[key] = SummedAreaTable(self.layer(pollutant, year), Affine(self.size, 0, 0, 0, self.size, 0))
+        return self.tables[key]
+
+    def buffer_means(self, pollutant, year, eastings, northings, radii, shape='circle', strips=8):
+        """
+        Mean pollution of the km squares within buffers of several radii around co-ordinates, see
+        geoutils.SummedAreaTable.buffer_mean.
+        :param pollutant: pollutant (e.g. 'PM10').
+        :param year: year of pollution data collection.
+        :param eastings: array of east co-ordinates in metres.
+        :param northings: array of north co-ordinates in metres.
+        :param radii: radii in metres.
+        :param shape: 'circle' or 'square'.
+        :param strips: maximum number of rectangles per half circle.
+        :return: pandas DataFrame with a column per radius.
+        """
+        return self.summed_area_table(pollutant, year).buffer_means(eastings, northings, radii, shape, strips)
+
+    def nearest_squares(self, eastings, northings):
+        """
+        Nearest km squares of the PCM grid, as found by UKGridIndex.nearest_idx (nearest column of centres, then
+        nearest centre within it, at most 1000 m away), so co-ordinates near the coast or the edge of the grid
+        take the neighbouring square as with the csv files.
+        :param eastings: array of east co-ordinates in metres.
+        :param northings: array of north co-ordinates in metres.
+        :return: tuple of arrays of rows and columns of the squares and whether a square was found.
+        """
+        if self.grid_index is None:
+            rows, cols = np.nonzero(self.squares)
+            self.square_rows, self.square_cols = rows, cols
+            self.grid_index = UKGridIndex(pd.DataFrame({
+                'ukgridcode': np.arange(len(rows)), 'x': cols * self.size + self.size / 2,
+                'y': rows * self.size + self.size / 2}), size=self.size)
+        idx = self.grid_index.nearest_idx(eastings, northings)
+        found = idx >= 0
+        idx = np.where(found, idx, 0)
+        return self.square_rows[idx], self.square_cols[idx], found
+
+    def lookup(self, pollutant, year, eastings, northings):
+        """
+        Pollution data of the nearest km squares of the co-ordinates (see nearest_squares).
+        :param pollutant: pollutant (e.g. 'PM10').
+        :param year: year of pollution data collection.
+        :param eastings: array of east co-ordinates in metres.
+        :param northings: array of north co-ordinates in metres.
+        :return: numpy array of pollution data (NaN without a square within 1000 m or for invalid co-ordinates).
+        """
+        layer = self.layer(pollutant, year)
+        rows, cols, found = self.nearest_squares(eastings, northings)
+        values = np.full(len(rows), np.nan, dtype=np.float32)
+        values[found] = layer[rows[found], cols[found]]
+        return values
@@ -1,27 +1,51 @@
+import os
 import pandas as pd
 import requests
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from bs4 import BeautifulSoup
-from geoutils import find_nearest_idx
+from geoutils import NearestValueIndex
 from geoutils import request_url_to_dataframe
+from geoutils import USER_AGENT
+from geoutils import METRICS
+from .grid_index import UKGridIndex
+from .pollution_cube import PollutionCube
+
+# Site of the pcm-data page and the pollution csv files
+DEFRA_URL = 'https://uk-air.defra.gov.uk'
+
 
 class ScrapeDefraPollution:
 
-    def __init__(self, years, pollutants):
-        url = 'https://uk-air.defra.gov.uk/data/pcm-data'
-        self.agent = {
-            "User-Agent":
-                'Mozilla/5.0 (Windows NT 6.3; WOW64) '
-                'AppleWebKit/537.36 (KHTML, like Gecko) '
-                'Chrome/59.0.3071.115 Safari/537.36'
-        }
-        self.request = requests.get(url, headers=self.agent).content
+    def __init__(self, years, pollutants, cache=None, base_url=DEFRA_URL):
+        """
+        :param years: years of postcode data collection.
+        :param pollutants: list of pollutants.
+        :param cache: optional geoutils.DownloadCache for the pcm-data page and the pollution csv files.
+        :param base_url: site of the pcm-data page (e.g. a local stand-in server for benchmarks).
+        """
+        self.base_url = base_url
+        url = base_url + '/data/pcm-data'
+        self.agent = USER_AGENT
+        self.cache = cache
+        if cache is None:
+            self.request = requests.get(url, headers=self.agent).content
+            METRICS.add('http_requests')
+            METRICS.add('http_bytes', len(self.request))
+        else:
+            self.request = cache.get_content(url)
+            if self.request is None:
+                raise FileNotFoundError(f"{url} not available from the download cache {cache.cache_dir}"
+                                        + (" (offline mode)." if cache.offline else "."))
         self.soup = BeautifulSoup(self.request, features="lxml")
         self.pollutants = pollutants
         self.years = years
         self.pollution_data = self.info()
-        self.reference = request_url_to_dataframe(
-            'https://uk-air.defra.gov.uk/datastore/pcm/mappm102001.csv', header=5).iloc[:, :3]
+        reference = request_url_to_dataframe(base_url + '/datastore/pcm/mappm102001.csv', header=5, cache=cache)
+        if reference is None:
+            raise FileNotFoundError(f"Reference grid {base_url}/datastore/pcm/mappm102001.csv not available.")
+        self.reference = reference.iloc[:, :3]
+        self.grid_index = UKGridIndex(self.reference)
 
     def get_tables(self):
         """
@@ -35,7 +59,7 @@ class ScrapeDefraPollution:
             rows = [[elem.text for elem in row.find_all('td')] for row in tab.find_all('tr')]
             refs = tab.find_all('a', href=True)
             refcol = [
-                'https://uk-air.defra.gov.uk' + ref.attrs['href'].replace('..', '') for ref in refs
+                self.base_url + ref.attrs['href'].replace('..', '') for ref in refs
             ]
             dt = pd.DataFrame([x for x in rows if x]).iloc[:, :-1]
             dt['download_link'] = np.asarray(refcol)
@@ -64,18 +88,21 @@ class ScrapeDefraPollution:
 
         ptab = self.get_tables()
 
+        # nearest years of each pollutant for all years at once
+        tables = {p: ptab[ptab['pollutant'] == p] for p in self.pollutants}
+        nearest = {p: NearestValueIndex(tables[p]['year_pollution_data_collected']).nearest_idx(self.years)
+                   for p in self.pollutants}
+
         dt = []
-        for year in self.years:
+        for i, year in enumerate(self.years):
             for p in self.pollutants:
-                pollution_dt = ptab[ptab['pollutant'] == p].copy()
-                indexes = find_nearest_idx(pollution_dt['year_pollution_data_collected'], year)
-                pollution_dt = pollution_dt.iloc[indexes, :]
+                pollution_dt = tables[p].iloc[nearest[p][i], :].copy()
                 pollution_dt.insert(1, 'year_postcode_data_collected', year, allow_duplicates=True)
                 pollution_dt = pollution_dt[
                     (pollution_dt['metric'] == 'Annual mean')
                     | (pollution_dt['metric'] == 'DGT120')]
                 dt.append(pollution_dt)
-        df = pd.concat(dt).replace(r'^\s+$', np.NaN, regex=True)
+        df = pd.concat(dt).replace(r'^\s+$', np.nan, regex=True)
         df = df.reset_index(drop=True)
         return df
 
@@ -87,54 +114,123 @@ class ScrapeDefraPollution:
         :param easting: east co-cordinate in metres.
         :return: grid code (str).
         """
-        try:
-            easting = float(easting)
-            northing = float(northing)
-        except ValueError:
-            return np.nan
-        else:
-            xindex = find_nearest_idx(self.reference.x, easting)
-            if np.isnan(xindex).any():
-                return np.nan
-            else:
-                update_reference = self.reference.iloc[xindex, :]
-                yindex = find_nearest_idx(update_reference.y, northing)
-                if np.isnan(yindex).any():
-                    return np.nan
-                else:
-                    nearest = update_reference.iloc[yindex[0], :]
-                    if abs(nearest['x'] - easting) > 1000:
-                        return np.nan
-                    elif abs(nearest['y'] - northing) > 1000:
-                        return np.nan
-                    else:
-                        return str(nearest['ukgridcode'])
-
-    def linking_func(self, data, idcol):
-        """
-        Function for linking the geocoded participant data with the pollution data.
+        return self.get_nearest_ukgridcodes([easting], [northing])[0]
+
+    def get_nearest_ukgridcodes(self, eastings, northings):
+        """
+        Returns grid codes of the nearest km squares in the British National Grid for whole columns of
+        co-ordinates. Co-ordinates more than 1000 metres from the nearest km square, or that cannot be converted
+        to numbers, return NaN.
+        :param eastings: east co-ordinates in metres.
+        :param northings: north co-ordinates in metres.
+        :return: numpy array of grid codes (str).
+        """
+        return self.grid_index.nearest_codes(eastings, northings)
+
+    def get_download_links(self):
+        """
+        Download links needed for each year of postcode data collection and pollutant.
+        :return: dict of (year, pollutant) to download link.
+        """
+        links = {}
+        for year in self.years:
+            for pollutant in self.pollutants:
+                linksdf = self.pollution_data[
+                    (self.pollution_data['pollutant'] == pollutant)
+                    & (self.pollution_data['year_postcode_data_collected'] == year)]
+                links[(year, pollutant)] = linksdf.iloc[0, 6]
+        return links
+
+    def get_pollution_table(self, link):
+        """
+        Download and parse the pollution data from a download link.
+        :param link: url to csv file with pollution data.
+        :return: pandas DataFrame with columns: ukgridcode (str), x, y and the pollution data.
+        """
+        pollution_df = request_url_to_dataframe(link, header=5, cache=self.cache)
+        pollution_df['ukgridcode'] = pollution_df['ukgridcode'].astype(str)
+        return pollution_df
+
+    def get_cube(self, path, workers=1):
+        """
+        Open the pollution cube at path, (re)building it from the pcm-data tables (all years) of the selected
+        pollutants and the pollutants already in the cube if it does not exist, lacks data needed for the selected
+        years or holds layers of other download links (see PollutionCube.has_layers).
+        :param path: filename of the cube.
+        :param workers: number of threads used to download and parse the pollution data.
+        :return: PollutionCube.
+        """
+        pollutants = set(self.pollutants)
+        if os.path.exists(path) and os.path.exists(path + '.json'):
+            cube = PollutionCube(path)
+            if cube.has_layers(self.pollution_data):
+                return cube
+            # other runs (e.g. the lookup server) sharing the cube keep their pollutants
+            pollutants |= set(cube.pollutants)
+        tables = self.get_tables()
+        tables = tables[tables['pollutant'].isin(pollutants)]
+        return PollutionCube.build(tables, path, cache=self.cache, workers=workers)
+
+    def linking_func(self, data, idcol, workers=1, cube=None, radii=None, shape='circle'):
+        """
+        Function for linking the geocoded participant data with the pollution data. Each distinct download link
+        is fetched once and the files are downloaded and parsed concurrently before merging. If a pollution cube
+        is given the data is read from the cube instead (value of the nearest km square of each postcode), and
+        mean pollution within buffers around each postcode can be added.
         :param idcol: column name for participant ids
         :param data: DataFrame with columns: idcol, year, postcode, easting, northing, country.
+        :param workers: number of threads used to download and parse the pollution data.
+        :param cube: optional PollutionCube (see get_cube).
+        :param radii: optional buffer radii in metres (requires cube), adds columns '<pollutant>_<radius>m'.
+        :param shape: shape of the buffers ('circle' or 'square').
         :return: DataFrame with columns: id_col, year, pollutant,
         """
-        data['ukgridcode'] = [self.get_nearest_ukgridcode(east, north)
-                              for iid, year, poll, east, north, count in data.itertuples(index=False)]
+        if radii and cube is None:
+            raise ValueError("Buffer means require a pollution cube.")
+        # years with data (only their pollution data is downloaded)
+        years = [year for year in self.years if (data['year'] == year).any()]
+        if cube is not None:
+            dfs = []
+            for year in years:
+                df = data[data['year'] == year].copy()
+                for pollutant in self.pollutants:
+                    pollution_year = self.pollution_data[
+                        (self.pollution_data['pollutant'] == pollutant)
+                        & (self.pollution_data['year_postcode_data_collected'] == year)
+                    ].iloc[0, 2]
+                    df[pollutant] = cube.lookup(pollutant, pollution_year, df['eastings'], df['northings'])
+                    if radii:
+                        means = cube.buffer_means(pollutant, pollution_year, df['eastings'], df['northings'], radii,
+                                                  shape)
+                        for radius in radii:
+                            df[f'{pollutant}_{radius:g}m'] = means[radius].to_numpy()
+                dfs.append(df)
+            return pd.concat(dfs)
+
+        data['ukgridcode'] = self.get_nearest_ukgridcodes(data['eastings'], data['northings'])
+
+        links = self.get_download_links()
+        unique_links = list(dict.fromkeys(link for (year, pollutant), link in links.items() if year in years))
+        done = []
+
+        def get_table(link):
+            table = self.get_pollution_table(link)
+            done.append(link)
+            METRICS.progress('pollution downloads', len(done), len(unique_links))
+            return table
+
+        with ThreadPoolExecutor(max_workers=int(workers)) as executor:
+            tables = dict(zip(unique_links, executor.map(get_table, unique_links)))
+
         dfs = []
-        for year in self.years:
+        for year in years:
             df = data[data['year'] == year].copy()
             df['ukgridcode'] = df['ukgridcode'].astype(str)
             for pollutant in self.pollutants:
-                linksdf = self.pollution_data[
-                    (self.pollution_data['pollutant'] == pollutant)
-                    & (self.pollution_data['year_postcode_data_collected'] == year)]
-                link = linksdf.iloc[0, 6]
-                pollution_df = request_url_to_dataframe(link, header=5)
-                pollution_df['ukgridcode'] = pollution_df['ukgridcode'].astype(str)
-                df = df.merge(pollution_df, 'left', 'ukgridcode')
+                df = df.merge(tables[links[(year, pollutant)]], 'left', 'ukgridcode')
                 df = df.drop(['x', 'y'], axis=1)
                 df = df.rename(columns={df.columns[-1]: pollutant})
             dfs.append(df)
         rdata = pd.concat(dfs)
         rdata = rdata.drop('ukgridcode', axis=1)
         return rdata
-
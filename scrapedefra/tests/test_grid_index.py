@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+import pytest
+from geoutils import find_nearest_idx
+from scrapedefra import UKGridIndex
+
+
+def nearest_ukgridcode_scan(reference, easting, northing):
+    """Linear-scan lookup as previously done by ScrapeDefraPollution.get_nearest_ukgridcode."""
+    xindex = find_nearest_idx(reference.x, easting)
+    if np.isnan(xindex).any():
+        return np.nan
+    update_reference = reference.iloc[xindex, :]
+    yindex = find_nearest_idx(update_reference.y, northing)
+    nearest = update_reference.iloc[yindex[0], :]
+    if abs(nearest['x'] - easting) > 1000 or abs(nearest['y'] - northing) > 1000:
+        return np.nan
+    return str(nearest['ukgridcode'])
+
+
+@pytest.fixture
+def reference():
+    rng = np.random.RandomState(0)
+    x, y = np.meshgrid(np.arange(10) * 1000 + 500, np.arange(12) * 1000 + 100500)
+    ref = pd.DataFrame({'x': x.ravel(), 'y': y.ravel()})
+    ref = ref[rng.rand(len(ref)) > 0.3].sample(frac=1, random_state=1)
+    ref.insert(0, 'ukgridcode', np.arange(len(ref)) + 1000)
+    return ref.reset_index(drop=True)
+
+
+class TestUKGridIndex:
+
+    def test_same_as_linear_scan(self, reference):
+        rng = np.random.RandomState(2)
+        eastings = np.r_[rng.randint(-2000, 12000, 500), np.arange(-1000, 12000, 500)]
+        northings = np.r_[rng.randint(98000, 114000, 500), np.full(26, 106000)]
+        expected = [nearest_ukgridcode_scan(reference, e, n) for e, n in zip(eastings, northings)]
+        actual = UKGridIndex(reference).nearest_codes(eastings, northings)
+        assert [str(v) for v in actual] == [str(v) for v in expected]
+
+    def test_invalid_coordinates(self, reference):
+        x, y = reference.loc[0, ['x', 'y']]
+        actual = UKGridIndex(reference).nearest_codes([str(x), 'NaN', 'not_coers_to_number', np.nan],
+                                                      [str(y), 1000, 'not_coers_to_number', y])
+        assert actual[0] == str(reference.loc[0, 'ukgridcode'])
+        assert all(np.isnan(v) for v in actual[1:])
+
+    def test_no_valid_coordinates(self, reference):
+        index = UKGridIndex(reference)
+        assert index.nearest_idx(['Invalid postcode', np.nan], [1000, 'Invalid postcode']).tolist() == [-1, -1]
+        assert len(index.nearest_codes([], [])) == 0
@@ -0,0 +1,59 @@
+import threading
+import pandas as pd
+import pytest
+import geoutils
+import scrapedefra
+
+
+@pytest.fixture
+def sc():
+    """ScrapeDefraPollution built without scraping https://uk-air.defra.gov.uk."""
+    sc = scrapedefra.ScrapeDefraPollution.__new__(scrapedefra.ScrapeDefraPollution)
+    sc.years = ['1998', '1999']
+    sc.pollutants = ['PM10', 'NO2']
+    sc.cache = None
+    sc.pollution_data = pd.DataFrame([
+        ['PM10', '1998', '2001', 'Annual mean', 'pm102001', None, 'mappm102001.csv'],
+        ['NO2', '1998', '2001', 'Annual mean', 'no22001', None, 'mapno22001.csv'],
+        ['PM10', '1999', '2001', 'Annual mean', 'pm102001', None, 'mappm102001.csv'],
+        ['NO2', '1999', '2001', 'Annual mean', 'no22001', None, 'mapno22001.csv']
+    ], columns=['pollutant', 'year_postcode_data_collected', 'year_pollution_data_collected', 'metric',
+                'header_label', 'comments', 'download_link'])
+    sc.reference = pd.DataFrame({'ukgridcode': [1, 2], 'x': [500, 1500], 'y': [500, 500]})
+    sc.grid_index = scrapedefra.UKGridIndex(sc.reference)
+    return sc
+
+
+class TestLinkingFunc:
+
+    def test_links_fetched_once_concurrently(self, sc):
+        fetched = []
+        # both links must be fetched at the same time, by two threads, to pass the barrier
+        barrier = threading.Barrier(2, timeout=10)
+
+        def get_pollution_table(link):
+            fetched.append((link, threading.current_thread().name))
+            barrier.wait()
+            value = 10.0 if 'pm10' in link else 20.0
+            return pd.DataFrame({'ukgridcode': ['1', '2'], 'x': [500, 1500], 'y': [500, 500],
+                                 link[3:-4]: [value, value + 1]})
+
+        sc.get_pollution_table = get_pollution_table
+        data = pd.DataFrame([['a', '1998', 'X', 400, 450, 'England'], ['b', '1999', 'Y', 1600, 300, 'England'],
+                             ['c', '1999', 'Z', 'Invalid postcode', 'Invalid postcode', 'Invalid postcode']],
+                            columns=['id', 'year', 'postcode', 'eastings', 'northings', 'country'])
+        actual = sc.linking_func(data, 'id', workers=2)
+
+        assert sorted(link for link, thread in fetched) == ['mapno22001.csv', 'mappm102001.csv']
+        assert len({thread for link, thread in fetched}) == 2
+        assert actual['id'].tolist() == ['a', 'b', 'c']
+        assert actual['PM10'].tolist()[:2] == [10.0, 11.0] and pd.isna(actual['PM10'].iloc[2])
+        assert actual['NO2'].tolist()[:2] == [20.0, 21.0]
+
+
+class TestOfflineCache:
+
+    def test_missing_pcm_page(self, tmp_path):
+        cache = geoutils.DownloadCache(str(tmp_path), offline=True)
+        with pytest.raises(FileNotFoundError, match='offline mode'):
+            scrapedefra.ScrapeDefraPollution(['2008'], ['PM10'], cache=cache)
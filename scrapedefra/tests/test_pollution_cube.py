@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+import pytest
+import scrapedefra
+from scrapedefra import PollutionCube
+
+
+def fake_request_url_to_dataframe(link, header, cache=None):
+    value = {'mappm102001.csv': 10.0, 'mappm102008g.csv': 20.0, 'mapno22008.csv': 30.0}[link]
+    return pd.DataFrame({'ukgridcode': [1, 2, 3], 'x': [500, 1500, 458500], 'y': [500, 500, 1220500],
+                         link[3:-4]: [value, value + 1, 'MISSING']})
+
+
+@pytest.fixture
+def tables():
+    return pd.DataFrame([
+        ['PM10', '2001', 'Annual mean', 'pm102001', 'TEOM units', 'mappm102001.csv'],
+        ['PM10', '2008', 'Annual mean', 'pm102008g', 'Gravimetric units', 'mappm102008g.csv'],
+        ['PM10', '2008', 'Days > 50', 'pm102008d', np.nan, 'mappm102008d.csv'],
+        ['NO2', '2008', 'Annual mean', 'no22008', np.nan, 'mapno22008.csv']
+    ], columns=['pollutant', 'year_pollution_data_collected', 'metric', 'header_label', 'comments',
+                'download_link'])
+
+
+@pytest.fixture
+def cube(tables, tmp_path, monkeypatch):
+    monkeypatch.setattr(scrapedefra.pollution_cube, 'request_url_to_dataframe', fake_request_url_to_dataframe)
+    PollutionCube.build(tables, str(tmp_path / 'pcm.npy'), workers=2)
+    return PollutionCube(str(tmp_path / 'pcm.npy'))
+
+
+class TestPollutionCube:
+
+    def test_layout(self, cube):
+        assert cube.pollutants == ['NO2', 'PM10'] and cube.years == ['2001', '2008']
+        assert cube.cube.shape == (2, 2, 1300, 700) and cube.cube.dtype == np.float32
+        assert isinstance(cube.cube, np.memmap)
+        assert cube.layers[('PM10', '2008')]['comments'] == 'Gravimetric units'
+        assert ('NO2', '2001') not in cube.layers
+
+    def test_lookup(self, cube):
+        actual = cube.lookup('PM10', 2008, [10, '1999', 'Invalid postcode', -5, 458000, 2500, 3000, 500],
+                             [999, 0, 'Invalid postcode', 10, 1220000, 500, 500, 1600])
+        np.testing.assert_array_equal(actual, [20, 21, np.nan, 20, np.nan, 21, np.nan, np.nan])
+        assert cube.squares.sum() == 3
+
+    def test_lookup_nearest_square_as_csv(self, cube):
+        # same km squares as the nearest grid codes of the reference grid used with the csv files
+        reference = fake_request_url_to_dataframe('mappm102008g.csv', 5)
+        index = scrapedefra.UKGridIndex(reference)
+        rng = np.random.default_rng(0)
+        eastings = np.r_[rng.uniform(-1500, 4000, 500), rng.uniform(456000, 461000, 100)]
+        northings = np.r_[rng.uniform(-1500, 3000, 500), rng.uniform(1218000, 1223000, 100)]
+        expected = reference.iloc[:, 3].replace('MISSING', np.nan).astype(float).to_numpy()
+        idx = index.nearest_idx(eastings, northings)
+        expected = np.where(idx >= 0, expected[np.maximum(idx, 0)], np.nan)
+        np.testing.assert_array_equal(cube.lookup('PM10', '2008', eastings, northings), expected)
+
+    def test_missing_layer(self, cube):
+        with pytest.raises(KeyError):
+            cube.lookup('NO2', '2001', [500], [500])
+
+    def test_linking_func(self, cube):
+        sc = scrapedefra.ScrapeDefraPollution.__new__(scrapedefra.ScrapeDefraPollution)
+        sc.years, sc.pollutants = ['1998', '2008'], ['PM10']
+        sc.pollution_data = pd.DataFrame([
+            ['PM10', '1998', '2001', 'Annual mean', 'pm102001', None, 'mappm102001.csv'],
+            ['PM10', '2008', '2008', 'Annual mean', 'pm102008g', None, 'mappm102008g.csv']
+        ], columns=['pollutant', 'year_postcode_data_collected', 'year_pollution_data_collected', 'metric',
+                    'header_label', 'comments', 'download_link'])
+        assert cube.has_layers(sc.pollution_data)
+        data = pd.DataFrame([['a', '2008', 'X', 400, 450, 'England'], ['b', '1998', 'Y', 1600, 300, 'England']],
+                            columns=['id', 'year', 'postcode', 'eastings', 'northings', 'country'])
+        actual = sc.linking_func(data, 'id', cube=cube)
+        assert actual['id'].tolist() == ['b', 'a'] and actual['PM10'].tolist() == [11.0, 20.0]
+
+    def test_has_layers_of_same_links(self, cube):
+        pollution_data = pd.DataFrame([
+            ['PM10', '2008', '2008', 'Annual mean', 'pm102008g', None, 'mappm102008g.csv'],
+            ['NO2', '2008', '2008', 'Annual mean', 'no22008', None, 'mapno22008.csv']
+        ], columns=['pollutant', 'year_postcode_data_collected', 'year_pollution_data_collected', 'metric',
+                    'header_label', 'comments', 'download_link'])
+        assert cube.has_layers(pollution_data)
+        revised = pollution_data.replace('mapno22008.csv', 'mapno22008v2.csv')
+        assert not cube.has_layers(revised)
+        assert not cube.has_layers(pollution_data.replace('Annual mean', 'DGT120'))
+
+    def test_get_cube_keeps_other_pollutants(self, cube, tables):
+        sc = scrapedefra.ScrapeDefraPollution.__new__(scrapedefra.ScrapeDefraPollution)
+        sc.pollutants, sc.cache = ['PM10'], None
+        sc.pollution_data = pd.DataFrame([
+            ['PM10', '2008', '2008', 'Annual mean', 'pm102008g', None, 'mappm102008g.csv']
+        ], columns=['pollutant', 'year_postcode_data_collected', 'year_pollution_data_collected', 'metric',
+                    'header_label', 'comments', 'download_link'])
+        sc.get_tables = lambda: tables
+        assert sc.get_cube(cube.path).layers == cube.layers
+        # PM10 revised: rebuilt with the NO2 layers of the cube
+        sc.pollution_data['download_link'] = 'mappm102001.csv'
+        rebuilt = sc.get_cube(cube.path)
+        assert rebuilt.pollutants == ['NO2', 'PM10'] and ('NO2', '2008') in rebuilt.layers
+
+    def test_buffer_means(self, cube):
+        actual = cube.buffer_means('PM10', '2008', [500, 500, 'Invalid postcode'], [500, 2500, 'Invalid postcode'],
+                                   [0, 1000, 2000])
+        np.testing.assert_allclose(actual.to_numpy(), [[20, 20.5, 20.5], [np.nan, np.nan, 20],
+                                                      [np.nan, np.nan, np.nan]])
+        assert ('PM10', '2008') in cube.tables
@@ -0,0 +1,121 @@
+import threading
+import numpy as np
+import pandas as pd
+import pytest
+import rasterio
+import requests
+from rasterio.transform import from_origin
+import scrapedefra
+from scrapedefra import PollutionCube
+import lookup_server
+from lookup_server import LookupService, serve
+
+
+def fake_request_url_to_dataframe(link, header, cache=None):
+    value = {'mappm102001.csv': 10.0, 'mappm102008g.csv': 20.0, 'mapno22008.csv': 30.0}[link]
+    return pd.DataFrame({'ukgridcode': [1, 2], 'x': [500, 1500], 'y': [500, 500], link[3:-4]: [value, value + 1]})
+
+
+@pytest.fixture
+def cube(tmp_path, monkeypatch):
+    monkeypatch.setattr(scrapedefra.pollution_cube, 'request_url_to_dataframe', fake_request_url_to_dataframe)
+    tables = pd.DataFrame([
+        ['PM10', '2001', 'Annual mean', 'pm102001', np.nan, 'mappm102001.csv'],
+        ['PM10', '2008', 'Annual mean', 'pm102008g', np.nan, 'mappm102008g.csv'],
+        ['NO2', '2008', 'Annual mean', 'no22008', np.nan, 'mapno22008.csv']
+    ], columns=['pollutant', 'year_pollution_data_collected', 'metric', 'header_label', 'comments',
+                'download_link'])
+    path = str(tmp_path / 'pcm.npy')
+    PollutionCube.build(tables, path)
+    return path
+
+
+@pytest.fixture
+def land_cover(tmp_path):
+    data = np.full((3, 3), 7, dtype=np.int16)
+    data[0, 0] = -1
+    path = str(tmp_path / 'class_1.tif')
+    with rasterio.open(path, 'w', driver='GTiff', height=3, width=3, count=1, dtype='int16', crs='EPSG:27700',
+                       transform=from_origin(0, 3000, 1000, 1000), nodata=-1) as dst:
+        dst.write(data, 1)
+    return [path], ['LCM_TargetClass_1']
+
+
+@pytest.fixture
+def server(cube):
+    service = LookupService(cube=cube, pollutants=['PM10', 'NO2'], radii=[1000])
+    httpd = serve(service, port=0)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_port}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+class TestLookupService:
+
+    def test_nearest_year(self, cube):
+        service = LookupService(cube=cube, pollutants=['PM10', 'NO2'])
+        actual = service.lookup({'eastings': [500, 1500, 600], 'northings': [500, 500, 400],
+                                 'years': [2003, 2006, 1990]})
+        assert actual['PM10'].tolist() == [10.0, 21.0, 10.0]
+        assert actual['NO2'].tolist() == [30.0, 31.0, 30.0]
+
+    def test_buffer_columns(self, cube):
+        service = LookupService(cube=cube, pollutants=['PM10', 'NO2'], radii=[1000, 2500])
+        actual = service.lookup({'eastings': [500, 1500], 'northings': [500, 500], 'year': 2008})
+        assert actual.columns.tolist() == ['year', 'eastings', 'northings', 'PM10', 'PM10_1000m', 'PM10_2500m',
+                                           'NO2', 'NO2_1000m', 'NO2_2500m']
+        expected = PollutionCube(cube).buffer_means('PM10', '2008', [500, 1500], [500, 500], [1000, 2500])
+        np.testing.assert_allclose(actual['PM10_1000m'], expected[1000])
+        np.testing.assert_allclose(actual['PM10_2500m'], expected[2500])
+
+    def test_invalid_coordinates(self, cube):
+        service = LookupService(cube=cube, pollutants=['PM10'], radii=[1000])
+        actual = service.lookup({'eastings': ['Invalid postcode', 500, 900000], 'northings': [None, 500, 500],
+                                 'year': 2008})
+        assert np.isnan(actual['PM10'][0]) and actual['PM10'][1] == 20.0 and np.isnan(actual['PM10'][2])
+        assert np.isnan(actual['PM10_1000m'][0])
+
+    def test_pollutant_without_data(self, cube, monkeypatch):
+        class ScrapeDefraPollution:
+            def __init__(self, years, pollutants, cache=None):
+                pass
+
+            def get_cube(self, path, workers=1):
+                return PollutionCube(path)
+
+        monkeypatch.setattr(lookup_server.scrapedefra, 'ScrapeDefraPollution', ScrapeDefraPollution)
+        with pytest.raises(ValueError, match='SO2'):
+            LookupService(cube=cube, pollutants=['PM10', 'SO2'])
+
+    def test_land_cover_nodata(self, land_cover):
+        service = LookupService(land_cover=land_cover)
+        actual = service.link(pd.DataFrame({'eastings': [500, 1500, 5000], 'northings': [2500, 2500, 500]}))
+        assert actual['LCM_TargetClass_1'].tolist()[:2] == [-1, 7] and np.isnan(actual['LCM_TargetClass_1'][2])
+
+
+class TestServer:
+
+    def test_health(self, server):
+        response = requests.get(server + '/health')
+        assert response.status_code == 200
+        assert response.json() == {'status': 'ok', 'datasets': ['pollution']}
+
+    def test_link(self, server):
+        response = requests.post(server + '/link', json={'eastings': [500, 'x'], 'northings': [500, 500],
+                                                         'years': [2001, 2008]})
+        assert response.status_code == 200
+        records = response.json()
+        assert records[0]['PM10'] == 10.0 and records[0]['NO2'] == 30.0 and 'PM10_1000m' in records[0]
+        assert records[1]['PM10'] is None
+
+    def test_years_length_mismatch(self, server):
+        response = requests.post(server + '/link', json={'eastings': [500, 1500], 'northings': [500, 500],
+                                                         'years': [2008]})
+        assert response.status_code == 400 and response.json()['error'].startswith('ValueError')
+
+    def test_bad_request(self, server):
+        assert requests.post(server + '/link', json={'year': 2008}).status_code == 400
+        assert requests.post(server + '/link', data=b'not json').status_code == 400
+        assert requests.get(server + '/other').status_code == 404